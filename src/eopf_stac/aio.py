@@ -0,0 +1,436 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+from collections.abc import Mapping
+from functools import partial
+from io import BytesIO
+from typing import Callable, Iterable
+from urllib.parse import urlparse
+
+import aiohttp
+import fsspec
+import pystac
+import s3fs
+from pystac.utils import now_in_utc
+
+from eopf_stac.batch import (
+    STATUS_FAILED,
+    STATUS_SKIPPED,
+    STATUS_SUCCESS,
+    CdseLookup,
+    ProductResult,
+    log_result,
+    record_result,
+    resolve_source_scenes,
+)
+from eopf_stac.cdse_cache import CdseCache
+from eopf_stac.common.constants import CDSE_STAC_API_URL, CONTENT_HASH_PROPERTY, PRODUCT_METADATA_PATH
+from eopf_stac.common.filesystem import get_s3_config_kwargs, unregister_ceph_handler
+from eopf_stac.common.http_client import get_http_settings
+from eopf_stac.common.metadata import (
+    ROOT_ATTRIBUTES_KEY,
+    ZARR_JSON_KEY,
+    LazyMetadata,
+    load_consolidated_metadata,
+    load_zarr_json_metadata,
+)
+from eopf_stac.common.serialization import json_body
+from eopf_stac.common.stac import (
+    compute_metadata_hash,
+    get_cdse_link_href,
+    set_content_hash,
+    validate_metadata,
+    validate_root_attributes,
+)
+from eopf_stac.io import (
+    API_ACTION_INSERTED,
+    API_ACTION_UNCHANGED,
+    API_ACTION_UPDATED,
+    CdseItemNotFoundError,
+    create_item,
+    get_product_type,
+    get_product_type_from_href,
+    get_self_href_from_search_response,
+    get_source_identifier,
+    read_consolidated_metadata,
+    read_metadata,
+    requires_array_attributes,
+)
+from eopf_stac.journal import BatchJournal
+from eopf_stac.metadata_cache import MetadataCache, get_metadata_cache
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPipeline:
+    """Creates and registers the STAC items of many products concurrently in a single process.
+
+    The product metadata is read with the async API of s3fs, the requests to the CDSE and the
+    STAC Transactions API are sent with aiohttp. At most `concurrency` products are in flight at any time.
+    Must be used as async context manager.
+    """
+
+    def __init__(
+        self,
+        stac_api_url: str | None = None,
+        concurrency: int = 100,
+        cdse_stac_api_url: str = CDSE_STAC_API_URL,
+        skip_unchanged: bool = False,
+        cdse_cache: CdseCache | None = None,
+        cdse_offline: bool = False,
+        metadata_cache: MetadataCache | None = None,
+    ) -> None:
+        self.stac_api_url = stac_api_url
+        self.skip_unchanged = skip_unchanged
+        self.cdse_cache = cdse_cache
+        self.cdse_offline = cdse_offline
+        self.metadata_cache = metadata_cache if metadata_cache is not None else get_metadata_cache()
+        self.concurrency = concurrency
+        self.cdse_stac_api_url = cdse_stac_api_url
+        self.settings = get_http_settings()
+        self.session: aiohttp.ClientSession | None = None
+        self.auth = None
+        if "STAC_INGEST_USER" in os.environ and "STAC_INGEST_PASS" in os.environ:
+            self.auth = aiohttp.BasicAuth(os.environ["STAC_INGEST_USER"], os.environ["STAC_INGEST_PASS"])
+        self._filesystems: dict[str, tuple[s3fs.S3FileSystem, object]] = {}
+        self._filesystems_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=self.settings.connect_timeout, sock_read=self.settings.read_timeout
+        )
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency), timeout=timeout, raise_for_status=False
+        )
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+        for _, client in self._filesystems.values():
+            await client.close()
+        self._filesystems.clear()
+
+    def get_s3_config_kwargs(self) -> dict:
+        # all products in flight may read from the same endpoint
+        return {**get_s3_config_kwargs(), "max_pool_connections": max(self.concurrency, self.settings.pool_size)}
+
+    async def get_filesystem(self, href: str) -> tuple[s3fs.S3FileSystem | None, str]:
+        """Returns the async filesystem and the path within this filesystem. Local files have no async filesystem."""
+        if href.startswith("s3://"):
+            key = "s3"
+            path = href
+        elif href.startswith("http"):
+            o = urlparse(href)
+            key = f"{o.scheme}://{o.netloc}"
+            path = o.path
+        else:
+            return (None, href)
+
+        async with self._filesystems_lock:
+            if key not in self._filesystems:
+                if key == "s3":
+                    fs = s3fs.S3FileSystem(
+                        anon=False,
+                        endpoint_url=os.environ["S3_ENDPOINT_URL"],
+                        config_kwargs=self.get_s3_config_kwargs(),
+                        asynchronous=True,
+                        skip_instance_cache=True,
+                    )
+                    client = await fs.set_session()
+                else:
+                    fs = s3fs.S3FileSystem(
+                        anon=True,
+                        client_kwargs={"endpoint_url": key},
+                        config_kwargs=self.get_s3_config_kwargs(),
+                        asynchronous=True,
+                        skip_instance_cache=True,
+                    )
+                    client = await fs.set_session()
+                    # unregister handler to make boto3 work with CEPH
+                    unregister_ceph_handler(client)
+                self._filesystems[key] = (fs, client)
+
+        return (self._filesystems[key][0], path)
+
+    async def read_metadata(self, eopf_href: str) -> Mapping:
+        """Reads the root attributes of the product and the consolidated metadata only if the item builder
+        of the product type needs the attributes of groups and arrays"""
+        if self.metadata_cache is not None:
+            # the consolidated metadata is loaded lazily in the thread of create_item, if needed
+            return await asyncio.to_thread(read_metadata, eopf_href, metadata_cache=self.metadata_cache)
+
+        fs, product_path = await self.get_filesystem(eopf_href)
+        product_type = get_product_type_from_href(eopf_href)
+        if product_type is not None and requires_array_attributes(product_type):
+            # the consolidated metadata is needed anyway, the root attributes are not read separately
+            try:
+                data = await self.cat_file(fs, os.path.join(product_path, PRODUCT_METADATA_PATH))
+                return validate_metadata(load_consolidated_metadata(BytesIO(data)))
+            except FileNotFoundError:
+                logger.debug(f"No {PRODUCT_METADATA_PATH} found for {eopf_href}, reading {ZARR_JSON_KEY}")
+                data = await self.cat_file(fs, os.path.join(product_path, ZARR_JSON_KEY))
+                return validate_metadata(load_zarr_json_metadata(BytesIO(data)), source=ZARR_JSON_KEY)
+
+        try:
+            data = await self.cat_file(fs, os.path.join(product_path, ROOT_ATTRIBUTES_KEY))
+            root_attributes = validate_root_attributes(json.loads(data))
+            if not requires_array_attributes(get_product_type({ROOT_ATTRIBUTES_KEY: root_attributes})):
+                return LazyMetadata(root_attributes, partial(read_consolidated_metadata, eopf_href))
+        except FileNotFoundError:
+            logger.debug(f"No {ROOT_ATTRIBUTES_KEY} found for {eopf_href}")
+            try:
+                data = await self.cat_file(fs, os.path.join(product_path, ZARR_JSON_KEY))
+                return validate_metadata(load_zarr_json_metadata(BytesIO(data)), source=ZARR_JSON_KEY)
+            except FileNotFoundError:
+                logger.debug(f"No {ZARR_JSON_KEY} found for {eopf_href}, reading {PRODUCT_METADATA_PATH}")
+
+        data = await self.cat_file(fs, os.path.join(product_path, PRODUCT_METADATA_PATH))
+        return validate_metadata(load_consolidated_metadata(BytesIO(data)))
+
+    async def cat_file(self, fs: s3fs.S3FileSystem | None, path: str) -> bytes:
+        if fs is None:
+            return await asyncio.to_thread(fsspec.filesystem("file").cat_file, path)
+        return await fs._cat_file(path)
+
+    async def get_cdse_stac_item_url(self, scene_id: str) -> str:
+        async with self.session.get(url=f"{self.cdse_stac_api_url}/search", params={"ids": scene_id}) as response:
+            response.raise_for_status()
+            return get_self_href_from_search_response(await response.json(), scene_id)
+
+    async def get_source_stac_item_url(self, source_scene_id: str) -> str | None:
+        source_stac_item_url = None
+        try:
+            source_stac_item_url = await self.get_cdse_stac_item_url(source_scene_id)
+            if self.cdse_cache is not None:
+                self.cdse_cache.put(source_scene_id, source_stac_item_url)
+        except CdseItemNotFoundError as e:
+            logger.warning(str(e))
+            if self.cdse_cache is not None:
+                self.cdse_cache.put(source_scene_id, None)
+        except Exception as e:
+            logger.warning(str(e))
+        return source_stac_item_url
+
+    async def register_item(self, item: pystac.Item) -> str:
+        """Inserts or updates the STAC item in the catalog and returns the action taken"""
+        logger.info(f"Inserting STAC item into catalog {self.stac_api_url} ...")
+
+        item.remove_links("self")
+        items_url = f"{self.stac_api_url}/collections/{item.collection_id}/items"
+
+        # the dictionary of the item is built once and updated along with the item
+        item_dict = item.to_dict()
+        exists = False
+        if self.skip_unchanged:
+            content_hash = set_content_hash(item, item_dict)
+            async with self.session.get(f"{items_url}/{item.id}", auth=self.auth) as response:
+                if response.status == 200:
+                    exists = True
+                    existing = await response.json()
+                    if existing.get("properties", {}).get(CONTENT_HASH_PROPERTY) == content_hash:
+                        logger.info(f"STAC item {item.id} in collection {item.collection_id} is unchanged")
+                        return API_ACTION_UNCHANGED
+                elif response.status != 404:
+                    response.raise_for_status()
+
+        api_action = API_ACTION_INSERTED
+        if not exists:
+            async with self.session.post(items_url, **json_body(item_dict), auth=self.auth) as response:
+                exists = response.status == 409
+                if not exists:
+                    response.raise_for_status()
+        if exists:
+            # STAC item already exists -> update
+            item.common_metadata.updated = now_in_utc()
+            item_dict["properties"]["updated"] = item.properties["updated"]
+            api_action = API_ACTION_UPDATED
+            async with self.session.put(f"{items_url}/{item.id}", **json_body(item_dict), auth=self.auth) as response:
+                response.raise_for_status()
+
+        logger.info(f"Successfully {api_action} STAC item {item.id} in collection {item.collection_id}")
+
+        return api_action
+
+    async def process_product(
+        self,
+        url: str,
+        source_uri: str | None = None,
+        cdse_lookup: CdseLookup | None = None,
+        journal_hash: str | None = None,
+    ) -> ProductResult:
+        try:
+            return await asyncio.wait_for(
+                self._process_product(url, source_uri, cdse_lookup, journal_hash), self.settings.product_timeout
+            )
+        except asyncio.TimeoutError:
+            error = f"Processing did not finish within {self.settings.product_timeout} seconds"
+            logger.error(f"Failed to process {url}: {error}")
+            return ProductResult(url=url, status=STATUS_FAILED, error=error)
+
+    async def _process_product(
+        self,
+        url: str,
+        source_uri: str | None = None,
+        cdse_lookup: CdseLookup | None = None,
+        journal_hash: str | None = None,
+    ) -> ProductResult:
+        try:
+            metadata = await self.read_metadata(url)
+            metadata_hash = compute_metadata_hash(metadata)
+            if journal_hash is not None and metadata_hash == journal_hash:
+                return ProductResult(url=url, status=STATUS_SKIPPED, metadata_hash=metadata_hash)
+
+            cdse_scene_href = None
+            cdse_cache_hit = None
+            if cdse_lookup is not None:
+                cdse_scene_href = cdse_lookup.href
+                cdse_cache_hit = cdse_lookup.cache_hit
+            elif source_uri is not None and len(source_uri) > 0 and not self.cdse_offline:
+                scene_id = get_source_identifier(source_uri)
+                if self.cdse_cache is not None:
+                    cdse_cache_hit, cdse_scene_href = self.cdse_cache.get(scene_id)
+                if not cdse_cache_hit:
+                    cdse_scene_href = await self.get_source_stac_item_url(scene_id)
+
+            logger.info(f"Creating STAC item for {url} ...")
+            # the item builders may block, e.g. reading coordinates from the Zarr data, loading the consolidated
+            # metadata or using the geometry cache, so they must not run on the event loop
+            item = await asyncio.to_thread(
+                create_item,
+                metadata=metadata,
+                eopf_href=url,
+                source_uri=source_uri,
+                cdse_resolver=lambda _: cdse_scene_href,
+                cdse_offline=self.cdse_offline,
+            )
+            action = None
+            if self.stac_api_url is not None:
+                action = await self.register_item(item)
+            return ProductResult(
+                url=url,
+                status=STATUS_SUCCESS,
+                item_id=item.id,
+                collection_id=item.collection_id,
+                action=action,
+                metadata_hash=metadata_hash,
+                cdse_cache_hit=cdse_cache_hit,
+                cdse_href=get_cdse_link_href(item),
+            )
+        except Exception as e:
+            logger.error(f"Failed to process {url}: {str(e)}")
+            return ProductResult(url=url, status=STATUS_FAILED, error=str(e))
+
+    async def run(
+        self,
+        products: Iterable[tuple],
+        on_result: Callable[[ProductResult], None] | None = None,
+        get_journal_hash: Callable[[str], str | None] | None = None,
+    ) -> list[ProductResult]:
+        """Processes all products and returns the result of each product in order of completion.
+
+        Each product is given as (url, source_uri) or (url, source_uri, cdse_lookup) tuple.
+
+        The products iterable is consumed lazily and may block (e.g. a product discovery generator),
+        so the next product is fetched in a separate thread. on_result is called with each result.
+        get_journal_hash returns the metadata hash of a product recorded in a previous run, products whose
+        metadata is unchanged are skipped and not part of the returned results.
+        """
+        results = []
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        async def process(url: str, source_uri: str | None, cdse_lookup: CdseLookup | None = None):
+            try:
+                journal_hash = get_journal_hash(url) if get_journal_hash is not None else None
+                result = await self.process_product(url, source_uri, cdse_lookup, journal_hash)
+                if result.status != STATUS_SKIPPED:
+                    results.append(result)
+                    log_result(result, len(results))
+                if on_result is not None:
+                    on_result(result)
+            finally:
+                semaphore.release()
+
+        iterator = iter(products)
+        while True:
+            await semaphore.acquire()
+            product = await asyncio.to_thread(next, iterator, None)
+            if product is None:
+                semaphore.release()
+                break
+            task = asyncio.create_task(process(*product))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if len(tasks) > 0:
+            await asyncio.wait(tasks)
+
+        return results
+
+
+def run_async_batch(
+    products: Iterable[tuple[str, str | None]],
+    concurrency: int = 100,
+    stac_api_url: str | None = None,
+    skip_unchanged: bool = False,
+    cdse_cache: CdseCache | None = None,
+    cdse_batch_size: int = 0,
+    cdse_offline: bool = False,
+    journal: BatchJournal | None = None,
+) -> list[ProductResult]:
+    if journal is not None:
+        products = journal.filter(products)
+    if cdse_batch_size > 0 and not cdse_offline:
+        products = resolve_source_scenes(products, chunk_size=cdse_batch_size, cdse_cache=cdse_cache)
+
+    async def run():
+        async with AsyncPipeline(
+            stac_api_url=stac_api_url,
+            concurrency=concurrency,
+            skip_unchanged=skip_unchanged,
+            cdse_cache=cdse_cache,
+            cdse_offline=cdse_offline,
+        ) as pipeline:
+            if journal is None:
+                return await pipeline.run(products)
+            return await pipeline.run(
+                products, on_result=partial(record_result, journal), get_journal_hash=journal.get_metadata_hash
+            )
+
+    return asyncio.run(run())
+
+
+async def verify_links(hrefs: list[str], concurrency: int = 10) -> list[str]:
+    """Requests all links concurrently and returns the ones which do not resolve"""
+    settings = get_http_settings()
+    timeout = aiohttp.ClientTimeout(sock_connect=settings.connect_timeout, sock_read=settings.read_timeout)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+
+        async def verify(href: str) -> bool:
+            async with semaphore:
+                try:
+                    async with session.get(href) as response:
+                        return response.status == 200
+                except Exception as e:
+                    logger.debug(f"Failed to request {href}: {str(e)}")
+                    return False
+
+        valid = await asyncio.gather(*[verify(href) for href in hrefs])
+
+    return [href for href, is_valid in zip(hrefs, valid) if not is_valid]
+
+
+def verify_cdse_links(hrefs: list[str], fraction: float, concurrency: int = 10) -> list[str]:
+    """Verifies a random sample of the given fraction of the links to CDSE and returns the broken ones"""
+    sample = random.sample(hrefs, k=min(len(hrefs), math.ceil(len(hrefs) * fraction)))
+    logger.info(f"Verifying {len(sample)} of {len(hrefs)} links to CDSE ...")
+    broken = asyncio.run(verify_links(sample, concurrency=concurrency))
+    for href in broken:
+        logger.warning(f"Link to CDSE STAC item {href} is broken")
+    logger.info(f"Verified {len(sample)} links to CDSE: {len(broken)} broken")
+    return broken
@@ -0,0 +1,341 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
+from itertools import islice
+from typing import Iterable, Iterator
+
+from eopf_stac.cdse_cache import CdseCache
+from eopf_stac.common.http_client import deadline, get_http_settings
+from eopf_stac.common.stac import compute_metadata_hash, get_cdse_link_href
+from eopf_stac.io import (
+    create_item,
+    get_cdse_stac_item_urls,
+    get_source_identifier,
+    get_source_stac_item_url,
+    read_metadata,
+    upsert_item,
+)
+from eopf_stac.item_stream import ItemWriter
+from eopf_stac.journal import BatchJournal
+
+logger = logging.getLogger(__name__)
+
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+# completed in a previous run and the metadata is unchanged
+STATUS_SKIPPED = "skipped"
+
+# seconds between the checks of the flush interval of the writer while waiting for the workers
+WRITER_CHECK_INTERVAL = 1.0
+
+
+@dataclass
+class ProductResult:
+    url: str
+    status: str
+    item_id: str | None = None
+    collection_id: str | None = None
+    error: str | None = None
+    action: str | None = None
+    metadata_hash: str | None = None
+    cdse_cache_hit: bool | None = None
+    cdse_href: str | None = None
+    item: dict | None = None
+
+
+@dataclass
+class CdseLookup:
+    """Result of the lookup of the source scene of a product at CDSE done before the product is processed"""
+
+    href: str | None
+    cache_hit: bool | None = None
+
+
+def read_manifest(path: str) -> Iterator[tuple[str, str | None]]:
+    """Yields (url, source_uri) tuples from a manifest file.
+
+    Each line contains the URL of an EOPF product, optionally followed by the source URI separated by whitespace.
+    Empty lines and lines starting with '#' are ignored.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            parts = line.split()
+            url = parts[0]
+            source_uri = parts[1] if len(parts) > 1 else None
+            yield (url, source_uri)
+
+
+def process_product(
+    url: str,
+    source_uri: str | None = None,
+    stac_api_url: str | None = None,
+    return_item: bool = False,
+    skip_unchanged: bool = False,
+    cdse_cache: CdseCache | None = None,
+    cdse_lookup: CdseLookup | None = None,
+    cdse_offline: bool = False,
+    journal_hash: str | None = None,
+) -> ProductResult:
+    """Creates the STAC item for a single product and registers it, if a STAC API URL is given.
+
+    All requests for the product must be finished within the product timeout of the HTTP settings, if set.
+    With return_item the STAC item is returned as dict in the result, e.g. to write it in bulk afterwards.
+    If journal_hash, the metadata hash recorded in a previous run, matches the hash of the current metadata,
+    the product is skipped.
+    Errors are not raised but reported in the returned result, so that one broken product does not stop a batch.
+    """
+
+    def cdse_resolver(scene_id: str) -> str | None:
+        if cdse_lookup is not None:
+            # the source scene has already been looked up together with the ones of other products
+            return cdse_lookup.href
+        return get_source_stac_item_url(scene_id, cache=cdse_cache)
+
+    try:
+        cache_stats = cdse_cache.stats() if cdse_cache is not None else None
+        with deadline(get_http_settings().product_timeout):
+            metadata = read_metadata(url)
+            metadata_hash = compute_metadata_hash(metadata)
+            if journal_hash is not None and metadata_hash == journal_hash:
+                return ProductResult(url=url, status=STATUS_SKIPPED, metadata_hash=metadata_hash)
+            logger.info(f"Creating STAC item for {url} ...")
+            item = create_item(
+                metadata=metadata,
+                eopf_href=url,
+                source_uri=source_uri,
+                cdse_resolver=cdse_resolver,
+                cdse_offline=cdse_offline,
+            )
+            action = None
+            if stac_api_url is not None:
+                action = upsert_item(item=item, stac_api_url=stac_api_url, skip_unchanged=skip_unchanged)
+        return ProductResult(
+            url=url,
+            status=STATUS_SUCCESS,
+            item_id=item.id,
+            collection_id=item.collection_id,
+            action=action,
+            metadata_hash=metadata_hash,
+            cdse_cache_hit=get_cache_hit(cdse_cache, cache_stats, cdse_lookup),
+            cdse_href=get_cdse_link_href(item),
+            item=item.to_dict() if return_item else None,
+        )
+    except Exception as e:
+        logger.error(f"Failed to process {url}: {str(e)}")
+        return ProductResult(url=url, status=STATUS_FAILED, error=str(e))
+
+
+def run_batch(
+    products: Iterable[tuple[str, str | None]],
+    jobs: int = 1,
+    stac_api_url: str | None = None,
+    writer: ItemWriter | None = None,
+    skip_unchanged: bool = False,
+    cdse_cache: CdseCache | None = None,
+    cdse_batch_size: int = 0,
+    cdse_offline: bool = False,
+    journal: BatchJournal | None = None,
+) -> list[ProductResult]:
+    """Processes all products and returns the result of each product in order of completion.
+
+    With jobs > 1 the products are distributed over a pool of worker processes. The products iterable is
+    consumed lazily, so it may be a generator which is still producing URLs while the first products are processed.
+    If a writer is given, the STAC items are not registered by the workers but passed to the writer.
+    With cdse_batch_size > 0 the source scenes are looked up at CDSE for chunks of products at once.
+    With a journal, the products completed in previous runs are skipped unless their metadata hash changed, and
+    the result of each product is recorded. Skipped products are not part of the returned results.
+    The results of items passed to a writer are recorded once the writer has written them.
+    """
+    if journal is not None:
+        products = journal.filter(products)
+    if cdse_batch_size > 0 and not cdse_offline:
+        products = resolve_source_scenes(products, chunk_size=cdse_batch_size, cdse_cache=cdse_cache)
+    else:
+        products = ((url, source_uri, None) for url, source_uri in products)
+
+    if writer is not None:
+        process = partial(
+            process_product, stac_api_url=None, return_item=True, cdse_cache=cdse_cache, cdse_offline=cdse_offline
+        )
+    else:
+        process = partial(
+            process_product,
+            stac_api_url=stac_api_url,
+            skip_unchanged=skip_unchanged,
+            cdse_cache=cdse_cache,
+            cdse_offline=cdse_offline,
+        )
+    results = []
+    written: dict[tuple[str, str], ProductResult] = {}
+
+    def mark_failed(failed: list[tuple[dict, str]]):
+        for item, error in failed:
+            result = written.pop((item["collection"], item["id"]), None)
+            if result is None:
+                continue
+            result.status = STATUS_FAILED
+            result.error = error
+            logger.info(f"Failed to write STAC item of {result.url}")
+            if journal is not None:
+                record_result(journal, result)
+
+    def mark_written(keys: list[tuple[str, str]]):
+        for key in keys:
+            result = written.pop(key, None)
+            if result is not None and journal is not None:
+                record_result(journal, result)
+
+    if writer is not None:
+        writer.on_written = mark_written
+
+    def collect(result: ProductResult):
+        if result.status == STATUS_SKIPPED:
+            record_result(journal, result)
+            return
+        results.append(result)
+        log_result(result, len(results))
+        if journal is not None and (writer is None or result.item is None):
+            record_result(journal, result)
+        if writer is not None and result.item is not None:
+            written[(result.collection_id, result.item_id)] = result
+            item = result.item
+            result.item = None
+            mark_failed(writer.add(item))
+
+    def get_journal_hash(url: str) -> str | None:
+        return journal.get_metadata_hash(url) if journal is not None else None
+
+    if jobs <= 1:
+        for url, source_uri, cdse_lookup in products:
+            collect(process(url, source_uri, cdse_lookup=cdse_lookup, journal_hash=get_journal_hash(url)))
+    else:
+        # Limit the number of pending futures to keep memory bounded for very large manifests
+        max_pending = jobs * 2
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            pending: dict[Future, str] = {}
+
+            def collect_completed():
+                # wake up regularly, so the pending items of the writer are flushed while all workers are busy
+                done, _ = wait(pending.keys(), timeout=WRITER_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(_get_result(future, pending.pop(future)))
+                if writer is not None:
+                    mark_failed(writer.flush_expired())
+
+            for url, source_uri, cdse_lookup in products:
+                future = executor.submit(
+                    process, url, source_uri, cdse_lookup=cdse_lookup, journal_hash=get_journal_hash(url)
+                )
+                pending[future] = url
+                while len(pending) >= max_pending:
+                    collect_completed()
+            while len(pending) > 0:
+                collect_completed()
+
+    if writer is not None:
+        mark_failed(writer.close())
+    return results
+
+
+def resolve_source_scenes(
+    products: Iterable[tuple[str, str | None]], chunk_size: int = 100, cdse_cache: CdseCache | None = None
+) -> Iterator[tuple[str, str | None, CdseLookup | None]]:
+    """Looks up the source scenes of chunks of products at CDSE with one search request per chunk.
+
+    Yields (url, source_uri, cdse_lookup) for each product. If the lookup of a chunk fails,
+    cdse_lookup is None and the source scenes are looked up again when the products are processed.
+    """
+    iterator = iter(products)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if len(chunk) == 0:
+            return
+
+        scene_ids = [get_source_identifier(source_uri) for _, source_uri in chunk if source_uri]
+        lookups: dict[str, CdseLookup] = {}
+        for scene_id in dict.fromkeys(scene_ids):
+            if cdse_cache is not None:
+                found, href = cdse_cache.get(scene_id)
+                if found:
+                    lookups[scene_id] = CdseLookup(href=href, cache_hit=True)
+        missing = [scene_id for scene_id in dict.fromkeys(scene_ids) if scene_id not in lookups]
+
+        if len(missing) > 0:
+            try:
+                hrefs = get_cdse_stac_item_urls(missing, chunk_size=chunk_size)
+                for scene_id in missing:
+                    href = hrefs.get(scene_id)
+                    if href is None:
+                        logger.warning(f"Failed to find STAC item for scene id {scene_id} at CDSE")
+                    if cdse_cache is not None:
+                        cdse_cache.put(scene_id, href)
+                    lookups[scene_id] = CdseLookup(href=href, cache_hit=False if cdse_cache is not None else None)
+            except Exception as e:
+                logger.warning(f"Failed to look up {len(missing)} source scenes at CDSE: {str(e)}")
+
+        for url, source_uri in chunk:
+            scene_id = get_source_identifier(source_uri) if source_uri else None
+            yield (url, source_uri, lookups.get(scene_id))
+
+
+def _get_result(future: Future, url: str) -> ProductResult:
+    try:
+        return future.result()
+    except Exception as e:
+        # e.g. the worker process died
+        logger.error(f"Failed to process {url}: {str(e)}")
+        return ProductResult(url=url, status=STATUS_FAILED, error=str(e))
+
+
+def get_cache_hit(
+    cdse_cache: CdseCache | None, previous_stats: dict[str, int] | None, cdse_lookup: CdseLookup | None
+) -> bool | None:
+    """Returns whether the CDSE lookup since previous_stats was a cache hit, None if there was no lookup"""
+    if cdse_lookup is not None:
+        return cdse_lookup.cache_hit
+    if cdse_cache is None:
+        return None
+    stats = cdse_cache.stats()
+    if stats["hits"] > previous_stats["hits"]:
+        return True
+    if stats["misses"] > previous_stats["misses"]:
+        return False
+    return None
+
+
+def record_result(journal: BatchJournal, result: ProductResult) -> None:
+    if result.status == STATUS_SKIPPED:
+        journal.skip(result.url)
+        return
+    journal.record(
+        result.url,
+        result.status,
+        metadata_hash=result.metadata_hash,
+        item_id=result.item_id,
+        collection_id=result.collection_id,
+        action=result.action,
+        error=result.error,
+    )
+
+
+def log_result(result: ProductResult, count: int) -> None:
+    if result.status == STATUS_SUCCESS:
+        action = f" ({result.action})" if result.action is not None else ""
+        logger.info(f"[{count}] Processed {result.url} -> {result.item_id}{action}")
+    else:
+        logger.info(f"[{count}] Failed {result.url}")
+
+
+def log_summary(results: list[ProductResult]) -> int:
+    failed = [r for r in results if r.status == STATUS_FAILED]
+    logger.info(f"Processed {len(results)} products: {len(results) - len(failed)} succeeded, {len(failed)} failed")
+    lookups = [r.cdse_cache_hit for r in results if r.cdse_cache_hit is not None]
+    if len(lookups) > 0:
+        logger.info(f"CDSE cache: {sum(lookups)} hits, {len(lookups) - sum(lookups)} misses")
+    for r in failed:
+        logger.info(f"Failed: {r.url} ({r.error})")
+    return len(failed)
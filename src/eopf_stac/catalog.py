@@ -0,0 +1,166 @@
+import logging
+import time
+from typing import Callable
+
+import requests
+from pystac.utils import datetime_to_str, now_in_utc
+
+from eopf_stac.common.constants import CONTENT_HASH_PROPERTY
+from eopf_stac.common.serialization import json_body
+from eopf_stac.common.stac import compute_content_hash
+from eopf_stac.io import create_session
+
+logger = logging.getLogger(__name__)
+
+BULK_METHOD_BULK_ITEMS = "bulk_items"
+BULK_METHOD_ITEM_COLLECTION = "item_collection"
+BULK_METHODS = [BULK_METHOD_BULK_ITEMS, BULK_METHOD_ITEM_COLLECTION]
+
+
+class BulkItemWriter:
+    """Writes STAC items to the Transactions API of a STAC catalog in batches per collection.
+
+    Items are buffered per collection and sent when `batch_size` items are pending or the oldest pending item
+    of a collection is older than `flush_interval` seconds. Two methods are supported:
+
+    - bulk_items: POST /collections/{collection_id}/bulk_items as provided by stac-fastapi (upsert)
+    - item_collection: POST /collections/{collection_id}/items with an ItemCollection. If some of the items already
+      exist (409), the batch is written again item by item with POST and PUT.
+
+    With skip_unchanged a content hash is stored in each item. Before a batch is written, the content hashes of
+    the existing items are fetched with one search request and items whose hash is unchanged are not written again.
+
+    The writer implements the ItemWriter protocol of eopf_stac.item_stream, the items of each batch are passed
+    to on_written once it has been written.
+    """
+
+    def __init__(
+        self,
+        stac_api_url: str,
+        batch_size: int = 100,
+        flush_interval: float = 10,
+        method: str = BULK_METHOD_BULK_ITEMS,
+        session: requests.Session | None = None,
+        skip_unchanged: bool = False,
+    ) -> None:
+        if method not in BULK_METHODS:
+            raise ValueError(f"Unsupported bulk method '{method}', expected one of {BULK_METHODS}")
+        self.stac_api_url = stac_api_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.method = method
+        self.skip_unchanged = skip_unchanged
+        self.session = session if session is not None else create_session()
+        self._pending: dict[str, list[dict]] = {}
+        self._pending_since: dict[str, float] = {}
+        self.on_written: Callable[[list[tuple[str, str]]], None] | None = None
+
+    def add(self, item: dict) -> list[tuple[dict, str]]:
+        collection_id = item["collection"]
+        item["links"] = [link for link in item.get("links", []) if link.get("rel") != "self"]
+        if collection_id not in self._pending:
+            self._pending[collection_id] = []
+            self._pending_since[collection_id] = time.monotonic()
+        self._pending[collection_id].append(item)
+
+        failed = []
+        if len(self._pending[collection_id]) >= self.batch_size:
+            failed.extend(self.flush(collection_id))
+        failed.extend(self.flush_expired())
+        return failed
+
+    def flush_expired(self) -> list[tuple[dict, str]]:
+        now = time.monotonic()
+        failed = []
+        for collection_id, since in list(self._pending_since.items()):
+            if now - since >= self.flush_interval:
+                failed.extend(self.flush(collection_id))
+        return failed
+
+    def flush(self, collection_id: str | None = None) -> list[tuple[dict, str]]:
+        collection_ids = list(self._pending.keys()) if collection_id is None else [collection_id]
+        failed = []
+        for cid in collection_ids:
+            items = self._pending.pop(cid, [])
+            self._pending_since.pop(cid, None)
+            if len(items) == 0:
+                continue
+            try:
+                self._write(cid, items)
+                logger.info(f"Successfully wrote {len(items)} STAC items to collection {cid}")
+            except Exception as e:
+                logger.error(f"Failed to write {len(items)} STAC items to collection {cid}: {str(e)}")
+                failed.extend([(item, str(e)) for item in items])
+                continue
+            if self.on_written is not None:
+                self.on_written([(cid, item["id"]) for item in items])
+        return failed
+
+    def close(self) -> list[tuple[dict, str]]:
+        return self.flush()
+
+    def _write(self, collection_id: str, items: list[dict]) -> None:
+        if self.skip_unchanged:
+            items = self._filter_unchanged(collection_id, items)
+            if len(items) == 0:
+                return
+
+        collection_url = f"{self.stac_api_url}/collections/{collection_id}"
+        if self.method == BULK_METHOD_BULK_ITEMS:
+            body = {"items": {item["id"]: item for item in items}, "method": "upsert"}
+            r = self.session.post(f"{collection_url}/bulk_items", **json_body(body))
+            r.raise_for_status()
+        else:
+            body = {"type": "FeatureCollection", "features": items}
+            r = self.session.post(f"{collection_url}/items", **json_body(body))
+            if r.status_code == 409:
+                # Some STAC items already exist -> write one by one
+                logger.info(f"Some STAC items already exist in collection {collection_id}, writing items one by one")
+                for item in items:
+                    self._upsert(collection_url, item)
+            else:
+                r.raise_for_status()
+
+    def _upsert(self, collection_url: str, item: dict) -> None:
+        r = self.session.post(f"{collection_url}/items", **json_body(item))
+        if r.status_code == 409:
+            # STAC item already exists -> update
+            item["properties"]["updated"] = datetime_to_str(now_in_utc())
+            r = self.session.put(f"{collection_url}/items/{item['id']}", **json_body(item))
+        r.raise_for_status()
+
+    def _filter_unchanged(self, collection_id: str, items: list[dict]) -> list[dict]:
+        for item in items:
+            item["properties"][CONTENT_HASH_PROPERTY] = compute_content_hash(item)
+
+        existing_hashes = {}
+        url = f"{self.stac_api_url}/search"
+        body = {"collections": [collection_id], "ids": [item["id"] for item in items], "limit": len(items)}
+        while url is not None:
+            if body is not None:
+                r = self.session.post(url, **json_body(body))
+            else:
+                r = self.session.get(url)
+            r.raise_for_status()
+            item_collection_dict = r.json()
+            for feature in item_collection_dict["features"]:
+                existing_hashes[feature["id"]] = feature.get("properties", {}).get(CONTENT_HASH_PROPERTY)
+
+            # the API may return fewer items than the limit per page, follow the link to the next page
+            next_links = [link for link in item_collection_dict.get("links", []) if link.get("rel") == "next"]
+            if len(next_links) == 0:
+                url = None
+            elif next_links[0].get("method", "GET").upper() == "POST":
+                url = next_links[0]["href"]
+                next_body = next_links[0].get("body") or {}
+                body = {**body, **next_body} if next_links[0].get("merge", False) else next_body
+            else:
+                url = next_links[0]["href"]
+                body = None
+
+        changed = [
+            item for item in items if existing_hashes.get(item["id"]) != item["properties"][CONTENT_HASH_PROPERTY]
+        ]
+        if len(changed) < len(items):
+            logger.info(f"Skipping {len(items) - len(changed)} unchanged STAC items in collection {collection_id}")
+        return changed
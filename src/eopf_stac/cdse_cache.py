@@ -0,0 +1,77 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_NEGATIVE_TTL = 24 * 3600
+
+
+class CdseCache:
+    """Persistent cache of the STAC item URLs of source scenes at CDSE backed by a SQLite database.
+
+    Scenes which were not found at CDSE are cached as well (negative caching), but with a shorter TTL
+    since they might be published later. The number of hits and misses of this process are counted.
+    Use open_cdse_cache to share one instance per process, e.g. with worker processes.
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL, negative_ttl: float = DEFAULT_NEGATIVE_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, isolation_level=None, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cdse_items (scene_id TEXT PRIMARY KEY, url TEXT, cached_at REAL NOT NULL)"
+        )
+
+    def __reduce__(self):
+        # the connection cannot be pickled, worker processes open the cache themselves
+        return (open_cdse_cache, (self.path, self.ttl, self.negative_ttl))
+
+    def get(self, scene_id: str) -> tuple[bool, str | None]:
+        """Returns (True, url) for a cached scene, url is None if the scene was not found at CDSE"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT url, cached_at FROM cdse_items WHERE scene_id = ?", (scene_id,)
+            ).fetchone()
+            if row is not None:
+                url, cached_at = row
+                ttl = self.ttl if url is not None else self.negative_ttl
+                if time.time() - cached_at < ttl:
+                    self.hits += 1
+                    return (True, url)
+            self.misses += 1
+            return (False, None)
+
+    def put(self, scene_id: str, url: str | None) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cdse_items (scene_id, url, cached_at) VALUES (?, ?, ?)",
+                (scene_id, url, time.time()),
+            )
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+_caches: dict[tuple, CdseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def open_cdse_cache(path: str, ttl: float = DEFAULT_TTL, negative_ttl: float = DEFAULT_NEGATIVE_TTL) -> CdseCache:
+    """Returns the cache instance of the current process for the given database and TTLs"""
+    key = (os.getpid(), path, ttl, negative_ttl)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = CdseCache(path, ttl=ttl, negative_ttl=negative_ttl)
+        return _caches[key]
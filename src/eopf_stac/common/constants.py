@@ -10,6 +10,17 @@ from pystac.provider import ProviderRole
 from eopf_stac.common.eopf_xarray import EopfXarrayBackendConfig, OpMode
 
 CDSE_STAC_API_URL = "https://stac.dataspace.copernicus.eu/v1"
+CDSE_LINK_TITLE = "CDSE STAC item"
+
+# URL templates of the STAC items at CDSE per mission, the parameters are derived from the collection of the
+# product type (see PRODUCT_TYPE_TO_COLLECTION) and the scene id
+CDSE_ITEM_URL_TEMPLATES: Final[dict] = {
+    "sentinel-1": "{api_url}/collections/sentinel-1-{product}/items/{scene_id}",
+    "sentinel-2": "{api_url}/collections/sentinel-2-{level}/items/{scene_id}",
+    "sentinel-3": "{api_url}/collections/sentinel-3-{instrument}-{level}-{product}-{timeliness}/items/{scene_id}",
+}
+CDSE_S3_INSTRUMENTS: Final[dict] = {"olci": "olci", "slstr": "sl", "syn": "syn"}
+CDSE_S3_TIMELINESS: Final[dict] = {"NR": "nrt", "ST": "stc", "NT": "ntc"}
 
 SUPPORTED_PRODUCT_TYPES_S1 = [
     "S01SIWGRH",
@@ -143,6 +154,10 @@ DATASET_ASSET_EXTRA_FIELDS: Final[dict] = {
     "xarray:open_dataset_kwargs": EopfXarrayBackendConfig(mode=OpMode.NATIVE).to_dict()
 }
 
+CONTENT_HASH_PROPERTY: Final[str] = "eopf_stac:content_hash"
+# Item properties which are set to the current time with every run
+VOLATILE_PROPERTIES: Final[list] = ["created", "updated", "published", CONTENT_HASH_PROPERTY]
+
 ZIPPED_PRODUCT_ASSET_KEY: Final[str] = "zipped_product"
 ZIPPED_PRODUCT_HREF_BASE = "https://download.user.eopf.eodc.eu/zip"
 
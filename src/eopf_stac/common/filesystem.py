@@ -0,0 +1,96 @@
+import hashlib
+import logging
+import os
+import threading
+from urllib.parse import urlparse
+
+import fsspec
+import s3fs
+import zarr
+from zarr.core.sync import sync
+from zarr.storage import FsspecStore, LocalStore
+
+from eopf_stac.common.http_client import get_http_settings
+
+logger = logging.getLogger(__name__)
+
+_filesystems: dict[tuple, s3fs.S3FileSystem] = {}
+_filesystems_lock = threading.Lock()
+
+
+def get_s3_config_kwargs() -> dict:
+    """Returns the botocore config with the timeouts and pool size of the HTTP settings"""
+    settings = get_http_settings()
+    return {
+        "connect_timeout": settings.connect_timeout,
+        "read_timeout": settings.read_timeout,
+        "max_pool_connections": settings.pool_size,
+    }
+
+
+def unregister_ceph_handler(client) -> None:
+    """Unregisters the handler of the boto client which breaks requests to CEPH object storages"""
+    handlers = client.meta.events._emitter._handlers
+    handlers_to_unregister = handlers.prefix_search("before-parameter-build.s3")
+    if len(handlers_to_unregister) > 0:
+        client.meta.events._emitter.unregister("before-parameter-build.s3", handlers_to_unregister[0])
+
+
+def get_filesystem(href: str, asynchronous: bool = False) -> tuple[fsspec.AbstractFileSystem, str]:
+    """Returns the filesystem and the path within this filesystem for the given href.
+
+    The filesystems of the object storages are created once per process and reused for all hrefs with the
+    same scheme, endpoint and credentials. Asynchronous filesystems are bound to the event loop of zarr.
+    """
+    if href.startswith("s3://"):
+        endpoint_url = os.environ["S3_ENDPOINT_URL"]
+        path = href
+        anon = False
+        secret = os.environ.get("AWS_SECRET_ACCESS_KEY", "")
+        credentials = (os.environ.get("AWS_ACCESS_KEY_ID"), hashlib.sha256(secret.encode("utf-8")).hexdigest())
+    elif href.startswith("http"):
+        o = urlparse(href)
+        endpoint_url = f"{o.scheme}://{o.netloc}"
+        path = o.path
+        anon = True
+        credentials = None
+    else:
+        return (fsspec.filesystem("file"), href)
+
+    key = (os.getpid(), endpoint_url, anon, credentials, asynchronous)
+    with _filesystems_lock:
+        if key not in _filesystems:
+            logger.debug(f"Creating filesystem for {endpoint_url}")
+            _filesystems[key] = _create_filesystem(endpoint_url, anon, asynchronous)
+        return (_filesystems[key], path)
+
+
+def _create_filesystem(endpoint_url: str, anon: bool, asynchronous: bool) -> s3fs.S3FileSystem:
+    if anon:
+        fs = s3fs.S3FileSystem(
+            anon=True,
+            client_kwargs={"endpoint_url": endpoint_url},
+            config_kwargs=get_s3_config_kwargs(),
+            asynchronous=asynchronous,
+            skip_instance_cache=True,
+        )
+        # unregister handler to make boto3 work with CEPH
+        client = sync(fs.set_session()) if asynchronous else fs.s3
+        unregister_ceph_handler(client)
+    else:
+        fs = s3fs.S3FileSystem(
+            anon=False,
+            endpoint_url=endpoint_url,
+            config_kwargs=get_s3_config_kwargs(),
+            asynchronous=asynchronous,
+            skip_instance_cache=True,
+        )
+    return fs
+
+
+def get_zarr_store(href: str) -> zarr.abc.store.Store:
+    """Returns a read-only zarr store for the given href using the filesystems of the registry"""
+    fs, path = get_filesystem(href, asynchronous=True)
+    if isinstance(fs, s3fs.S3FileSystem):
+        return FsspecStore(fs, path=path.removeprefix("s3://"), read_only=True)
+    return LocalStore(path.removeprefix("file://"), read_only=True)
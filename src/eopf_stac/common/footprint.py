@@ -0,0 +1,67 @@
+import logging
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import shapely
+
+logger = logging.getLogger(__name__)
+
+ENV_FOOTPRINT_SIMPLIFY_TOLERANCE: str = "FOOTPRINT_SIMPLIFY_TOLERANCE"
+ENV_FOOTPRINT_PRECISION: str = "FOOTPRINT_PRECISION"
+
+WORLD = shapely.box(-180, -90, 180, 90)
+
+
+@dataclass(frozen=True)
+class FootprintSettings:
+    # maximum distance in degrees between the simplified and the original outline, 0 disables simplification
+    simplify_tolerance: float = 0
+    # number of decimals of the coordinates, None keeps them as they are
+    precision: int | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.simplify_tolerance > 0 or self.precision is not None
+
+
+def get_footprint_settings(env=os.environ) -> FootprintSettings:
+    """Reads the settings of the footprint simplification from the environment"""
+    precision = env.get(ENV_FOOTPRINT_PRECISION)
+    return FootprintSettings(
+        simplify_tolerance=float(env.get(ENV_FOOTPRINT_SIMPLIFY_TOLERANCE, FootprintSettings.simplify_tolerance)),
+        precision=int(precision) if precision is not None and len(precision) > 0 else None,
+    )
+
+
+def compact_footprints(geometries: np.ndarray, settings: FootprintSettings) -> np.ndarray:
+    """Simplifies the footprints with the topology preserving simplification and rounds their coordinates.
+
+    Every returned footprint covers its original footprint. If the simplified footprint does not, the
+    original is grown by the tolerance and the rounding error and simplified again. Footprints which are
+    invalid or still not covered are returned unchanged.
+    """
+    result = geometries.copy()
+    pending = shapely.is_valid(geometries) & ~shapely.is_empty(geometries)
+    if not pending.all():
+        logger.debug(f"Keeping {np.count_nonzero(~pending)} invalid footprints as they are")
+
+    margin = settings.simplify_tolerance + (10.0**-settings.precision if settings.precision is not None else 0)
+    for distance in [0, margin, 2 * margin]:
+        indices = np.flatnonzero(pending)
+        if len(indices) == 0:
+            break
+        candidates = geometries[indices]
+        if distance > 0:
+            candidates = shapely.intersection(shapely.buffer(candidates, distance, join_style="mitre"), WORLD)
+        if settings.simplify_tolerance > 0:
+            candidates = shapely.simplify(candidates, settings.simplify_tolerance, preserve_topology=True)
+        if settings.precision is not None:
+            candidates = shapely.transform(candidates, lambda coordinates: np.round(coordinates, settings.precision))
+        covered = shapely.is_valid(candidates) & shapely.covers(candidates, geometries[indices])
+        result[indices[covered]] = candidates[covered]
+        pending[indices[covered]] = False
+
+    if pending.any():
+        logger.warning(f"Failed to simplify {np.count_nonzero(pending)} footprints, keeping the original ones")
+    return result
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import footprint_facility
+
+from eopf_stac.common.footprint import FootprintSettings
+from eopf_stac.common.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+ENV_GEOMETRY_CACHE_SIZE: str = "GEOMETRY_CACHE_SIZE"
+ENV_GEOMETRY_CACHE_PATH: str = "GEOMETRY_CACHE_PATH"
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+EVICTION_INTERVAL = 100
+
+
+class GeometryCache:
+    """Cache of the repaired footprints of items, keyed by a hash of the input geometry and the settings.
+
+    The repaired footprints are kept as JSON in a least recently used cache of max_size bytes in memory and,
+    if a path is given, in a SQLite database of the same size, which is shared by all processes and runs.
+    Use open_geometry_cache to share one instance per process.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, path: str | None = None) -> None:
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, isolation_level=None, timeout=30, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS geometries (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+            )
+
+    def __reduce__(self):
+        # the connection cannot be pickled, worker processes open the cache themselves
+        return (open_geometry_cache, (self.max_size, self.path))
+
+    @staticmethod
+    def get_key(geometry: dict, settings: FootprintSettings) -> str:
+        """Returns the hash of the input geometry, the settings and the version of the footprint repair"""
+        # canonical JSON, so the key does not depend on whether orjson is installed
+        serialized = json.dumps(geometry, sort_keys=True, separators=(",", ":"))
+        sha256 = hashlib.sha256(serialized.encode("utf-8"))
+        sha256.update(f"{settings.simplify_tolerance}:{settings.precision}".encode("utf-8"))
+        sha256.update(footprint_facility.__version__.encode("utf-8"))
+        return sha256.hexdigest()
+
+    def get(self, key: str) -> tuple[dict, list[float] | None] | None:
+        """Returns the repaired geometry and its bounds, if simplified, or None if the key is not cached"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            elif self._connection is not None:
+                row = self._connection.execute("SELECT value FROM geometries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self._connection.execute("UPDATE geometries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    self._add(key, value)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        entry = json.loads(value)
+        return (entry["geometry"], entry["bounds"])
+
+    def put(self, key: str, geometry: dict, bounds: list[float] | None = None) -> None:
+        value = dumps({"geometry": geometry, "bounds": bounds})
+        with self._lock:
+            self._add(key, value)
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO geometries (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), time.time()),
+                )
+                self._puts += 1
+                if self._puts % EVICTION_INTERVAL == 0:
+                    self._evict()
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+
+    def _add(self, key: str, value: bytes) -> None:
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        if len(value) > self.max_size:
+            return
+        self._entries[key] = value
+        self._size += len(value)
+        while self._size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _evict(self) -> None:
+        rows = self._connection.execute("SELECT key, size FROM geometries ORDER BY accessed_at DESC").fetchall()
+        total_size = 0
+        evicted = []
+        for key, size in rows:
+            total_size += size
+            if total_size > self.max_size:
+                evicted.append((key,))
+        if len(evicted) > 0:
+            logger.debug(f"Evicting {len(evicted)} geometries from geometry cache")
+            self._connection.executemany("DELETE FROM geometries WHERE key = ?", evicted)
+
+
+_caches: dict[tuple, GeometryCache] = {}
+_caches_lock = threading.Lock()
+
+
+def open_geometry_cache(max_size: int = DEFAULT_MAX_SIZE, path: str | None = None) -> GeometryCache:
+    """Returns the cache instance of the current process for the given size and database"""
+    key = (os.getpid(), max_size, path)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = GeometryCache(max_size=max_size, path=path)
+        return _caches[key]
+
+
+def get_geometry_cache(env=os.environ) -> GeometryCache | None:
+    """Returns the cache configured with the environment variables, None if the size is 0"""
+    max_size = int(env.get(ENV_GEOMETRY_CACHE_SIZE, DEFAULT_MAX_SIZE))
+    if max_size <= 0:
+        return None
+    path = env.get(ENV_GEOMETRY_CACHE_PATH)
+    return open_geometry_cache(max_size=max_size, path=path if path else None)
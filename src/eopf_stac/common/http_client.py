@@ -0,0 +1,167 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+ENV_HTTP_CONNECT_TIMEOUT: str = "HTTP_CONNECT_TIMEOUT"
+ENV_HTTP_READ_TIMEOUT: str = "HTTP_READ_TIMEOUT"
+ENV_HTTP_POOL_SIZE: str = "HTTP_POOL_SIZE"
+ENV_HTTP_RETRIES: str = "HTTP_RETRIES"
+ENV_PRODUCT_TIMEOUT: str = "PRODUCT_TIMEOUT"
+
+RETRY_STATUS_CODES = [429, 502, 503, 504]
+
+
+class DeadlineExceededError(TimeoutError):
+    pass
+
+
+@dataclass(frozen=True)
+class HttpSettings:
+    connect_timeout: float = 10
+    read_timeout: float = 60
+    pool_size: int = 32
+    retries: int = 3
+    product_timeout: float | None = None
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        return (self.connect_timeout, self.read_timeout)
+
+
+def get_http_settings(env=os.environ) -> HttpSettings:
+    """Reads the settings of the HTTP clients from the environment"""
+    product_timeout = float(env.get(ENV_PRODUCT_TIMEOUT, 0))
+    return HttpSettings(
+        connect_timeout=float(env.get(ENV_HTTP_CONNECT_TIMEOUT, HttpSettings.connect_timeout)),
+        read_timeout=float(env.get(ENV_HTTP_READ_TIMEOUT, HttpSettings.read_timeout)),
+        pool_size=int(env.get(ENV_HTTP_POOL_SIZE, HttpSettings.pool_size)),
+        retries=int(env.get(ENV_HTTP_RETRIES, HttpSettings.retries)),
+        product_timeout=product_timeout if product_timeout > 0 else None,
+    )
+
+
+_deadline = threading.local()
+
+
+@contextmanager
+def deadline(seconds: float | None):
+    """Limits the time of all requests sent by the current thread within the context.
+
+    Nested deadlines can only shorten the remaining time. Requests started after the deadline fail
+    with a DeadlineExceededError, the timeouts of other requests are reduced to the remaining time.
+    """
+    previous = getattr(_deadline, "value", None)
+    if seconds is not None and seconds > 0:
+        value = time.monotonic() + seconds
+        _deadline.value = value if previous is None else min(previous, value)
+    try:
+        yield
+    finally:
+        _deadline.value = previous
+
+
+def get_remaining_time() -> float | None:
+    value = getattr(_deadline, "value", None)
+    if value is None:
+        return None
+    return value - time.monotonic()
+
+
+def check_deadline() -> None:
+    remaining = get_remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError("Deadline for processing the product exceeded")
+
+
+class DeadlineRetry(Retry):
+    """Retry which gives up instead of waiting for the backoff or the Retry-After header beyond the deadline"""
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None) -> Retry:
+        retry = super().increment(
+            method=method, url=url, response=response, error=error, _pool=_pool, _stacktrace=_stacktrace
+        )
+        remaining = get_remaining_time()
+        if remaining is not None:
+            wait = retry.get_backoff_time()
+            if response is not None and retry.respect_retry_after_header:
+                retry_after = retry.get_retry_after(response)
+                if retry_after is not None:
+                    wait = retry_after
+            if wait >= remaining:
+                logger.debug(f"Not retrying {url}, waiting {wait:.1f}s would exceed the deadline")
+                raise MaxRetryError(_pool, url, error or ResponseError("deadline exceeded before retry"))
+        return retry
+
+
+class TimeoutSession(requests.Session):
+    """Session which applies default timeouts and the deadline of the current thread to every request"""
+
+    def __init__(self, timeout: tuple[float, float]) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        timeout = kwargs.get("timeout") or self.timeout
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+
+        remaining = get_remaining_time()
+        if remaining is not None:
+            check_deadline()
+            timeout = tuple(min(t, remaining) for t in timeout)
+
+        kwargs["timeout"] = timeout
+        return super().request(method, url, **kwargs)
+
+
+def create_session(auth: tuple[str, str] | None = None, settings: HttpSettings | None = None) -> requests.Session:
+    """Creates a session with a keep-alive connection pool of `pool_size` connections per host.
+
+    Failed connections and responses indicating overload (429, 502, 503, 504) are retried with
+    exponential backoff for idempotent methods, as long as the deadline of the current thread allows it.
+    """
+    if settings is None:
+        settings = get_http_settings()
+
+    session = TimeoutSession(timeout=settings.timeout)
+    session.auth = auth
+    retry = DeadlineRetry(
+        total=settings.retries,
+        read=False,
+        status_forcelist=RETRY_STATUS_CODES,
+        backoff_factor=0.5,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=settings.pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_sessions: dict[tuple[str, str] | None, requests.Session] = {}
+_sessions_pid: int | None = None
+_sessions_lock = threading.Lock()
+
+
+def get_session(auth: tuple[str, str] | None = None) -> requests.Session:
+    """Returns the session shared by all threads of the current process for the given credentials"""
+    global _sessions_pid
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # connections must not be shared with a forked parent process
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        if auth not in _sessions:
+            _sessions[auth] = create_session(auth=auth)
+        return _sessions[auth]
@@ -0,0 +1,333 @@
+import codecs
+import json
+import logging
+import os
+import re
+from collections.abc import Mapping
+from typing import BinaryIO, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+ROOT_ATTRIBUTES_KEY: str = ".zattrs"
+ARRAY_METADATA_KEY: str = ".zarray"
+ROOT_GROUP_KEY: str = ".zgroup"
+ZARR_JSON_KEY: str = "zarr.json"
+
+ENV_METADATA_MAX_SIZE: str = "METADATA_MAX_SIZE"
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def is_attributes_key(key: str) -> bool:
+    """Returns True for the keys of the attributes of the root group and of all groups and arrays"""
+    return key == ROOT_ATTRIBUTES_KEY or key.endswith(f"/{ROOT_ATTRIBUTES_KEY}")
+
+
+def is_item_metadata_key(key: str) -> bool:
+    """Returns True for the keys of all attributes and of the array metadata, e.g. with the shape of the arrays"""
+    return is_attributes_key(key) or key == ARRAY_METADATA_KEY or key.endswith(f"/{ARRAY_METADATA_KEY}")
+
+
+def get_metadata_max_size(env=os.environ) -> int:
+    return int(env.get(ENV_METADATA_MAX_SIZE, DEFAULT_MAX_SIZE))
+
+
+def load_consolidated_metadata(
+    f: BinaryIO, key_filter: Callable[[str], bool] = is_item_metadata_key, max_size: int | None = None
+) -> dict:
+    """Parses a consolidated metadata document (.zmetadata).
+
+    Only the entries of the "metadata" object accepted by key_filter are kept. By default the attributes
+    (.zattrs) and the array metadata (.zarray) are kept, which is all the STAC item builders need. Documents
+    in the layout written by zarr are indexed without decoding and the kept entries are decoded on first
+    access (see RawMetadata). Other documents are parsed incrementally, decoding the entries one by one. A
+    ValueError is raised if a single entry or all kept entries together are larger than max_size bytes of
+    JSON text, which limits the memory used per product.
+    """
+    if max_size is None:
+        max_size = get_metadata_max_size()
+
+    data = f.read(max_size + 1)
+    if len(data) <= max_size:
+        zmetadata = _index_consolidated_metadata(data, key_filter)
+        if zmetadata is not None:
+            return zmetadata
+
+    decoder = _StreamingDecoder(f, max_size, data)
+    zmetadata = {}
+    decoder.expect("{")
+    for key in decoder.keys():
+        if key != "metadata":
+            zmetadata[key] = decoder.decode_value()[0]
+            continue
+
+        metadata = {}
+        kept_size = 0
+        decoder.expect("{")
+        for entry_key in decoder.keys():
+            value, size = decoder.decode_value()
+            if key_filter(entry_key):
+                metadata[entry_key] = value
+                kept_size += size
+                if kept_size > max_size:
+                    raise ValueError(f"Metadata exceeds the maximum size of {max_size} bytes")
+        zmetadata["metadata"] = metadata
+
+    return zmetadata
+
+
+# zarr writes the consolidated metadata with an indentation of 4 spaces and escapes all line breaks within
+# strings, so the keys of the entries are the only lines starting with 8 spaces and a quote
+_METADATA_START = b'\n    "metadata": {\n'
+_METADATA_END = b"\n    }"
+_ENTRY_KEY = re.compile(rb'\n        ("[^"\\\n]*(?:\\.[^"\\\n]*)*"): ')
+_FORMAT = re.compile(rb'\n    "zarr_consolidated_format": (\d+)')
+
+
+def _index_consolidated_metadata(data: bytes, key_filter: Callable[[str], bool]) -> dict | None:
+    """Returns the consolidated metadata with a RawMetadata view of the entries, or None for other layouts"""
+    start = data.find(_METADATA_START)
+    if data[:1] != b"{" or start < 0:
+        return None
+    start += len(_METADATA_START) - 1
+    end = data.find(_METADATA_END, start)
+    if end < 0:
+        return None
+
+    matches = list(_ENTRY_KEY.finditer(data, start, end + 1))
+    spans = {}
+    for i, match in enumerate(matches):
+        key = match.group(1)
+        key = json.loads(key) if b"\\" in key else key[1:-1].decode("utf-8")
+        if not key_filter(key):
+            continue
+        value_start = match.end()
+        value_end = data.rfind(b"}", value_start, matches[i + 1].start() if i + 1 < len(matches) else end) + 1
+        if data[value_start : value_start + 1] != b"{" or value_end == 0:
+            return None
+        spans[key] = (value_start, value_end)
+
+    zmetadata = {"metadata": RawMetadata(data, spans)}
+    consolidated_format = _FORMAT.search(data)
+    if consolidated_format is not None:
+        zmetadata["zarr_consolidated_format"] = int(consolidated_format.group(1))
+    return zmetadata
+
+
+def load_zarr_json_metadata(
+    f: BinaryIO, key_filter: Callable[[str], bool] = is_item_metadata_key, max_size: int | None = None
+) -> dict:
+    """Parses the root zarr.json of a Zarr v3 store with consolidated metadata incrementally.
+
+    The attributes and array metadata of all nodes are mapped to the keys of the consolidated metadata of
+    Zarr v2 (.zattrs, .zarray, .zgroup), so that the result has the same structure as the one of
+    load_consolidated_metadata. Without consolidated metadata only the root attributes are available.
+    """
+    if max_size is None:
+        max_size = get_metadata_max_size()
+
+    decoder = _StreamingDecoder(f, max_size)
+    zmetadata = {}
+    metadata = {}
+    kept_size = 0
+    consolidated = False
+    decoder.expect("{")
+    for key in decoder.keys():
+        if key == "attributes":
+            metadata[ROOT_ATTRIBUTES_KEY], _ = decoder.decode_value()
+        elif key == "consolidated_metadata" and decoder.peek() == "{":
+            decoder.expect("{")
+            for consolidated_key in decoder.keys():
+                if consolidated_key != "metadata":
+                    decoder.decode_value()
+                    continue
+                consolidated = True
+                decoder.expect("{")
+                for path in decoder.keys():
+                    node, size = decoder.decode_value()
+                    entries = {k: v for k, v in _to_v2_entries(path, node) if key_filter(k)}
+                    if len(entries) > 0:
+                        metadata.update(entries)
+                        kept_size += size
+                        if kept_size > max_size:
+                            raise ValueError(f"Metadata exceeds the maximum size of {max_size} bytes")
+        else:
+            zmetadata[key], _ = decoder.decode_value()
+
+    if not consolidated:
+        logger.warning(f"No consolidated metadata found in {ZARR_JSON_KEY}, only the root attributes are available")
+    metadata.setdefault(ROOT_ATTRIBUTES_KEY, {})
+    metadata[ROOT_GROUP_KEY] = {"zarr_format": zmetadata.get("zarr_format", 3)}
+    zmetadata["metadata"] = metadata
+    return zmetadata
+
+
+def get_zarr_format(metadata: Mapping) -> int:
+    """Returns the Zarr format of the product the metadata has been read from"""
+    if isinstance(metadata, LazyMetadata):
+        # only Zarr v2 products have a root .zattrs
+        return 2
+    return metadata.get(ROOT_GROUP_KEY, {}).get("zarr_format", 2)
+
+
+def _to_v2_entries(path: str, node: dict) -> Iterator[tuple[str, object]]:
+    if node.get("node_type") == "array":
+        chunks = node.get("chunk_grid", {}).get("configuration", {}).get("chunk_shape")
+        for codec in node.get("codecs", []):
+            # the attributes of sharded arrays are stored inline, the chunks are within the shards
+            if isinstance(codec, dict) and codec.get("name") == "sharding_indexed":
+                chunks = codec.get("configuration", {}).get("chunk_shape", chunks)
+        yield (
+            f"{path}/.zarray",
+            {
+                "zarr_format": node.get("zarr_format"),
+                "shape": node.get("shape"),
+                "chunks": chunks,
+                "dtype": node.get("data_type"),
+                "fill_value": node.get("fill_value"),
+            },
+        )
+    else:
+        yield (f"{path}/.zgroup", {"zarr_format": node.get("zarr_format")})
+    yield (f"{path}/{ROOT_ATTRIBUTES_KEY}", node.get("attributes", {}))
+
+
+class RawMetadata(Mapping):
+    """Read-only view of the entries of a consolidated metadata document.
+
+    The raw JSON text of the document is kept and an entry is only decoded on first access, the decoded
+    value is cached. Most entries of a product are never read by the STAC item builders.
+    """
+
+    def __init__(self, data: bytes, spans: dict[str, tuple[int, int]]) -> None:
+        self._data = data
+        self._spans = spans
+        self._values = {}
+
+    def __getitem__(self, key: str):
+        value = self._values.get(key)
+        if value is None:
+            start, end = self._spans[key]
+            value = json.loads(self._data[start:end])
+            self._values[key] = value
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._spans
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._spans)
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+
+class LazyMetadata(Mapping):
+    """Metadata of a product of which only the root attributes are read up front.
+
+    All other entries, e.g. the attributes of groups and arrays, are loaded on first access with the loader,
+    which typically reads the consolidated metadata of the product.
+    """
+
+    def __init__(self, root_attributes: dict, loader: Callable[[], Mapping]) -> None:
+        self.root_attributes = root_attributes
+        self._loader = loader
+        self._metadata = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._metadata is not None
+
+    def load(self) -> Mapping:
+        if self._metadata is None:
+            logger.debug("Loading the attributes of all groups and arrays")
+            self._metadata = self._loader()
+        return self._metadata
+
+    def __getitem__(self, key: str):
+        if key == ROOT_ATTRIBUTES_KEY:
+            return self.root_attributes
+        return self.load()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+class _StreamingDecoder:
+    """Decodes the JSON values of a document one after another while reading it in chunks"""
+
+    def __init__(self, f: BinaryIO, max_size: int, data: bytes = b"") -> None:
+        self.f = f
+        self.max_size = max_size
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        # data which has already been read from f
+        self.buffer = self._text_decoder.decode(data)
+
+    def _read(self) -> None:
+        pending = len(self.buffer) - self.pos
+        if pending > self.max_size:
+            raise ValueError(f"Metadata entry exceeds the maximum size of {self.max_size} bytes")
+
+        # read at least as much as is pending, so that a large value is not decoded again and again
+        chunk = self.f.read(max(CHUNK_SIZE, pending))
+        if isinstance(chunk, bytes):
+            chunk = self._text_decoder.decode(chunk, final=len(chunk) == 0)
+        if len(chunk) == 0:
+            self.eof = True
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos : self.pos + 1]
+            self._read()
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Invalid metadata: expected '{char}' at position {self.pos}")
+        self.pos += 1
+
+    def decode_value(self) -> tuple[object, int]:
+        """Returns the next value and the size of its JSON text"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer might continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    size = end - self.pos
+                    self.pos = end
+                    return (value, size)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read()
+
+    def keys(self) -> Iterator[str]:
+        """Yields the keys of an object after its opening brace, the value must be decoded by the caller"""
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key, _ = self.decode_value()
+            if not isinstance(key, str):
+                raise ValueError(f"Invalid metadata: expected key at position {self.pos}")
+            self.expect(":")
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Invalid metadata: expected ',' or '}}' at position {self.pos - 1}")
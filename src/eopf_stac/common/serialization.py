@@ -0,0 +1,32 @@
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """Encodes the object as UTF-8 JSON, compact unless indent is set.
+
+    orjson is used if it is installed and can encode the object, the json module of the standard library
+    otherwise. Indented output uses 2 spaces with both encoders.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError as e:
+            logger.debug(f"Falling back to json module: {e}")
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def json_body(obj) -> dict:
+    """Returns the keyword arguments to send the object as JSON body with requests or aiohttp"""
+    return {"data": dumps(obj), "headers": JSON_HEADERS}
@@ -1,9 +1,12 @@
+import hashlib
 import json
 import logging
 import os
 import re
+from collections.abc import Mapping
 
 import geojson
+import numpy as np
 import pystac
 import shapely
 from footprint_facility import rework_to_polygon_geometry
@@ -15,29 +18,44 @@ from pystac.utils import now_in_utc, str_to_datetime
 from stactools.sentinel2.mgrs import MgrsExtension
 
 from eopf_stac.common.constants import (
+    CDSE_ITEM_URL_TEMPLATES,
+    CDSE_LINK_TITLE,
+    CDSE_S3_INSTRUMENTS,
+    CDSE_S3_TIMELINESS,
+    CDSE_STAC_API_URL,
+    CONTENT_HASH_PROPERTY,
     EO_EXTENSION_SCHEMA_URI,
     EOPF_EXTENSION_SCHEMA_URI,
     PROCESSING_EXTENSION_SCHEMA_URI,
     PRODUCT_EXTENSION_SCHEMA_URI,
+    PRODUCT_TYPE_TO_COLLECTION,
     S2_MGRS_PATTERN,
     VERSION_EXTENSION_SCHEMA_URI,
+    VOLATILE_PROPERTIES,
     ZIPPED_PRODUCT_HREF_BASE,
     get_item_asset_zipped_product,
 )
+from eopf_stac.common.footprint import FootprintSettings, compact_footprints, get_footprint_settings
+from eopf_stac.common.geometry_cache import GeometryCache, get_geometry_cache
 
 logger = logging.getLogger(__name__)
 
 
-def validate_metadata(metadata: dict) -> dict:
-    stac_discovery = metadata.get("metadata", {}).get(".zattrs", {}).get("stac_discovery")
+def validate_metadata(metadata: dict, source: str = ".zmetadata") -> dict:
+    validate_root_attributes(metadata.get("metadata", {}).get(".zattrs", {}), source=source)
+    return metadata["metadata"]
+
+
+def validate_root_attributes(attributes: dict, source: str = ".zattrs") -> dict:
+    stac_discovery = attributes.get("stac_discovery")
     if stac_discovery is None:
-        raise ValueError("JSON object 'stac_discovery' not found in .zmetadata file")
+        raise ValueError(f"JSON object 'stac_discovery' not found in {source} file")
 
-    other_metadata = metadata.get("metadata", {}).get(".zattrs", {}).get("other_metadata")
+    other_metadata = attributes.get("other_metadata")
     if other_metadata is None:
-        raise ValueError("JSON object 'other_metadata' not found in .zmetadata file")
+        raise ValueError(f"JSON object 'other_metadata' not found in {source} file")
 
-    return metadata["metadata"]
+    return attributes
 
 
 def rearrange_bbox(bbox):
@@ -114,19 +132,129 @@ def get_cpm_version(path: str) -> str | None:
     return None
 
 
-def fix_geometry(item: pystac.Item) -> None:
-    coordinates = geojson.Polygon.clean_coordinates(coords=item.geometry["coordinates"], precision=15)
+def fix_geometry(
+    item: pystac.Item, settings: FootprintSettings | None = None, cache: GeometryCache | None = None
+) -> None:
+    fix_geometries([item], settings=settings, cache=cache)
+
+
+def fix_geometries(
+    items: list[pystac.Item], settings: FootprintSettings | None = None, cache: GeometryCache | None = None
+) -> None:
+    """Closes the exterior ring of the footprints of the items and splits them at the antimeridian.
+
+    The polygons of all items are processed together as coordinate arrays. Only polygons whose bounding box
+    touches or spans more than half of the antimeridian are converted to shapely geometries and reworked,
+    the others cannot cross it and are kept as they are. Other geometry types take the generic path.
+    The footprints are simplified and rounded according to the settings, by default the ones of the
+    environment (see compact_footprints); the bbox of an item is extended if the footprint has grown.
+    The repaired footprints are looked up in and added to the cache, by default the one of the environment.
+    """
+    if settings is None:
+        settings = get_footprint_settings()
+    if cache is None:
+        cache = get_geometry_cache()
+
+    keys = {}
+    if cache is not None:
+        missing = []
+        for item in items:
+            key = cache.get_key(item.geometry, settings)
+            cached = cache.get(key)
+            if cached is None:
+                keys[id(item)] = key
+                missing.append(item)
+                continue
+            item.geometry, bounds = cached
+            if bounds is not None:
+                _extend_bbox(item, bounds)
+        items = missing
+
+    geometries = []
+    polygons = []
+    for item in items:
+        rings = _get_polygon_rings(item.geometry)
+        if rings is None:
+            geometries.append((item, _rework_geometry(item.geometry)))
+            continue
+        if not np.array_equal(rings[0][0], rings[0][-1]):
+            # CPM workaround for https://gitlab.eopf.copernicus.eu/cpm/eopf-cpm/-/issues/708
+            logger.info("Fixing coordinates to end linear ring where it started")
+            rings = [_round_coordinates(ring) for ring in rings]
+            rings[0] = np.vstack([rings[0], rings[0][:1]])
+        polygons.append((item, rings))
+
+    if len(polygons) > 0:
+        longitudes = np.concatenate([ring[:, 0] for _, rings in polygons for ring in rings])
+        offsets = np.cumsum([0] + [sum(len(ring) for ring in rings) for _, rings in polygons[:-1]])
+        min_longitudes = np.minimum.reduceat(longitudes, offsets)
+        max_longitudes = np.maximum.reduceat(longitudes, offsets)
+        may_cross = (min_longitudes <= -180) | (max_longitudes >= 180) | (max_longitudes - min_longitudes > 180)
+
+        for (item, rings), crossing in zip(polygons, may_cross):
+            if crossing:
+                geometries.append((item, rework_to_polygon_geometry(shapely.Polygon(rings[0], rings[1:]))))
+            elif settings.enabled:
+                geometries.append((item, shapely.Polygon(rings[0], rings[1:])))
+            else:
+                item.geometry = {"type": "Polygon", "coordinates": [ring.tolist() for ring in rings]}
+                if cache is not None:
+                    cache.put(keys[id(item)], item.geometry)
+
+    if len(geometries) == 0:
+        return
+    shapes = np.array([geometry for _, geometry in geometries], dtype=object)
+    if settings.enabled:
+        shapes = compact_footprints(shapes, settings)
+    for (item, _), shape, geojson_str in zip(geometries, shapes, shapely.to_geojson(shapes)):
+        item.geometry = json.loads(geojson_str)
+        bounds = list(shape.bounds) if settings.enabled else None
+        if bounds is not None:
+            _extend_bbox(item, bounds)
+        if cache is not None:
+            cache.put(keys[id(item)], item.geometry, bounds)
+
+
+def _extend_bbox(item: pystac.Item, bounds: list[float]) -> None:
+    bbox = item.bbox
+    if bbox is None or len(bbox) != 4 or bbox[0] > bbox[2] or any(np.isnan(bounds)):
+        return
+    item.bbox = [min(bbox[0], bounds[0]), min(bbox[1], bounds[1]), max(bbox[2], bounds[2]), max(bbox[3], bounds[3])]
+
+
+def _round_coordinates(coordinates: np.ndarray) -> np.ndarray:
+    """Rounds the coordinates to 15 decimals like geojson.Polygon.clean_coordinates"""
+    coordinates = coordinates.copy()
+    # doubles with an absolute value of 8 or more have less than 15 decimals, round does not change them
+    small = np.abs(coordinates) < 8
+    coordinates[small] = [round(value, 15) for value in coordinates[small].tolist()]
+    return coordinates
+
+
+def _get_polygon_rings(geometry: dict) -> list[np.ndarray] | None:
+    """Returns the rings of a 2D polygon as arrays, None for other geometries"""
+    if geometry.get("type") != "Polygon" or len(geometry.get("coordinates", [])) == 0:
+        return None
+    try:
+        rings = [np.array(ring, dtype=np.float64) for ring in geometry["coordinates"]]
+    except (TypeError, ValueError):
+        return None
+    if any(ring.ndim != 2 or ring.shape[0] == 0 or ring.shape[1] != 2 for ring in rings):
+        return None
+    return rings
+
+
+def _rework_geometry(geometry: dict) -> shapely.Geometry:
+    coordinates = geojson.Polygon.clean_coordinates(coords=geometry["coordinates"], precision=15)
     first_coord = coordinates[0][0]
     last_coord = coordinates[0][-1]
     if first_coord != last_coord:
         # CPM workaround for https://gitlab.eopf.copernicus.eu/cpm/eopf-cpm/-/issues/708
         logger.info("Fixing coordinates to end linear ring where it started")
         coordinates[0].append(first_coord)
-        item.geometry["coordinates"] = coordinates
+        geometry = {**geometry, "coordinates": coordinates}
 
-    geometry = shapely.from_geojson(json.dumps(item.geometry))
-    reworked = rework_to_polygon_geometry(geometry)
-    item.geometry = json.loads(shapely.to_geojson(reworked))
+    return rework_to_polygon_geometry(shapely.from_geojson(json.dumps(geometry)))
 
 
 def fill_timestamp_properties(item: pystac.Item, properties: dict) -> None:
@@ -308,15 +436,85 @@ def any_not_none(values: list) -> bool:
             return True
 
 
+def compute_content_hash(item_dict: dict) -> str:
+    """Returns a stable hash of the STAC item, ignoring the timestamps which change with every run"""
+    properties = {
+        key: value for key, value in item_dict.get("properties", {}).items() if key not in VOLATILE_PROPERTIES
+    }
+    links = [link for link in item_dict.get("links", []) if link.get("rel") != "self"]
+    content = {**item_dict, "properties": properties, "links": links}
+    serialized = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def compute_metadata_hash(metadata: Mapping) -> str:
+    """Returns a stable hash of the root attributes of a product, which contain all product level metadata.
+
+    The hash is recorded in the batch journal and compared on resume to process changed products again.
+    """
+    serialized = json.dumps(metadata[".zattrs"], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def set_content_hash(item: pystac.Item, item_dict: dict | None = None) -> str:
+    """Stores the content hash in the item and in item_dict, the dictionary of the item if already built"""
+    if item_dict is None:
+        item_dict = item.to_dict()
+    content_hash = compute_content_hash(item_dict)
+    item.properties[CONTENT_HASH_PROPERTY] = content_hash
+    item_dict["properties"][CONTENT_HASH_PROPERTY] = content_hash
+    return content_hash
+
+
 def create_cdse_link(cdse_scene_href: str) -> Link:
     return Link(
         rel="alternate",
-        title="CDSE STAC item",
+        title=CDSE_LINK_TITLE,
         target=cdse_scene_href,
         media_type="application/geo+json",
     )
 
 
+def get_cdse_link_href(item: pystac.Item) -> str | None:
+    for link in item.links:
+        if link.rel == "alternate" and link.title == CDSE_LINK_TITLE:
+            return link.href
+    return None
+
+
+def get_cdse_stac_item_href(product_type: str, scene_id: str, cdse_stac_api_url: str = CDSE_STAC_API_URL) -> str | None:
+    """Builds the URL of the STAC item of the source scene at CDSE without a request to the CDSE STAC API.
+
+    Returns None if the URL cannot be derived for the product type or scene id.
+    """
+    collection = PRODUCT_TYPE_TO_COLLECTION.get(product_type)
+    if collection is None:
+        return None
+
+    # e.g. sentinel-1-l1-grd, sentinel-2-l2a, sentinel-3-olci-l1-efr, sentinel-3-syn-l2
+    parts = collection.split("-")
+    mission = "-".join(parts[:2])
+    params = {"api_url": cdse_stac_api_url, "scene_id": scene_id}
+    if mission == "sentinel-1":
+        params["product"] = parts[3]
+    elif mission == "sentinel-2":
+        params["level"] = parts[2]
+    elif mission == "sentinel-3":
+        # timeliness is the second last part of the scene id, e.g. ..._0179_105_248_3240_ESA_O_NR_004
+        scene_id_parts = scene_id.split("_")
+        timeliness = CDSE_S3_TIMELINESS.get(scene_id_parts[-2]) if len(scene_id_parts) > 2 else None
+        if timeliness is None:
+            return None
+        params["instrument"] = CDSE_S3_INSTRUMENTS[parts[2]]
+        params["level"] = parts[3].removeprefix("l")
+        params["product"] = parts[4] if len(parts) > 4 else parts[2]
+        params["timeliness"] = timeliness
+    else:
+        return None
+
+    return CDSE_ITEM_URL_TEMPLATES[mission].format(**params)
+
+
 def create_zipped_product_asset(collection_id: str, item_id: str) -> Asset:
     if is_valid_string(collection_id) and is_valid_string(item_id):
         href = os.path.join(ZIPPED_PRODUCT_HREF_BASE, "collections", collection_id, "items", item_id + ".zip")
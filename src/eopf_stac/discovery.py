@@ -0,0 +1,72 @@
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator
+from urllib.parse import urlparse
+
+import fsspec
+
+from eopf_stac.common.constants import PRODUCT_METADATA_PATH
+from eopf_stac.common.filesystem import get_filesystem
+from eopf_stac.common.metadata import ZARR_JSON_KEY
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_EXTENSION = ".zarr"
+# consolidated metadata of Zarr v2 and root metadata of Zarr v3 products
+PRODUCT_MARKERS = [PRODUCT_METADATA_PATH, ZARR_JSON_KEY]
+
+
+def discover_products(prefix: str, max_workers: int = 16) -> Iterator[str]:
+    """Yields the URLs of all EOPF products (*.zarr with a .zmetadata or zarr.json file) below the given prefix.
+
+    The sub-prefixes are listed in parallel and every product is yielded as soon as it has been found,
+    so that processing can start before the listing is complete.
+    """
+    fs, root = get_filesystem(prefix)
+    logger.info(f"Discovering EOPF products below {prefix} ...")
+
+    count = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_scan, fs, root)}
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                products, sub_prefixes = future.result()
+                for product_path in products:
+                    count += 1
+                    yield _to_url(prefix, product_path)
+                for sub_prefix in sub_prefixes:
+                    pending.add(executor.submit(_scan, fs, sub_prefix))
+
+    logger.info(f"Discovered {count} EOPF products below {prefix}")
+
+
+def _scan(fs: fsspec.AbstractFileSystem, path: str) -> tuple[list[str], list[str]]:
+    """Returns the products and the sub-prefixes found at the given path"""
+    path = path.rstrip("/")
+    try:
+        if path.endswith(PRODUCT_EXTENSION):
+            if any(fs.exists(f"{path}/{marker}") for marker in PRODUCT_MARKERS):
+                return ([path], [])
+            logger.warning(f"Skipping {path}: neither {' nor '.join(PRODUCT_MARKERS)} found")
+            return ([], [])
+
+        entries = fs.ls(path, detail=True)
+        sub_prefixes = [e["name"] for e in entries if e.get("type") == "directory"]
+        return ([], sub_prefixes)
+    except Exception as e:
+        logger.warning(f"Unable to list {path}: {str(e)}")
+        return ([], [])
+
+
+def _to_url(prefix: str, path: str) -> str:
+    if prefix.startswith("s3://"):
+        return f"s3://{path}"
+    elif prefix.startswith("http"):
+        o = urlparse(prefix)
+        return f"{o.scheme}://{o.netloc}/{path.lstrip('/')}"
+    elif prefix.startswith("file://"):
+        return f"file://{path}"
+    else:
+        return os.path.normpath(path)
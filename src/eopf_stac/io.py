@@ -1,63 +1,164 @@
 import json
 import logging
 import os
-from urllib.parse import urlparse
+from collections.abc import Mapping
+from functools import partial
+from typing import BinaryIO, Callable
 
-import fsspec
 import pystac
 import requests
-import s3fs
 from pystac.utils import now_in_utc
 
+from eopf_stac.cdse_cache import CdseCache
+from eopf_stac.common import http_client
 from eopf_stac.common.constants import (
     CDSE_STAC_API_URL,
+    CONTENT_HASH_PROPERTY,
+    PRODUCT_METADATA_ASSET_KEY,
     PRODUCT_METADATA_PATH,
     PRODUCT_TYPE_TO_COLLECTION,
     SUPPORTED_PRODUCT_TYPES_S1,
     SUPPORTED_PRODUCT_TYPES_S2,
     SUPPORTED_PRODUCT_TYPES_S3,
 )
-from eopf_stac.common.stac import get_cpm_version, validate_metadata
+from eopf_stac.common.filesystem import get_filesystem
+from eopf_stac.common.metadata import (
+    ROOT_ATTRIBUTES_KEY,
+    ZARR_JSON_KEY,
+    LazyMetadata,
+    get_zarr_format,
+    load_consolidated_metadata,
+    load_zarr_json_metadata,
+)
+from eopf_stac.common.serialization import json_body
+from eopf_stac.common.stac import (
+    get_cdse_stac_item_href,
+    get_cpm_version,
+    set_content_hash,
+    validate_metadata,
+    validate_root_attributes,
+)
+from eopf_stac.metadata_cache import MetadataCache, get_metadata_cache
+from eopf_stac.sentinel1.constants import S1_OCN_PRODUCT_TYPES
 from eopf_stac.sentinel1.stac import create_item as create_item_s1
 from eopf_stac.sentinel2.stac import create_item as create_item_s2
 from eopf_stac.sentinel3.stac import create_item as create_item_s3
 
 logger = logging.getLogger(__name__)
 
+API_ACTION_INSERTED = "inserted"
+API_ACTION_UPDATED = "updated"
+API_ACTION_UNCHANGED = "unchanged"
+
+
+class CdseItemNotFoundError(ValueError):
+    pass
+
+
+def read_metadata(eopf_href: str, metadata_cache: MetadataCache | None = None) -> Mapping:
+    """Reads the metadata of the product.
+
+    Only the small root attributes (.zattrs) are read up front. The consolidated metadata (.zmetadata) with
+    the attributes of all groups and arrays is read on first access to any other entry, which only the item
+    builders of some product types do. The metadata of Zarr v3 products is read from the root zarr.json,
+    which contains the consolidated metadata as well. Other products are read from .zmetadata directly.
+    If the name of the product shows that its item builder needs the attributes of groups and arrays anyway,
+    the consolidated metadata is read right away without reading the root attributes first.
+    The documents are read through the metadata cache configured in the environment, if any.
+    """
+    if metadata_cache is None:
+        metadata_cache = get_metadata_cache()
+
+    product_type = get_product_type_from_href(eopf_href)
+    if product_type is not None and requires_array_attributes(product_type):
+        try:
+            return read_consolidated_metadata(eopf_href, metadata_cache=metadata_cache)
+        except FileNotFoundError:
+            logger.debug(f"No {PRODUCT_METADATA_PATH} found for {eopf_href}, reading {ZARR_JSON_KEY}")
+            return read_zarr_json_metadata(eopf_href, metadata_cache=metadata_cache)
+
+    try:
+        with open_metadata_file(eopf_href, ROOT_ATTRIBUTES_KEY, metadata_cache) as f:
+            root_attributes = json.load(f)
+        return LazyMetadata(
+            validate_root_attributes(root_attributes),
+            partial(read_consolidated_metadata, eopf_href, metadata_cache=metadata_cache),
+        )
+    except FileNotFoundError:
+        logger.debug(f"No {ROOT_ATTRIBUTES_KEY} found for {eopf_href}")
 
-def read_metadata(eopf_href: str) -> dict:
-    path = os.path.join(eopf_href, PRODUCT_METADATA_PATH)
-    fs = fsspec.filesystem("file")
+    try:
+        return read_zarr_json_metadata(eopf_href, metadata_cache=metadata_cache)
+    except FileNotFoundError:
+        logger.debug(f"No {ZARR_JSON_KEY} found for {eopf_href}, reading {PRODUCT_METADATA_PATH}")
 
-    if eopf_href.startswith("s3://"):
-        fs = s3fs.S3FileSystem(anon=False, endpoint_url=os.environ["S3_ENDPOINT_URL"])
-    elif eopf_href.startswith("http"):
-        o = urlparse(eopf_href)
-        endpoint_url = f"{o.scheme}://{o.netloc}"
-        path = os.path.join(o.path, PRODUCT_METADATA_PATH)
-        fs = s3fs.S3FileSystem(anon=True, client_kwargs={"endpoint_url": endpoint_url})
+    return read_consolidated_metadata(eopf_href, metadata_cache=metadata_cache)
 
-        # unregister handler to make boto3 work with CEPH
-        handlers = fs.s3.meta.events._emitter._handlers
-        handlers_to_unregister = handlers.prefix_search("before-parameter-build.s3")
-        handler_to_unregister = handlers_to_unregister[0]
-        fs.s3.meta.events._emitter.unregister("before-parameter-build.s3", handler_to_unregister)
 
-    # -- open product metadata
-    f = fs.open(path, "rb")
-    zmetadata = json.load(f)
+def read_consolidated_metadata(eopf_href: str, metadata_cache: MetadataCache | None = None) -> dict:
+    # -- open product metadata, only the attributes are kept
+    with open_metadata_file(eopf_href, PRODUCT_METADATA_PATH, metadata_cache) as f:
+        zmetadata = load_consolidated_metadata(f)
 
     return validate_metadata(zmetadata)
 
 
-def create_item(metadata: dict, eopf_href: str, source_uri: str | None) -> pystac.Item:
-    # Determine product type
+def read_zarr_json_metadata(eopf_href: str, metadata_cache: MetadataCache | None = None) -> dict:
+    with open_metadata_file(eopf_href, ZARR_JSON_KEY, metadata_cache) as f:
+        return validate_metadata(load_zarr_json_metadata(f), source=ZARR_JSON_KEY)
+
+
+def open_metadata_file(eopf_href: str, name: str, metadata_cache: MetadataCache | None = None) -> BinaryIO:
+    if metadata_cache is not None:
+        return metadata_cache.open(os.path.join(eopf_href, name))
+
+    fs, product_path = get_filesystem(eopf_href)
+    return fs.open(os.path.join(product_path, name), "rb")
+
+
+def get_product_type(metadata: Mapping) -> str:
     product_type = metadata[".zattrs"]["stac_discovery"].get("properties", {}).get("product:type")
     # workaround eopf-cpm 2.4.x
     if product_type is None:
         product_type = metadata[".zattrs"]["stac_discovery"].get("properties", {}).get("eopf:type")
     if product_type is None:
         raise ValueError("No product type in stac_discovery metadata")
+    return product_type
+
+
+def get_product_type_from_href(eopf_href: str) -> str | None:
+    """Returns the product type from the name of the product, e.g. S02MSIL2A_20250109T100401_0000_A122_TC06.zarr
+
+    None if the name does not start with a supported product type.
+    """
+    name = os.path.basename(eopf_href.rstrip("/"))
+    product_type = name.split("_", 1)[0]
+    return product_type if product_type in PRODUCT_TYPE_TO_COLLECTION else None
+
+
+def requires_array_attributes(product_type: str) -> bool:
+    """Returns True if the item builder of the product type reads the attributes of groups and arrays"""
+    return product_type in SUPPORTED_PRODUCT_TYPES_S2 or product_type in S1_OCN_PRODUCT_TYPES
+
+
+def create_item(
+    metadata: Mapping,
+    eopf_href: str,
+    source_uri: str | None,
+    cdse_resolver: Callable[[str], str | None] | None = None,
+    cdse_offline: bool = False,
+) -> pystac.Item:
+    """Creates the STAC item for the EOPF product
+
+    The link to the STAC item of the source scene at CDSE is looked up with the cdse_resolver, which
+    defaults to a request to the CDSE STAC API. With cdse_offline the link is built from the URL template
+    of the mission instead, without checking that the STAC item exists.
+    """
+    if cdse_resolver is None:
+        cdse_resolver = get_source_stac_item_url
+
+    # Determine product type
+    product_type = get_product_type(metadata)
     logger.info(f"Product type is {product_type}")
 
     # Extract CPM version from eopf_href
@@ -75,7 +176,10 @@ def create_item(metadata: dict, eopf_href: str, source_uri: str | None) -> pysta
 
     cdse_scene_href = None
     if cdse_scene_id is not None:
-        cdse_scene_href = get_source_stac_item_url(cdse_scene_id)
+        if cdse_offline:
+            cdse_scene_href = get_cdse_stac_item_href(product_type, cdse_scene_id)
+        else:
+            cdse_scene_href = cdse_resolver(cdse_scene_id)
         logger.info(f"CDSE STAC item URL of source scene is {cdse_scene_href}")
 
     if cdse_scene_href is None:
@@ -121,32 +225,78 @@ def create_item(metadata: dict, eopf_href: str, source_uri: str | None) -> pysta
 
     item.collection_id = collection
 
+    metadata_asset = item.assets.get(PRODUCT_METADATA_ASSET_KEY)
+    if metadata_asset is not None and get_zarr_format(metadata) == 3:
+        # Zarr v3 products have no .zmetadata, the consolidated metadata is part of the root zarr.json
+        metadata_asset.href = os.path.join(eopf_href, ZARR_JSON_KEY)
+
     logger.info("Sucessfully created STAC item")
     return item
 
 
-def register_item(item: pystac.Item, stac_api_url: str) -> pystac.Item:
+def get_stac_auth() -> tuple[str, str] | None:
+    if "STAC_INGEST_USER" in os.environ and "STAC_INGEST_PASS" in os.environ:
+        return (os.environ["STAC_INGEST_USER"], os.environ["STAC_INGEST_PASS"])
+    return None
+
+
+def create_session() -> requests.Session:
+    return http_client.create_session(auth=get_stac_auth())
+
+
+def register_item(
+    item: pystac.Item, stac_api_url: str, session: requests.Session | None = None, skip_unchanged: bool = False
+) -> pystac.Item:
+    upsert_item(item=item, stac_api_url=stac_api_url, session=session, skip_unchanged=skip_unchanged)
+    return item
+
+
+def upsert_item(
+    item: pystac.Item, stac_api_url: str, session: requests.Session | None = None, skip_unchanged: bool = False
+) -> str:
+    """Inserts or updates the STAC item in the catalog and returns the action taken.
+
+    With skip_unchanged a content hash is stored in the item and an existing item is only updated if its
+    content hash differs. This costs one read per item but avoids writing unchanged items again.
+    """
     logger.info(f"Inserting STAC item into catalog {stac_api_url} ...")
 
     item.remove_links("self")
-    session = requests.Session()
-    if "STAC_INGEST_USER" in os.environ and "STAC_INGEST_PASS" in os.environ:
-        session.auth = (os.environ["STAC_INGEST_USER"], os.environ["STAC_INGEST_PASS"])
-    api_action = "inserted"
-    r = session.post(f"{stac_api_url}/collections/{item.collection_id}/items", json=item.to_dict())
-    if r.status_code == 409:
+    if session is None:
+        session = http_client.get_session(auth=get_stac_auth())
+    items_url = f"{stac_api_url}/collections/{item.collection_id}/items"
+
+    # the dictionary of the item is built once and updated along with the item
+    item_dict = item.to_dict()
+    exists = None
+    if skip_unchanged:
+        content_hash = set_content_hash(item, item_dict)
+        r = session.get(f"{items_url}/{item.id}")
+        if r.status_code == 200:
+            exists = True
+            if r.json().get("properties", {}).get(CONTENT_HASH_PROPERTY) == content_hash:
+                logger.info(f"STAC item {item.id} in collection {item.collection_id} is unchanged")
+                return API_ACTION_UNCHANGED
+        elif r.status_code == 404:
+            exists = False
+        else:
+            r.raise_for_status()
+
+    api_action = API_ACTION_INSERTED
+    r = None
+    if not exists:
+        r = session.post(items_url, **json_body(item_dict))
+    if exists or r.status_code == 409:
         # STAC item already exists -> update
         item.common_metadata.updated = now_in_utc()
-        api_action = "updated"
-        r = session.put(
-            f"{stac_api_url}/collections/{item.collection_id}/items/{item.id}",
-            json=item.to_dict(),
-        )
+        item_dict["properties"]["updated"] = item.properties["updated"]
+        api_action = API_ACTION_UPDATED
+        r = session.put(f"{items_url}/{item.id}", **json_body(item_dict))
     r.raise_for_status()
 
     logger.info(f"Successfully {api_action} STAC item {item.id} in collection {item.collection_id}")
 
-    return item
+    return api_action
 
 
 def get_source_identifier(source_uri: str | None) -> str:
@@ -160,10 +310,26 @@ def get_source_identifier(source_uri: str | None) -> str:
     return source_identifier
 
 
-def get_source_stac_item_url(source_scene_id: str) -> str | None:
+def get_source_stac_item_url(source_scene_id: str, cache: CdseCache | None = None) -> str | None:
+    """Returns the URL of the STAC item of the source scene at CDSE or None if it cannot be determined.
+
+    If a cache is given, it is used for the lookup and scenes not found at CDSE are cached as well.
+    Other errors (e.g. timeouts) are not cached.
+    """
+    if cache is not None:
+        found, source_stac_item_url = cache.get(source_scene_id)
+        if found:
+            return source_stac_item_url
+
     source_stac_item_url = None
     try:
         source_stac_item_url = get_cdse_stac_item_url(source_scene_id)
+        if cache is not None:
+            cache.put(source_scene_id, source_stac_item_url)
+    except CdseItemNotFoundError as e:
+        logger.warning(str(e))
+        if cache is not None:
+            cache.put(source_scene_id, None)
     except Exception as e:
         logger.warning(str(e))
 
@@ -174,11 +340,58 @@ def get_cdse_stac_item_url(scene_id: str) -> str:
     # https://stac.dataspace.copernicus.eu/v1/search?ids=
     # https://stac.dataspace.copernicus.eu/v1/search?ids=S2B_MSIL1C_20240428T102559_N0510_R108_T32UPC_20240428T123125
     params = {"ids": scene_id}
-    repsonse = requests.get(url=f"{CDSE_STAC_API_URL}/search", params=params)
+    repsonse = http_client.get_session().get(url=f"{CDSE_STAC_API_URL}/search", params=params)
     repsonse.raise_for_status()
 
+    return get_self_href_from_search_response(repsonse.json(), scene_id)
+
+
+def get_cdse_stac_item_urls(
+    scene_ids: list[str], chunk_size: int = 100, session: requests.Session | None = None
+) -> dict[str, str]:
+    """Returns the STAC item URLs of many scenes at CDSE, searching for up to chunk_size ids per request.
+
+    The ids are sent in the JSON body of a POST search, since a GET search with hundreds of ids exceeds the
+    maximum URL length of the API. Scenes which are not found at CDSE are missing in the returned dict.
+    """
+    if session is None:
+        session = http_client.get_session()
+
+    item_urls = {}
+    for i in range(0, len(scene_ids), chunk_size):
+        chunk = scene_ids[i : i + chunk_size]
+        url = f"{CDSE_STAC_API_URL}/search"
+        body = {"ids": chunk, "limit": len(chunk)}
+        while url is not None:
+            if body is not None:
+                response = session.post(url=url, **json_body(body))
+            else:
+                response = session.get(url=url)
+            response.raise_for_status()
+            item_collection_dict = response.json()
+            for item_dict in item_collection_dict["features"]:
+                for link in item_dict["links"]:
+                    if link.get("rel") == "self" and len(link.get("href") or "") > 0:
+                        item_urls[item_dict["id"]] = link["href"]
+
+            # follow the link to the next page, which is either a GET link containing all search parameters
+            # or a POST link with the body of the next request, which may need to be merged with the current one
+            next_links = [link for link in item_collection_dict.get("links", []) if link.get("rel") == "next"]
+            if len(next_links) == 0:
+                url = None
+            elif next_links[0].get("method", "GET").upper() == "POST":
+                url = next_links[0]["href"]
+                next_body = next_links[0].get("body") or {}
+                body = {**body, **next_body} if next_links[0].get("merge", False) else next_body
+            else:
+                url = next_links[0]["href"]
+                body = None
+
+    return item_urls
+
+
+def get_self_href_from_search_response(item_collection_dict: dict, scene_id: str) -> str:
     item_url = None
-    item_collection_dict = repsonse.json()
     if len(item_collection_dict["features"]) > 0:
         item_dict = item_collection_dict["features"][0]
         for link in item_dict["links"]:
@@ -189,6 +402,6 @@ def get_cdse_stac_item_url(scene_id: str) -> str:
                     item_url = href
 
     if item_url is None:
-        raise ValueError(f"Failed to find STAC item for scene id {scene_id} at CDSE")
+        raise CdseItemNotFoundError(f"Failed to find STAC item for scene id {scene_id} at CDSE")
 
     return item_url
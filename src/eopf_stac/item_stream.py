@@ -0,0 +1,365 @@
+import gzip
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+from typing import Callable, Protocol
+
+from fsspec.implementations.local import LocalFileSystem
+
+from eopf_stac.common.filesystem import get_filesystem
+from eopf_stac.common.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSIONS = [COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZSTD]
+
+FILE_EXTENSIONS = {COMPRESSION_NONE: ".ndjson", COMPRESSION_GZIP: ".ndjson.gz", COMPRESSION_ZSTD: ".ndjson.zst"}
+
+DEFAULT_MAX_FILE_SIZE = 256 * 1024 * 1024
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+PGSTAC_METHOD_INSERT = "insert"
+PGSTAC_METHOD_IGNORE = "ignore"
+PGSTAC_METHOD_UPSERT = "upsert"
+PGSTAC_METHODS = [PGSTAC_METHOD_INSERT, PGSTAC_METHOD_IGNORE, PGSTAC_METHOD_UPSERT]
+PGSTAC_STAGING_TABLES = {
+    PGSTAC_METHOD_INSERT: "items_staging",
+    PGSTAC_METHOD_IGNORE: "items_staging_ignore",
+    PGSTAC_METHOD_UPSERT: "items_staging_upsert",
+}
+DEFAULT_PGSTAC_BATCH_SIZE = 1000
+
+
+class ItemWriter(Protocol):
+    """Interface of the writers which take the STAC items of run_batch instead of the workers.
+
+    The methods add, flush_expired, flush and close return the items which could not be written together with
+    the error, so the results of their products can be marked as failed. flush_expired writes the pending items
+    which are older than the flush interval of the writer, if it has one, and is called regularly by run_batch.
+    If on_written is set, it is called with the (collection_id, item_id) of the items which have been written,
+    e.g. once a file has been closed or a batch has been committed, so the results can be recorded in the journal.
+    """
+
+    on_written: Callable[[list[tuple[str, str]]], None] | None
+
+    def add(self, item: dict) -> list[tuple[dict, str]]: ...
+
+    def flush_expired(self) -> list[tuple[dict, str]]: ...
+
+    def flush(self, collection_id: str | None = None) -> list[tuple[dict, str]]: ...
+
+    def close(self) -> list[tuple[dict, str]]: ...
+
+
+def get_next_file_index(prefix: str, extension: str) -> int:
+    """Returns the index after the last existing file {prefix}-{index:05d}{extension}, 0 if there is none"""
+    fs, fs_path = get_filesystem(prefix)
+    base_name = posixpath.basename(fs_path)
+    next_index = 0
+    for path in fs.glob(f"{fs_path}-*{extension}"):
+        index = posixpath.basename(path)[len(base_name) + 1 : -len(extension)]
+        if index.isdigit():
+            next_index = max(next_index, int(index) + 1)
+    return next_index
+
+
+class NdjsonItemWriter:
+    """Writes STAC items as newline delimited JSON (one compact item per line) to a series of files.
+
+    The files are named {prefix}-{index:05d}.ndjson with the extension of the compression and may be local
+    paths or s3/http URLs. The numbering continues after the existing files of the prefix, so that a resumed
+    run does not overwrite the files of a previous run. A new file is started when the current file contains
+    max_size bytes of (uncompressed) JSON or max_items items, 0 disables the limit. The files can be loaded
+    into pgstac with pypgstac load. The items of a file are passed to on_written once it has been closed.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        max_size: int = DEFAULT_MAX_FILE_SIZE,
+        max_items: int = 0,
+        compression: str = COMPRESSION_NONE,
+    ) -> None:
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression '{compression}', expected one of {COMPRESSIONS}")
+        if compression == COMPRESSION_ZSTD:
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                raise ValueError("The zstd compression requires the package zstandard") from None
+        self.prefix = prefix
+        self.max_size = max_size
+        self.max_items = max_items
+        self.compression = compression
+        self.paths: list[str] = []
+        self._file = None
+        self._raw_file = None
+        self._size = 0
+        self._items = 0
+        self._keys: list[tuple[str, str]] = []
+        self._first_index: int | None = None
+        self.on_written: Callable[[list[tuple[str, str]]], None] | None = None
+
+    def add(self, item: dict) -> list[tuple[dict, str]]:
+        item["links"] = [link for link in item.get("links", []) if link.get("rel") != "self"]
+        line = dumps(item) + b"\n"
+        try:
+            if self._file is not None and self._is_full(len(line)):
+                self._close_file()
+            if self._file is None:
+                self._open_file()
+            self._file.write(line)
+            self._size += len(line)
+            self._items += 1
+            if self.on_written is not None:
+                self._keys.append((item.get("collection"), item.get("id")))
+        except Exception as e:
+            logger.error(f"Failed to write STAC item {item.get('id')} to {self.paths[-1]}: {str(e)}")
+            return [(item, str(e))]
+        return []
+
+    def flush_expired(self) -> list[tuple[dict, str]]:
+        return []
+
+    def flush(self, collection_id: str | None = None) -> list[tuple[dict, str]]:
+        if self._file is not None:
+            self._file.flush()
+        return []
+
+    def close(self) -> list[tuple[dict, str]]:
+        if self._file is not None:
+            self._close_file()
+        return []
+
+    def _is_full(self, size: int) -> bool:
+        if self.max_items > 0 and self._items >= self.max_items:
+            return True
+        return self.max_size > 0 and self._size + size > self.max_size
+
+    def _open_file(self) -> None:
+        extension = FILE_EXTENSIONS[self.compression]
+        if self._first_index is None:
+            self._first_index = get_next_file_index(self.prefix, extension)
+        path = f"{self.prefix}-{self._first_index + len(self.paths):05d}{extension}"
+        self.paths.append(path)
+        fs, fs_path = get_filesystem(path)
+        if isinstance(fs, LocalFileSystem):
+            fs.makedirs(fs._parent(fs_path), exist_ok=True)
+        self._raw_file = fs.open(fs_path, "wb")
+        if self.compression == COMPRESSION_GZIP:
+            self._file = gzip.GzipFile(fileobj=self._raw_file, mode="wb")
+        elif self.compression == COMPRESSION_ZSTD:
+            import zstandard
+
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw_file, closefd=False)
+        else:
+            self._file = self._raw_file
+        self._size = 0
+        self._items = 0
+
+    def _close_file(self) -> None:
+        self._file.close()
+        if self._raw_file is not self._file:
+            self._raw_file.close()
+        logger.info(f"Wrote {self._items} STAC items to {self.paths[-1]}")
+        self._file = None
+        self._raw_file = None
+        keys = self._keys
+        self._keys = []
+        if self.on_written is not None and len(keys) > 0:
+            self.on_written(keys)
+
+
+class GeoParquetItemWriter:
+    """Writes STAC items as stac-geoparquet, one file {prefix}/{collection_id}.parquet per collection.
+
+    If the file already exists, e.g. from a previous run, the items are written to the next free file
+    {prefix}/{collection_id}-{index:05d}.parquet instead.
+
+    The items are spooled to a local NDJSON file per collection and converted when the writer is closed. The
+    conversion infers a common schema of all items of a collection in a first pass and then writes row groups
+    of row_group_size items, so memory stays bounded. The prefix may be a local path or an s3/http URL.
+    Requires the optional packages stac-geoparquet and pyarrow.
+    The items of a collection are passed to on_written once its file has been written.
+    """
+
+    def __init__(self, prefix: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE, spool_dir: str | None = None) -> None:
+        try:
+            import stac_geoparquet.arrow  # noqa: F401
+        except ImportError:
+            raise ValueError("The GeoParquet output requires the packages stac-geoparquet and pyarrow") from None
+        self.prefix = prefix.rstrip("/")
+        self.row_group_size = row_group_size
+        self.paths: list[str] = []
+        self._spool_dir = tempfile.mkdtemp(prefix="eopf-stac-", dir=spool_dir)
+        self._spools: dict[str, NdjsonItemWriter] = {}
+        self._ids: dict[str, list[str]] = {}
+        self.on_written: Callable[[list[tuple[str, str]]], None] | None = None
+
+    def add(self, item: dict) -> list[tuple[dict, str]]:
+        collection_id = item["collection"]
+        if collection_id not in self._spools:
+            self._spools[collection_id] = NdjsonItemWriter(os.path.join(self._spool_dir, collection_id), max_size=0)
+            self._ids[collection_id] = []
+        failed = self._spools[collection_id].add(item)
+        if len(failed) == 0:
+            self._ids[collection_id].append(item["id"])
+        return failed
+
+    def flush_expired(self) -> list[tuple[dict, str]]:
+        return []
+
+    def flush(self, collection_id: str | None = None) -> list[tuple[dict, str]]:
+        for spool in self._spools.values():
+            spool.flush()
+        return []
+
+    def close(self) -> list[tuple[dict, str]]:
+        failed = []
+        try:
+            for collection_id, spool in self._spools.items():
+                spool.close()
+                try:
+                    self._convert(collection_id, spool.paths[0])
+                except Exception as e:
+                    logger.error(f"Failed to write STAC items of collection {collection_id}: {str(e)}")
+                    failed.extend(({"collection": collection_id, "id": i}, str(e)) for i in self._ids[collection_id])
+                    continue
+                if self.on_written is not None:
+                    self.on_written([(collection_id, i) for i in self._ids[collection_id]])
+        finally:
+            self._spools.clear()
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+        return failed
+
+    def _convert(self, collection_id: str, ndjson_path: str) -> None:
+        from stac_geoparquet.arrow import parse_stac_ndjson_to_parquet
+
+        path = f"{self.prefix}/{collection_id}.parquet"
+        fs, fs_path = get_filesystem(path)
+        if fs.exists(fs_path):
+            index = max(get_next_file_index(f"{self.prefix}/{collection_id}", ".parquet"), 1)
+            path = f"{self.prefix}/{collection_id}-{index:05d}.parquet"
+            fs, fs_path = get_filesystem(path)
+        local_path = f"{ndjson_path}.parquet"
+        parse_stac_ndjson_to_parquet(ndjson_path, local_path, chunk_size=self.row_group_size)
+
+        if isinstance(fs, LocalFileSystem):
+            fs.makedirs(fs._parent(fs_path), exist_ok=True)
+        fs.put_file(local_path, fs_path)
+        self.paths.append(path)
+        logger.info(f"Wrote {len(self._ids[collection_id])} STAC items to {path}")
+
+
+class PartitionedNdjsonItemWriter:
+    """Writes STAC items as NDJSON files partitioned by collection: {prefix}/{collection_id}/items-00000.ndjson
+
+    Each partition is written with an NdjsonItemWriter with the given options. The files of a partition can be
+    loaded with the pgstac loader (pypgstac load items) after the collection has been created.
+    """
+
+    def __init__(self, prefix: str, **kwargs) -> None:
+        self.prefix = prefix.rstrip("/")
+        self.kwargs = kwargs
+        self._writers: dict[str, NdjsonItemWriter] = {}
+        self.on_written: Callable[[list[tuple[str, str]]], None] | None = None
+
+    @property
+    def paths(self) -> list[str]:
+        return [path for writer in self._writers.values() for path in writer.paths]
+
+    def add(self, item: dict) -> list[tuple[dict, str]]:
+        collection_id = item["collection"]
+        if collection_id not in self._writers:
+            self._writers[collection_id] = NdjsonItemWriter(f"{self.prefix}/{collection_id}/items", **self.kwargs)
+            self._writers[collection_id].on_written = self.on_written
+        return self._writers[collection_id].add(item)
+
+    def flush_expired(self) -> list[tuple[dict, str]]:
+        return []
+
+    def flush(self, collection_id: str | None = None) -> list[tuple[dict, str]]:
+        for writer in self._writers.values():
+            writer.flush()
+        return []
+
+    def close(self) -> list[tuple[dict, str]]:
+        failed = []
+        for writer in self._writers.values():
+            failed.extend(writer.close())
+        return failed
+
+
+class PgstacItemWriter:
+    """Loads STAC items directly into a pgstac database with COPY in batches of batch_size items.
+
+    The items are copied into the staging table of pgstac for the given method (insert, ignore or upsert), which
+    moves them into the partitions of the items table like the pgstac loader does. The collections must exist.
+    Requires the optional package psycopg unless a connection is given.
+    The items of a batch are passed to on_written once it has been committed.
+    """
+
+    def __init__(
+        self,
+        dsn: str | None = None,
+        batch_size: int = DEFAULT_PGSTAC_BATCH_SIZE,
+        method: str = PGSTAC_METHOD_UPSERT,
+        connection=None,
+    ) -> None:
+        if method not in PGSTAC_METHODS:
+            raise ValueError(f"Unsupported pgstac load method '{method}', expected one of {PGSTAC_METHODS}")
+        self.batch_size = batch_size
+        self.method = method
+        self._owns_connection = connection is None
+        if connection is None:
+            try:
+                import psycopg
+            except ImportError:
+                raise ValueError("Loading STAC items into pgstac requires the package psycopg") from None
+            connection = psycopg.connect(dsn)
+        self.connection = connection
+        self._pending: list[dict] = []
+        self.on_written: Callable[[list[tuple[str, str]]], None] | None = None
+
+    def add(self, item: dict) -> list[tuple[dict, str]]:
+        item["links"] = [link for link in item.get("links", []) if link.get("rel") != "self"]
+        self._pending.append(item)
+        if len(self._pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush_expired(self) -> list[tuple[dict, str]]:
+        return []
+
+    def flush(self, collection_id: str | None = None) -> list[tuple[dict, str]]:
+        items = self._pending
+        self._pending = []
+        if len(items) == 0:
+            return []
+
+        table = PGSTAC_STAGING_TABLES[self.method]
+        try:
+            with self.connection.cursor() as cursor:
+                with cursor.copy(f"COPY pgstac.{table} (content) FROM STDIN") as copy:
+                    for item in items:
+                        copy.write_row((dumps(item).decode("utf-8"),))
+            self.connection.commit()
+            logger.info(f"Successfully loaded {len(items)} STAC items into pgstac")
+        except Exception as e:
+            self.connection.rollback()
+            logger.error(f"Failed to load {len(items)} STAC items into pgstac: {str(e)}")
+            return [(item, str(e)) for item in items]
+        if self.on_written is not None:
+            self.on_written([(item["collection"], item["id"]) for item in items])
+        return []
+
+    def close(self) -> list[tuple[dict, str]]:
+        failed = self.flush()
+        if self._owns_connection:
+            self.connection.close()
+        return failed
@@ -0,0 +1,96 @@
+import logging
+import sqlite3
+import time
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+
+
+class BatchJournal:
+    """Checkpoint journal of the products of batch runs backed by a SQLite database.
+
+    The journal records the status of each product URL together with the hash of its metadata, the id of the
+    created STAC item and the action taken in the catalog (inserted, updated or unchanged). The URLs and hashes
+    of the completed products are loaded into memory when the journal is opened. A restarted run reads the
+    metadata of the completed products again and skips them if the hash is unchanged, products whose metadata
+    changed and failed products are processed again.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.skipped = 0
+        self._connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # a product recorded just before a crash may be lost, it is processed again on restart
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS products (
+                url TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                metadata_hash TEXT,
+                item_id TEXT,
+                collection_id TEXT,
+                action TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        rows = self._connection.execute("SELECT url, metadata_hash FROM products WHERE status = ?", (STATUS_SUCCESS,))
+        self._completed: dict[str, str | None] = {url: metadata_hash for url, metadata_hash in rows}
+
+    def is_completed(self, url: str) -> bool:
+        return url in self._completed
+
+    def get_metadata_hash(self, url: str) -> str | None:
+        """Returns the metadata hash of a completed product, None if it has not been completed or has no hash"""
+        return self._completed.get(url)
+
+    def filter(self, products: Iterable[tuple]) -> Iterator[tuple]:
+        """Yields the products whose URL (first element) has not been completed yet or has to be verified.
+
+        Completed products are only yielded if they have a metadata hash, which is compared with the hash of
+        the current metadata when they are processed (see get_metadata_hash).
+        """
+        for product in products:
+            if product[0] in self._completed and self._completed[product[0]] is None:
+                self.skip(product[0])
+                continue
+            yield product
+
+    def skip(self, url: str) -> None:
+        """Counts a completed product which is skipped in this run"""
+        self.skipped += 1
+        logger.debug(f"Skipping {url}, completed in a previous run")
+
+    def record(
+        self,
+        url: str,
+        status: str,
+        metadata_hash: str | None = None,
+        item_id: str | None = None,
+        collection_id: str | None = None,
+        action: str | None = None,
+        error: str | None = None,
+    ) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO products "
+            "(url, status, metadata_hash, item_id, collection_id, action, error, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (url, status, metadata_hash, item_id, collection_id, action, error, time.time()),
+        )
+        if status == STATUS_SUCCESS:
+            self._completed[url] = metadata_hash
+        else:
+            self._completed.pop(url, None)
+
+    def counts(self) -> dict[str, int]:
+        rows = self._connection.execute("SELECT status, COUNT(*) FROM products GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        self._connection.close()
@@ -2,10 +2,33 @@ import argparse
 import json
 import logging
 import os
+from functools import partial
 from sys import exit
-from typing import Optional
+from typing import Iterable, Optional
 
-from eopf_stac.io import create_item, read_metadata, register_item
+from eopf_stac.aio import run_async_batch, verify_cdse_links
+from eopf_stac.batch import log_summary, read_manifest, run_batch
+from eopf_stac.catalog import BULK_METHOD_BULK_ITEMS, BULK_METHODS, BulkItemWriter
+from eopf_stac.cdse_cache import DEFAULT_NEGATIVE_TTL, DEFAULT_TTL, CdseCache, open_cdse_cache
+from eopf_stac.common.http_client import deadline, get_http_settings
+from eopf_stac.discovery import discover_products
+from eopf_stac.io import create_item, get_source_stac_item_url, read_metadata, register_item
+from eopf_stac.item_stream import (
+    COMPRESSION_NONE,
+    COMPRESSIONS,
+    DEFAULT_MAX_FILE_SIZE,
+    DEFAULT_PGSTAC_BATCH_SIZE,
+    DEFAULT_ROW_GROUP_SIZE,
+    PGSTAC_METHOD_UPSERT,
+    PGSTAC_METHODS,
+    GeoParquetItemWriter,
+    ItemWriter,
+    NdjsonItemWriter,
+    PartitionedNdjsonItemWriter,
+    PgstacItemWriter,
+)
+from eopf_stac.journal import BatchJournal
+from eopf_stac.worker import IngestionWorker, WorkQueue
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +38,7 @@ ENV_STAC_INGEST_PASS: str = "STAC_INGEST_PASS"
 ENV_S3_ENDPOINT_URL: str = "S3_ENDPOINT_URL"
 ENV_AWS_ACCESS_KEY_ID: str = "AWS_ACCESS_KEY_ID"
 ENV_AWS_SECRET_ACCESS_KEY: str = "AWS_SECRET_ACCESS_KEY"
+ENV_PGSTAC_DSN: str = "PGSTAC_DSN"
 
 
 def configure_logging(level: int):
@@ -52,9 +76,133 @@ def exit_on_error(exit_code: int = 1):
     exit(exit_code)
 
 
+def run_batch_mode(products: Iterable[tuple[str, str | None]], args, env) -> int:
+    stac_api_url = None if args.dry_run or has_output_writer(args) else env[ENV_STAC_API_URL]
+    cdse_cache = get_cdse_cache(args)
+    journal = BatchJournal(args.journal) if args.journal is not None else None
+    if args.use_async:
+        logger.info(f"Processing products with up to {args.concurrency} concurrent products ...")
+        results = run_async_batch(
+            products=products,
+            concurrency=args.concurrency,
+            stac_api_url=stac_api_url,
+            skip_unchanged=args.skip_unchanged,
+            cdse_cache=cdse_cache,
+            cdse_batch_size=args.cdse_batch_size,
+            cdse_offline=args.cdse_offline,
+            journal=journal,
+        )
+    else:
+        writer: ItemWriter | None = None
+        if args.output_pgstac:
+            if args.dry_run:
+                logger.info("Dry run, the STAC items are not loaded into pgstac")
+            else:
+                if ENV_PGSTAC_DSN not in env:
+                    raise ValueError(f"The enviroment variable {ENV_PGSTAC_DSN} is missing")
+                writer = PgstacItemWriter(
+                    dsn=env[ENV_PGSTAC_DSN], batch_size=args.pgstac_batch_size, method=args.pgstac_method
+                )
+        elif args.output_geoparquet is not None:
+            writer = GeoParquetItemWriter(prefix=args.output_geoparquet, row_group_size=args.geoparquet_row_group_size)
+        elif args.output_ndjson is not None:
+            ndjson_writer = PartitionedNdjsonItemWriter if args.ndjson_partition else NdjsonItemWriter
+            writer = ndjson_writer(
+                prefix=args.output_ndjson,
+                max_size=args.ndjson_max_size * 1024 * 1024,
+                max_items=args.ndjson_max_items,
+                compression=args.ndjson_compression,
+            )
+        elif stac_api_url is not None and args.bulk_size > 0:
+            writer = BulkItemWriter(
+                stac_api_url=stac_api_url,
+                batch_size=args.bulk_size,
+                flush_interval=args.flush_interval,
+                method=args.bulk_method,
+                skip_unchanged=args.skip_unchanged,
+            )
+        logger.info(f"Processing products with {args.jobs} job(s) ...")
+        results = run_batch(
+            products=products,
+            jobs=args.jobs,
+            stac_api_url=stac_api_url,
+            writer=writer,
+            skip_unchanged=args.skip_unchanged,
+            cdse_cache=cdse_cache,
+            cdse_batch_size=args.cdse_batch_size,
+            cdse_offline=args.cdse_offline,
+            journal=journal,
+        )
+    if journal is not None:
+        logger.info(
+            f"Skipped {journal.skipped} products completed in previous runs, journal status: {journal.counts()}"
+        )
+        journal.close()
+    if args.cdse_verify > 0:
+        verify_cdse_links([r.cdse_href for r in results if r.cdse_href is not None], fraction=args.cdse_verify)
+    return log_summary(results)
+
+
+def has_output_writer(args) -> bool:
+    return get_output_writer_count(args) > 0
+
+
+def get_output_writer_count(args) -> int:
+    return sum([args.output_ndjson is not None, args.output_geoparquet is not None, args.output_pgstac])
+
+
+def get_cdse_cache(args) -> CdseCache | None:
+    if args.cdse_cache is None:
+        return None
+    return open_cdse_cache(
+        args.cdse_cache, ttl=args.cdse_cache_ttl * 3600, negative_ttl=args.cdse_cache_negative_ttl * 3600
+    )
+
+
+def get_batch_products(args, dry_run: bool, env) -> Iterable[tuple[str, str | None]]:
+    if args.manifest is not None:
+        products = list(read_manifest(args.manifest))
+        for url, _ in products:
+            validate_env(url, dry_run, None, env)
+        logger.info(f"Found {len(products)} products in {args.manifest}")
+        return products
+    elif args.discover is not None:
+        validate_env(args.discover, dry_run, None, env)
+        urls = discover_products(args.discover, max_workers=args.discovery_threads)
+        return ((url, None) for url in urls)
+    else:
+        validate_env(args.URL, dry_run, None, env)
+        return [(args.URL, args.source_uri)]
+
+
+def enqueue_products(queue_path: str, products: Iterable[tuple[str, str | None]]) -> None:
+    queue = WorkQueue(queue_path)
+    count = 0
+    for url, source_uri in products:
+        queue.enqueue(url, source_uri)
+        count += 1
+    logger.info(f"Added {count} products to queue {queue_path}, queue status: {queue.counts()}")
+    queue.close()
+
+
+def run_worker(args, env) -> None:
+    validate_env("", args.dry_run, None, env)
+    stac_api_url = None if args.dry_run else env[ENV_STAC_API_URL]
+    queue = WorkQueue(args.queue)
+    IngestionWorker(
+        queue=queue,
+        stac_api_url=stac_api_url,
+        poll_interval=args.poll_interval,
+        skip_unchanged=args.skip_unchanged,
+        cdse_cache=get_cdse_cache(args),
+        cdse_offline=args.cdse_offline,
+    ).run()
+    queue.close()
+
+
 def main():
     parser = argparse.ArgumentParser("eopf-stac.py")
-    parser.add_argument("URL", help="Local file path or URL to the EOPF product", type=str)
+    parser.add_argument("URL", help="Local file path or URL to the EOPF product", type=str, nargs="?")
     parser.add_argument(
         "--source-uri",
         help="Reference to the original product which was input for the EOPF conversion",
@@ -64,32 +212,251 @@ def main():
         "--dry-run", help="Create STAC item without trying to insert it into the catalog", action="store_true"
     )
     parser.add_argument("--output-file", help="Save the STAC item as JSON to the specified file path", type=str)
+    parser.add_argument(
+        "--manifest",
+        help="Process all products listed in the given file (one URL and optional source URI per line)",
+        type=str,
+    )
+    parser.add_argument(
+        "--discover",
+        help="Process all EOPF products found below the given prefix (local directory or s3/http URL)",
+        type=str,
+    )
+    parser.add_argument(
+        "--jobs", help="Number of worker processes used with --manifest or --discover", type=int, default=1
+    )
+    parser.add_argument(
+        "--async",
+        help="Process the products of --manifest or --discover concurrently with asyncio in a single process",
+        action="store_true",
+        dest="use_async",
+    )
+    parser.add_argument(
+        "--concurrency", help="Maximum number of products in flight with --async", type=int, default=100
+    )
+    parser.add_argument(
+        "--bulk-size",
+        help="Write the STAC items of --manifest or --discover in batches of the given size per collection",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--flush-interval",
+        help="Maximum number of seconds STAC items are buffered with --bulk-size",
+        type=float,
+        default=10,
+    )
+    parser.add_argument(
+        "--bulk-method",
+        help="Endpoint used with --bulk-size: stac-fastapi bulk_items or POST of an ItemCollection",
+        choices=BULK_METHODS,
+        default=BULK_METHOD_BULK_ITEMS,
+    )
+    parser.add_argument(
+        "--discovery-threads",
+        help="Number of sub-prefixes listed in parallel with --discover",
+        type=int,
+        default=16,
+    )
+    parser.add_argument(
+        "--queue",
+        help="SQLite work queue. The given products are added to the queue instead of being processed",
+        type=str,
+    )
+    parser.add_argument(
+        "--daemon", help="Keep running and process all products added to the work queue", action="store_true"
+    )
+    parser.add_argument(
+        "--poll-interval", help="Seconds to wait with --daemon if the queue is empty", type=float, default=5
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        help="Do not write STAC items which are unchanged in the catalog (compared by content hash)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cdse-cache",
+        help="SQLite database to cache the STAC item URLs of the source scenes at CDSE",
+        type=str,
+    )
+    parser.add_argument(
+        "--cdse-cache-ttl", help="Hours a cached STAC item URL is valid", type=float, default=DEFAULT_TTL / 3600
+    )
+    parser.add_argument(
+        "--cdse-cache-negative-ttl",
+        help="Hours a source scene which was not found at CDSE is not looked up again",
+        type=float,
+        default=DEFAULT_NEGATIVE_TTL / 3600,
+    )
+    parser.add_argument(
+        "--cdse-batch-size",
+        help="Number of source scenes looked up at CDSE with one request with --manifest (0 to disable)",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--cdse-offline",
+        help="Build the links to the source scenes at CDSE from URL templates without requests to CDSE",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cdse-verify",
+        help="Fraction of the links to CDSE which are verified after --manifest or --discover (0 to 1)",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--output-ndjson",
+        help="Write the STAC items of --manifest or --discover as NDJSON to files with the given path or URL prefix",
+        type=str,
+    )
+    parser.add_argument(
+        "--ndjson-max-size",
+        help="Maximum size in MB of the uncompressed JSON per file with --output-ndjson (0 for no limit)",
+        type=int,
+        default=DEFAULT_MAX_FILE_SIZE // (1024 * 1024),
+    )
+    parser.add_argument(
+        "--ndjson-max-items",
+        help="Maximum number of STAC items per file with --output-ndjson (0 for no limit)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--ndjson-compression",
+        help="Compression of the files written with --output-ndjson",
+        choices=COMPRESSIONS,
+        default=COMPRESSION_NONE,
+    )
+    parser.add_argument(
+        "--ndjson-partition",
+        help="Write the files of --output-ndjson into one sub-prefix per collection, e.g. for the pgstac loader",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--output-geoparquet",
+        help="Write the STAC items of --manifest or --discover as stac-geoparquet, one file per collection below the "
+        "given path or URL prefix",
+        type=str,
+    )
+    parser.add_argument(
+        "--geoparquet-row-group-size",
+        help="Number of STAC items per row group with --output-geoparquet",
+        type=int,
+        default=DEFAULT_ROW_GROUP_SIZE,
+    )
+    parser.add_argument(
+        "--output-pgstac",
+        help=f"Load the STAC items of --manifest or --discover with COPY into the pgstac database at {ENV_PGSTAC_DSN}",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--pgstac-batch-size",
+        help="Number of STAC items loaded with one COPY with --output-pgstac",
+        type=int,
+        default=DEFAULT_PGSTAC_BATCH_SIZE,
+    )
+    parser.add_argument(
+        "--pgstac-method",
+        help="Handling of existing STAC items with --output-pgstac",
+        choices=PGSTAC_METHODS,
+        default=PGSTAC_METHOD_UPSERT,
+    )
+    parser.add_argument(
+        "--journal",
+        help="Path to a SQLite journal of the products of --manifest or --discover. Products completed in a "
+        "previous run with the same journal are skipped",
+        type=str,
+    )
     parser.add_argument("--debug", help="Enable verbose output", action="store_true")
     args = parser.parse_args()
 
+    batch_mode = args.manifest is not None or args.discover is not None
+    if args.daemon:
+        if args.queue is None:
+            parser.error("--daemon requires --queue")
+    elif sum(x is not None for x in [args.URL, args.manifest, args.discover]) != 1:
+        parser.error("exactly one of URL, --manifest or --discover is required")
+    if batch_mode and args.output_file is not None:
+        parser.error("--output-file cannot be used together with --manifest or --discover")
+    if args.use_async and args.bulk_size > 0:
+        parser.error("--bulk-size cannot be used together with --async")
+    if get_output_writer_count(args) > 1:
+        parser.error("only one of --output-ndjson, --output-geoparquet or --output-pgstac can be used")
+    if has_output_writer(args) and not batch_mode:
+        parser.error("--output-ndjson, --output-geoparquet and --output-pgstac require --manifest or --discover")
+    if has_output_writer(args) and (args.use_async or args.bulk_size > 0):
+        parser.error(
+            "--output-ndjson, --output-geoparquet and --output-pgstac cannot be used together "
+            "with --async or --bulk-size"
+        )
+    if args.journal is not None and not batch_mode:
+        parser.error("--journal requires --manifest or --discover")
+    if args.journal is not None and args.queue is not None:
+        parser.error("--journal cannot be used together with --queue")
+    if args.cdse_verify < 0 or args.cdse_verify > 1:
+        parser.error("--cdse-verify must be between 0 and 1")
+    if args.cdse_verify > 0 and not batch_mode:
+        parser.error("--cdse-verify requires --manifest or --discover")
+    if args.cdse_verify > 0 and args.queue is not None:
+        parser.error("--cdse-verify cannot be used together with --queue")
+
     if args.debug:
         configure_logging(logging.DEBUG)
     else:
         configure_logging(logging.INFO)
 
+    if args.queue is not None:
+        try:
+            if args.daemon:
+                run_worker(args, os.environ)
+            else:
+                enqueue_products(args.queue, get_batch_products(args, True, os.environ))
+        except Exception as e:
+            logger.error(str(e))
+            exit_on_error()
+        return
+
+    if batch_mode:
+        try:
+            products = get_batch_products(args, args.dry_run or has_output_writer(args), os.environ)
+            failed = run_batch_mode(products, args, os.environ)
+        except Exception as e:
+            logger.error(str(e))
+            exit_on_error()
+        if failed > 0:
+            exit_on_error()
+        return
+
     try:
         validate_env(args.URL, args.dry_run, args.output_file, os.environ)
 
-        logger.debug("Opening metadata file ...")
-        metadata = read_metadata(args.URL)
+        with deadline(get_http_settings().product_timeout):
+            logger.debug("Opening metadata file ...")
+            metadata = read_metadata(args.URL)
 
-        logger.info(f"Creating STAC item for {args.URL} ...")
-        item = create_item(metadata=metadata, eopf_href=args.URL, source_uri=args.source_uri)
-        logger.debug(json.dumps(item.to_dict(), indent=4))
+            logger.info(f"Creating STAC item for {args.URL} ...")
+            cdse_cache = get_cdse_cache(args)
+            item = create_item(
+                metadata=metadata,
+                eopf_href=args.URL,
+                source_uri=args.source_uri,
+                cdse_resolver=partial(get_source_stac_item_url, cache=cdse_cache),
+                cdse_offline=args.cdse_offline,
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(json.dumps(item.to_dict(), indent=4))
 
-        if not args.dry_run:
-            if args.output_file:
-                logger.info(f"Writing STAC item to {args.output_file}")
-                with open(args.output_file, "w") as f:
-                    json.dump(item.to_dict(), f, indent=4)
-            else:
-                logger.info(f"Registering STAC item to {os.environ[ENV_STAC_API_URL]}")
-                item = register_item(item=item, stac_api_url=os.environ[ENV_STAC_API_URL])
+            if not args.dry_run:
+                if args.output_file:
+                    logger.info(f"Writing STAC item to {args.output_file}")
+                    with open(args.output_file, "w") as f:
+                        json.dump(item.to_dict(), f, indent=4)
+                else:
+                    logger.info(f"Registering STAC item to {os.environ[ENV_STAC_API_URL]}")
+                    item = register_item(
+                        item=item, stac_api_url=os.environ[ENV_STAC_API_URL], skip_unchanged=args.skip_unchanged
+                    )
 
     except Exception as e:
         logger.error(str(e))
@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import BinaryIO
+
+from eopf_stac.common.filesystem import get_filesystem
+
+logger = logging.getLogger(__name__)
+
+ENV_METADATA_CACHE_DIR: str = "METADATA_CACHE_DIR"
+ENV_METADATA_CACHE_SIZE: str = "METADATA_CACHE_SIZE"
+
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+# number of downloads after which the total size is read again from the index shared with other processes
+EVICTION_INTERVAL = 100
+
+
+class MetadataCache:
+    """Local cache of the metadata documents (.zattrs, .zmetadata, zarr.json) of products.
+
+    The documents are stored once per content (named by their SHA-256 digest) in the cache directory and
+    indexed by their URL in a SQLite database. A cached document is only used if the ETag (or modification
+    time) and size of the object are unchanged, which costs a HEAD request instead of the download. The least
+    recently used documents are evicted when the total size exceeds max_size bytes. The total size is kept
+    up to date by this instance and read again from the index every EVICTION_INTERVAL downloads, so that
+    documents added by other processes are taken into account.
+    Use open_metadata_cache to share one instance per process, e.g. with worker processes.
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._downloads = 0
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(path, "index.db"), isolation_level=None, timeout=30, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata_files (url TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, "
+            "digest TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS metadata_files_digest ON metadata_files (digest)")
+        self._size = self._get_total_size()
+
+    def __reduce__(self):
+        # the connection cannot be pickled, worker processes open the cache themselves
+        return (open_metadata_cache, (self.path, self.max_size))
+
+    def open(self, href: str) -> BinaryIO:
+        """Opens the cached copy of the object at href, the object is downloaded if it is not cached or changed.
+
+        Raises FileNotFoundError if the object does not exist.
+        """
+        fs, path = get_filesystem(href)
+        fingerprint = get_fingerprint(fs.info(path))
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fingerprint, digest FROM metadata_files WHERE url = ?", (href,)
+            ).fetchone()
+            if row is not None and row[0] == fingerprint:
+                try:
+                    f = open(self._get_file_path(row[1]), "rb")
+                    self._connection.execute(
+                        "UPDATE metadata_files SET accessed_at = ? WHERE url = ?", (time.time(), href)
+                    )
+                    self.hits += 1
+                    return f
+                except FileNotFoundError:
+                    logger.debug(f"Cached file of {href} was evicted by another process")
+            self.misses += 1
+
+        digest, size = self._download(fs, path)
+        with self._lock:
+            if not self._is_referenced(digest):
+                self._size += size
+            previous = self._connection.execute("SELECT digest, size FROM metadata_files WHERE url = ?", (href,))
+            previous = previous.fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO metadata_files (url, fingerprint, digest, size, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (href, fingerprint, digest, size, time.time()),
+            )
+            if previous is not None and previous[0] != digest and not self._is_referenced(previous[0]):
+                self._remove_file(previous[0])
+                self._size -= previous[1]
+            f = open(self._get_file_path(digest), "rb")
+            self._downloads += 1
+            if self._downloads % EVICTION_INTERVAL == 0:
+                self._size = self._get_total_size()
+            if self._size > self.max_size:
+                self._evict()
+        return f
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _get_file_path(self, digest: str) -> str:
+        return os.path.join(self.path, digest[:2], digest)
+
+    def _download(self, fs, path: str) -> tuple[str, int]:
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.path, delete=False) as dst:
+            try:
+                with fs.open(path, "rb") as src:
+                    while chunk := src.read(COPY_BUFFER_SIZE):
+                        sha256.update(chunk)
+                        size += len(chunk)
+                        dst.write(chunk)
+            except BaseException:
+                os.remove(dst.name)
+                raise
+
+        digest = sha256.hexdigest()
+        file_path = self._get_file_path(digest)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(dst.name, file_path)
+        return (digest, size)
+
+    def _is_referenced(self, digest: str) -> bool:
+        row = self._connection.execute("SELECT 1 FROM metadata_files WHERE digest = ? LIMIT 1", (digest,))
+        return row.fetchone() is not None
+
+    def _get_total_size(self) -> int:
+        row = self._connection.execute(
+            "SELECT SUM(size) FROM (SELECT MAX(size) AS size FROM metadata_files GROUP BY digest)"
+        ).fetchone()
+        return row[0] or 0
+
+    def _remove_file(self, digest: str) -> None:
+        try:
+            os.remove(self._get_file_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        rows = self._connection.execute(
+            "SELECT digest, MAX(size) FROM metadata_files GROUP BY digest ORDER BY MAX(accessed_at) DESC"
+        ).fetchall()
+        total_size = 0
+        self._size = 0
+        for digest, size in rows:
+            total_size += size
+            if total_size > self.max_size:
+                logger.debug(f"Evicting {digest} from metadata cache")
+                self._connection.execute("DELETE FROM metadata_files WHERE digest = ?", (digest,))
+                self._remove_file(digest)
+            else:
+                self._size = total_size
+
+
+def get_fingerprint(info: dict) -> str:
+    """Returns the version of an object from the ETag, the modification time and the size in its info"""
+    version = info.get("ETag") or info.get("LastModified") or info.get("mtime")
+    return f"{version}:{info.get('size')}"
+
+
+_caches: dict[tuple, MetadataCache] = {}
+_caches_lock = threading.Lock()
+
+
+def open_metadata_cache(path: str, max_size: int = DEFAULT_MAX_SIZE) -> MetadataCache:
+    """Returns the cache instance of the current process for the given directory and size"""
+    key = (os.getpid(), path, max_size)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = MetadataCache(path, max_size=max_size)
+        return _caches[key]
+
+
+def get_metadata_cache(env=os.environ) -> MetadataCache | None:
+    """Returns the cache configured with the environment variables, if any"""
+    path = env.get(ENV_METADATA_CACHE_DIR)
+    if path is None or len(path) == 0:
+        return None
+    return open_metadata_cache(path, max_size=int(env.get(ENV_METADATA_CACHE_SIZE, DEFAULT_MAX_SIZE)))
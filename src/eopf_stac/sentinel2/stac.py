@@ -1,6 +1,7 @@
 import logging
 import os
 import re
+from collections.abc import Mapping
 from itertools import chain
 
 import pystac
@@ -19,6 +20,8 @@ from eopf_stac.common.constants import (
     SENTINEL_LICENSE,
     SENTINEL_PROVIDER,
 )
+from eopf_stac.common.filesystem import get_zarr_store
+from eopf_stac.common.metadata import ARRAY_METADATA_KEY, ROOT_ATTRIBUTES_KEY
 from eopf_stac.common.stac import (
     create_cdse_link,
     fill_eo_properties,
@@ -54,6 +57,10 @@ from eopf_stac.sentinel2.constants import (
 
 logger = logging.getLogger(__name__)
 
+REFLECTANCE_PATH = "measurements/reflectance"
+# number of pixels of the rows and columns of a tile per resolution
+TILE_SIZES = {10: 10980, 20: 5490, 60: 1830}
+
 
 def create_item(
     metadata: dict,
@@ -139,13 +146,21 @@ def create_item(
             proj_code = other_metadata.get("horizontal_CRS_code")  # 2.5.6 < CPM version < 2.6.4
 
     proj_bbox = properties.get("proj:bbox")  # in CPM 2.5.6 and 2.6.4 this field is available
+    proj_shape = properties.get("proj:shape")
     if proj_bbox is None:
-        proj_bbox = calculate_proj_bbox(url=asset_href_prefix)  # 2.5.6 < CPM version < 2.6.4
+        # 2.5.6 < CPM version < 2.6.4
+        grid = get_proj_bbox_from_metadata(metadata)
+        if grid is None:
+            grid = calculate_proj_bbox(url=asset_href_prefix, metadata=metadata)
+        if grid is not None:
+            proj_bbox, proj_shape = grid
 
     if any([proj_code, proj_bbox]):
         projection = ProjectionExtension.ext(item, add_if_missing=True)
         if proj_bbox is not None:
             projection.bbox = proj_bbox
+        if proj_shape is not None:
+            projection.shape = proj_shape
         if proj_code is not None:
             projection.code = proj_code
 
@@ -231,34 +246,72 @@ def create_item(
     return item
 
 
-def calculate_proj_bbox(url: str, res: int = 10) -> list | None:
+def get_proj_bbox_from_metadata(metadata: Mapping, res: int = 10) -> tuple[list, list] | None:
+    """Returns the bbox in data CRS coordinates and the shape (rows, columns) of the grid of the given resolution.
+
+    Both are derived from the metadata of the first array of the grid which has a proj:bbox or proj:transform in
+    its attributes, the shape is taken from proj:shape or the shape of the array. None if there is no such array.
+    """
+    prefix = f"{REFLECTANCE_PATH}/r{res}m/"
+    for key in metadata:
+        if not key.startswith(prefix) or not key.endswith(f"/{ARRAY_METADATA_KEY}"):
+            continue
+        array_path = key.removesuffix(f"/{ARRAY_METADATA_KEY}")
+        attrs = (metadata.get(f"{array_path}/{ROOT_ATTRIBUTES_KEY}") or {}).get("_eopf_attrs") or {}
+        shape = attrs.get("proj:shape") or metadata[key].get("shape", [])[-2:]
+        if attrs.get("proj:bbox") and len(shape) == 2:
+            return (list(attrs["proj:bbox"]), list(shape))
+
+        transform = attrs.get("proj:transform")
+        if transform is None or len(transform) < 6 or len(shape) != 2:
+            continue
+        a, b, c, d, e, f = transform[:6]
+        nrows, ncols = shape
+        xs = [c, c + a * ncols + b * nrows]
+        ys = [f, f + d * ncols + e * nrows]
+        return ([min(xs), min(ys), max(xs), max(ys)], list(shape))
+    return None
+
+
+def get_grid_shape(metadata: Mapping | None, res: int = 10) -> tuple[int, int]:
+    """Returns the shape (rows, columns) of the first 2D array of the grid of the given resolution in the metadata.
+
+    Falls back to the size of the tiles of Sentinel-2 if the metadata has no such array.
+    """
+    prefix = f"{REFLECTANCE_PATH}/r{res}m/"
+    for key, value in (metadata or {}).items():
+        if key.startswith(prefix) and key.endswith(f"/{ARRAY_METADATA_KEY}") and len(value.get("shape", [])) >= 2:
+            return tuple(value["shape"][-2:])
+    size = TILE_SIZES.get(res, TILE_SIZES[60])
+    return (size, size)
+
+
+def calculate_proj_bbox(url: str, res: int = 10, metadata: Mapping | None = None) -> tuple[list, list] | None:
+    """Calculates the bbox in data CRS coordinates and the shape (rows, columns) of the grid of the given resolution.
+
+    The upper left corner is read from the coordinates of the geometry conditions with additional requests, so
+    this is only the last resort if the bbox cannot be derived from the metadata (see get_proj_bbox_from_metadata).
+    The size of the grid is taken from the shape of its arrays in the metadata, if given.
+    """
     logger.info(f"Calculating bounding box in data crs coordinates for resolution {res} ...")
     try:
         path_geom_x_coords = "conditions/geometry/x"
         path_geom_y_coords = "conditions/geometry/y"
-        geom_x_coords = zarr.open_array(os.path.join(url, path_geom_x_coords))
-        geom_y_coords = zarr.open_array(os.path.join(url, path_geom_y_coords))
+        store = get_zarr_store(url)
+        geom_x_coords = zarr.open_array(store, path=path_geom_x_coords, mode="r")
+        geom_y_coords = zarr.open_array(store, path=path_geom_y_coords, mode="r")
         ulx = float(geom_x_coords[0])
         uly = float(geom_y_coords[0])
-
-        if res == 10:
-            ncols = 10980
-            nrows = 10980
-        elif res == 20:
-            ncols = 5490
-            nrows = 5490
-        else:
-            ncols = 1830
-            nrows = 1830
+        nrows, ncols = get_grid_shape(metadata, res=res)
 
         #  [xmin, ymin, xmax, ymax]
         proj_bbox = [
             ulx,
-            uly - res * ncols,
-            ulx + res * nrows,
+            uly - res * nrows,
+            ulx + res * ncols,
             uly,
         ]
-        return proj_bbox
+        return (proj_bbox, [nrows, ncols])
     except Exception as e:
         logger.error(f"Unable to read coordinates from Zarr data: {str(e)}")
         return None
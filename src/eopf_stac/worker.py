@@ -0,0 +1,193 @@
+import logging
+import signal
+import sqlite3
+import threading
+import time
+from functools import partial
+
+from eopf_stac.cdse_cache import CdseCache
+from eopf_stac.common.http_client import deadline, get_http_settings
+from eopf_stac.io import create_item, create_session, get_source_stac_item_url, read_metadata, upsert_item
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = "queued"
+STATUS_PROCESSING = "processing"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+WORKER_DIED_ERROR = "Worker died while processing the product"
+
+
+class WorkQueue:
+    """Durable queue of EOPF product URLs backed by a SQLite database.
+
+    Entries are claimed atomically, so several workers can consume the same queue. Entries which have been
+    claimed but not finished within the visibility timeout (e.g. because the worker died) are queued again.
+    """
+
+    def __init__(self, path: str, visibility_timeout: float = 3600, max_attempts: int = 3) -> None:
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._connection = sqlite3.connect(path, isolation_level=None, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                source_uri TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                item_id TEXT,
+                claimed_at REAL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS queue_status ON queue (status, id)")
+
+    def enqueue(self, url: str, source_uri: str | None = None) -> int:
+        cursor = self._connection.execute(
+            "INSERT INTO queue (url, source_uri, status, updated_at) VALUES (?, ?, ?, ?)",
+            (url, source_uri, STATUS_QUEUED, time.time()),
+        )
+        return cursor.lastrowid
+
+    def claim(self) -> tuple[int, str, str | None] | None:
+        """Marks the oldest queued entry as processing and returns its (id, url, source_uri)"""
+        now = time.time()
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            # re-queue entries of workers which died while processing, unless the attempts are used up
+            self._connection.execute(
+                "UPDATE queue SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, "
+                "error = CASE WHEN attempts < ? THEN error ELSE ? END, updated_at = ? "
+                "WHERE status = ? AND claimed_at < ?",
+                (
+                    self.max_attempts,
+                    STATUS_QUEUED,
+                    STATUS_FAILED,
+                    self.max_attempts,
+                    WORKER_DIED_ERROR,
+                    now,
+                    STATUS_PROCESSING,
+                    now - self.visibility_timeout,
+                ),
+            )
+            row = self._connection.execute(
+                "SELECT id, url, source_uri FROM queue WHERE status = ? ORDER BY attempts, id LIMIT 1",
+                (STATUS_QUEUED,),
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE queue SET status = ?, attempts = attempts + 1, claimed_at = ?, updated_at = ? WHERE id = ?",
+                    (STATUS_PROCESSING, now, now, row[0]),
+                )
+            self._connection.execute("COMMIT")
+        except Exception:
+            self._connection.execute("ROLLBACK")
+            raise
+        return row
+
+    def complete(self, entry_id: int, item_id: str) -> None:
+        self._connection.execute(
+            "UPDATE queue SET status = ?, item_id = ?, error = NULL, updated_at = ? WHERE id = ?",
+            (STATUS_DONE, item_id, time.time(), entry_id),
+        )
+
+    def fail(self, entry_id: int, error: str) -> None:
+        """Queues the entry again or marks it as failed if the maximum number of attempts is reached"""
+        self._connection.execute(
+            "UPDATE queue SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, error = ?, updated_at = ? "
+            "WHERE id = ?",
+            (self.max_attempts, STATUS_QUEUED, STATUS_FAILED, error, time.time(), entry_id),
+        )
+
+    def counts(self) -> dict[str, int]:
+        rows = self._connection.execute("SELECT status, COUNT(*) FROM queue GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class IngestionWorker:
+    """Long-running worker which creates and registers the STAC items of all products of a work queue.
+
+    The worker keeps one pooled HTTP session to the STAC API for its lifetime. The filesystems used to read the
+    product metadata are created once per process and reused as well.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        stac_api_url: str | None = None,
+        poll_interval: float = 5,
+        skip_unchanged: bool = False,
+        cdse_cache: CdseCache | None = None,
+        cdse_offline: bool = False,
+    ) -> None:
+        self.queue = queue
+        self.stac_api_url = stac_api_url
+        self.skip_unchanged = skip_unchanged
+        self.cdse_cache = cdse_cache
+        self.cdse_offline = cdse_offline
+        self.poll_interval = poll_interval
+        self.session = create_session()
+        self.product_timeout = get_http_settings().product_timeout
+        self._stop = threading.Event()
+
+    def stop(self, *args) -> None:
+        logger.info("Stopping worker after the current product ...")
+        self._stop.set()
+
+    def process(self, url: str, source_uri: str | None) -> str:
+        with deadline(self.product_timeout):
+            metadata = read_metadata(url)
+            logger.info(f"Creating STAC item for {url} ...")
+            item = create_item(
+                metadata=metadata,
+                eopf_href=url,
+                source_uri=source_uri,
+                cdse_resolver=partial(get_source_stac_item_url, cache=self.cdse_cache),
+                cdse_offline=self.cdse_offline,
+            )
+            if self.stac_api_url is not None:
+                upsert_item(
+                    item=item, stac_api_url=self.stac_api_url, session=self.session, skip_unchanged=self.skip_unchanged
+                )
+        return item.id
+
+    def run_once(self) -> bool:
+        """Processes the next queued product. Returns False if the queue is empty."""
+        entry = self.queue.claim()
+        if entry is None:
+            return False
+
+        entry_id, url, source_uri = entry
+        try:
+            item_id = self.process(url, source_uri)
+            self.queue.complete(entry_id, item_id)
+            logger.info(f"Processed {url} -> {item_id}")
+        except Exception as e:
+            logger.error(f"Failed to process {url}: {str(e)}")
+            self.queue.fail(entry_id, str(e))
+        return True
+
+    def run(self, exit_when_empty: bool = False) -> None:
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        logger.info(f"Worker started, consuming queue {self.queue.path}")
+        while not self._stop.is_set():
+            if not self.run_once():
+                if exit_when_empty:
+                    break
+                self._stop.wait(self.poll_interval)
+        logger.info(f"Worker stopped, queue status: {self.queue.counts()}")
+        if self.cdse_cache is not None:
+            logger.info(f"CDSE cache: {self.cdse_cache.hits} hits, {self.cdse_cache.misses} misses")
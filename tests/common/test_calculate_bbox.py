@@ -1,11 +1,56 @@
 import os
 
-from eopf_stac.sentinel2.stac import calculate_proj_bbox
+import numpy as np
+import zarr
+
+from eopf_stac.sentinel2.stac import calculate_proj_bbox, get_proj_bbox_from_metadata
 
 
 def test_calculate_boox():
     url = os.environ.get("EOPF_DATA_PATH")
     if url is not None:
         # pytest.fail(reason="Environment variable EOPF_DATA_PATH is not set")
-        bbox = calculate_proj_bbox(url, res=10)
-        assert bbox is not None
+        grid = calculate_proj_bbox(url, res=10)
+        assert grid is not None
+
+
+def test_get_proj_bbox_from_metadata():
+    metadata = {
+        ".zattrs": {},
+        "measurements/reflectance/r10m/x/.zarray": {"shape": [10980]},
+        "measurements/reflectance/r10m/x/.zattrs": {"_eopf_attrs": {}},
+        "measurements/reflectance/r10m/b02/.zarray": {"shape": [10980, 10980]},
+        "measurements/reflectance/r10m/b02/.zattrs": {
+            "_eopf_attrs": {"proj:transform": [10.0, 0.0, 399960.0, 0.0, -10.0, 5600040.0]}
+        },
+        "measurements/reflectance/r20m/b05/.zarray": {"shape": [5490, 5490]},
+        "measurements/reflectance/r20m/b05/.zattrs": {
+            "_eopf_attrs": {"proj:bbox": [399960.0, 5490240.0, 509760.0, 5600040.0], "proj:shape": [5490, 5490]}
+        },
+    }
+
+    assert get_proj_bbox_from_metadata(metadata, res=10) == (
+        [399960.0, 5600040.0 - 109800, 399960.0 + 109800, 5600040.0],
+        [10980, 10980],
+    )
+    assert get_proj_bbox_from_metadata(metadata, res=20) == ([399960.0, 5490240.0, 509760.0, 5600040.0], [5490, 5490])
+    assert get_proj_bbox_from_metadata(metadata, res=60) is None
+
+
+def test_calculate_proj_bbox_with_grid_shape(tmp_path):
+    url = str(tmp_path / "S02MSIL1C.zarr")
+    store = zarr.storage.LocalStore(url)
+    x = zarr.create_array(store, name="conditions/geometry/x", shape=(1,), dtype="float64", zarr_format=2)
+    x[:] = np.array([399960.0])
+    y = zarr.create_array(store, name="conditions/geometry/y", shape=(1,), dtype="float64", zarr_format=2)
+    y[:] = np.array([5600040.0])
+
+    metadata = {"measurements/reflectance/r60m/b01/.zarray": {"shape": [1000, 2000]}}
+    assert calculate_proj_bbox(url, res=60, metadata=metadata) == (
+        [399960.0, 5600040.0 - 60000, 519960.0, 5600040.0],
+        [1000, 2000],
+    )
+    assert calculate_proj_bbox(url, res=60) == (
+        [399960.0, 5600040.0 - 109800, 399960.0 + 109800, 5600040.0],
+        [1830, 1830],
+    )
@@ -0,0 +1,37 @@
+import numpy as np
+import s3fs
+import zarr
+
+from eopf_stac.common.filesystem import get_filesystem, get_zarr_store
+from eopf_stac.sentinel2.stac import calculate_proj_bbox
+
+
+def test_get_filesystem():
+    fs, path = get_filesystem("https://objects.example.com/bucket/product.zarr")
+    assert isinstance(fs, s3fs.S3FileSystem)
+    assert path == "/bucket/product.zarr"
+
+    # filesystems are reused for the same endpoint
+    other_fs, _ = get_filesystem("https://objects.example.com/bucket/other.zarr")
+    assert other_fs is fs
+    assert get_filesystem("https://other.example.com/bucket/product.zarr")[0] is not fs
+    assert get_filesystem("https://objects.example.com/bucket/product.zarr", asynchronous=True)[0] is not fs
+
+    # handler validating the bucket name, which breaks requests to CEPH, is unregistered once
+    handlers = fs.s3.meta.events._emitter._handlers.prefix_search("before-parameter-build.s3")
+    assert "validate_bucket_name" not in [getattr(handler, "__name__", "") for handler in handlers]
+
+
+def test_calculate_proj_bbox(tmp_path):
+    url = str(tmp_path / "S02MSIL1C.zarr")
+    store = zarr.storage.LocalStore(url)
+    x = zarr.create_array(store, name="conditions/geometry/x", shape=(2,), dtype="float64", zarr_format=2)
+    x[:] = np.array([399960.0, 404960.0])
+    y = zarr.create_array(store, name="conditions/geometry/y", shape=(2,), dtype="float64", zarr_format=2)
+    y[:] = np.array([5600040.0, 5595040.0])
+
+    assert isinstance(get_zarr_store(url), zarr.storage.LocalStore)
+    assert calculate_proj_bbox(url, res=10) == (
+        [399960.0, 5600040.0 - 109800, 399960.0 + 109800, 5600040.0],
+        [10980, 10980],
+    )
@@ -0,0 +1,58 @@
+import datetime
+
+import numpy as np
+import pystac
+import shapely
+
+from eopf_stac.common.footprint import (
+    ENV_FOOTPRINT_PRECISION,
+    ENV_FOOTPRINT_SIMPLIFY_TOLERANCE,
+    FootprintSettings,
+    compact_footprints,
+    get_footprint_settings,
+)
+from eopf_stac.common.stac import fix_geometry
+
+
+def create_swath(vertices: int = 1000) -> shapely.Polygon:
+    """Returns a curved swath with a slightly noisy outline"""
+    t = np.linspace(0, 1, vertices)
+    noise = np.sin(t * 400) * 0.001
+    left = np.column_stack([10 + t * 20 + noise, -40 + t * 80 + np.sin(t * 3) * 5])
+    right = left[::-1] + [5, 0]
+    return shapely.Polygon(np.vstack([left, right]))
+
+
+def test_get_footprint_settings():
+    assert not get_footprint_settings({}).enabled
+    settings = get_footprint_settings({ENV_FOOTPRINT_SIMPLIFY_TOLERANCE: "0.01", ENV_FOOTPRINT_PRECISION: "4"})
+    assert settings == FootprintSettings(simplify_tolerance=0.01, precision=4)
+
+
+def test_compact_footprints():
+    swath = create_swath()
+    invalid = shapely.Polygon([(0, 0), (1, 1), (1, 0), (0, 1), (0, 0)])
+    settings = FootprintSettings(simplify_tolerance=0.01, precision=3)
+
+    compacted = compact_footprints(np.array([swath, invalid], dtype=object), settings)
+    assert shapely.get_num_coordinates(compacted[0]) < shapely.get_num_coordinates(swath) / 10
+    assert compacted[0].covers(swath)
+    coordinates = shapely.get_coordinates(compacted[0])
+    assert np.array_equal(coordinates, np.round(coordinates, 3))
+    assert compacted[1] is invalid
+
+
+def test_fix_geometry_with_simplification():
+    swath = create_swath()
+    item = pystac.Item(
+        "a",
+        geometry=shapely.geometry.mapping(swath),
+        bbox=list(swath.bounds),
+        datetime=datetime.datetime(2025, 1, 1),
+        properties={},
+    )
+    fix_geometry(item, settings=FootprintSettings(simplify_tolerance=0.05, precision=2))
+
+    geometry = shapely.geometry.shape(item.geometry)
+    assert geometry.covers(swath)
+    assert shapely.box(*item.bbox).covers(geometry)
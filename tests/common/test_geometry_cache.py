@@ -0,0 +1,86 @@
+import copy
+import datetime
+
+import pystac
+
+from eopf_stac.common import serialization
+from eopf_stac.common.footprint import FootprintSettings
+from eopf_stac.common.geometry_cache import (
+    ENV_GEOMETRY_CACHE_PATH,
+    ENV_GEOMETRY_CACHE_SIZE,
+    GeometryCache,
+    get_geometry_cache,
+)
+from eopf_stac.common.stac import fix_geometry
+
+CROSSING = {"type": "Polygon", "coordinates": [[[170, 10], [-170, 10], [-170, 20], [170, 20], [170, 10]]]}
+
+
+def create_item(geometry: dict) -> pystac.Item:
+    return pystac.Item(
+        "a", geometry=copy.deepcopy(geometry), bbox=None, datetime=datetime.datetime(2025, 1, 1), properties={}
+    )
+
+
+def test_lru():
+    geometry = {"type": "Point", "coordinates": [1.0, 2.0]}
+    size = len(b'{"geometry":{"type":"Point","coordinates":[1.0,2.0]},"bounds":null}')
+    cache = GeometryCache(max_size=2 * size)
+    cache.put("a", geometry)
+    cache.put("b", geometry)
+    assert cache.get("a") == (geometry, None)
+    cache.put("c", geometry)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats() == {"hits": 3, "misses": 1}
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / "geometries.db")
+    cache = GeometryCache(path=path)
+    cache.put("a", {"type": "Point", "coordinates": [1.0, 2.0]}, bounds=[1.0, 2.0, 1.0, 2.0])
+    cache.close()
+
+    cache = GeometryCache(path=path)
+    assert cache.get("a") == ({"type": "Point", "coordinates": [1.0, 2.0]}, [1.0, 2.0, 1.0, 2.0])
+    cache.close()
+
+
+def test_get_key(monkeypatch):
+    settings = FootprintSettings()
+    geometry = {"type": "Point", "coordinates": [1.0, 2.0]}
+    key = GeometryCache.get_key(geometry, settings)
+    assert GeometryCache.get_key({"coordinates": [1.0, 2.0], "type": "Point"}, settings) == key
+
+    # the same key with and without orjson, so the persistent cache is shared between environments
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert GeometryCache.get_key(geometry, settings) == key
+
+
+def test_get_geometry_cache(tmp_path):
+    assert get_geometry_cache({ENV_GEOMETRY_CACHE_SIZE: "0"}) is None
+    path = str(tmp_path / "geometries.db")
+    cache = get_geometry_cache({ENV_GEOMETRY_CACHE_PATH: path})
+    assert cache.path == path
+    assert get_geometry_cache({ENV_GEOMETRY_CACHE_PATH: path}) is cache
+
+
+def test_fix_geometry_with_cache():
+    cache = GeometryCache()
+    settings = FootprintSettings()
+    expected = create_item(CROSSING)
+    fix_geometry(expected, settings=settings, cache=cache)
+    assert cache.stats() == {"hits": 0, "misses": 1}
+
+    item = create_item(CROSSING)
+    fix_geometry(item, settings=settings, cache=cache)
+    assert cache.stats() == {"hits": 1, "misses": 1}
+    assert item.geometry == expected.geometry
+    assert item.geometry is not expected.geometry
+
+    # other settings give other footprints
+    item = create_item(CROSSING)
+    fix_geometry(item, settings=FootprintSettings(precision=1), cache=cache)
+    assert cache.stats() == {"hits": 1, "misses": 2}
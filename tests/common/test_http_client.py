@@ -0,0 +1,108 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from eopf_stac.common.http_client import (
+    DeadlineExceededError,
+    HttpSettings,
+    create_session,
+    deadline,
+    get_http_settings,
+    get_remaining_time,
+    get_session,
+)
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.5)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class OverloadedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(503)
+        self.send_header("Retry-After", "5")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(handler):
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def slow_server():
+    yield from serve(SlowHandler)
+
+
+@pytest.fixture
+def overloaded_server():
+    yield from serve(OverloadedHandler)
+
+
+def test_get_http_settings():
+    assert get_http_settings({}) == HttpSettings()
+    settings = get_http_settings({"HTTP_READ_TIMEOUT": "5", "HTTP_POOL_SIZE": "100", "PRODUCT_TIMEOUT": "30"})
+    assert settings.timeout == (10, 5)
+    assert settings.pool_size == 100
+    assert settings.product_timeout == 30
+
+
+def test_read_timeout(slow_server):
+    session = create_session(settings=HttpSettings(read_timeout=0.1, retries=0))
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.get(slow_server)
+
+
+def test_deadline(slow_server):
+    session = create_session(settings=HttpSettings(retries=0))
+
+    # the read timeout is reduced to the remaining time
+    with deadline(0.1):
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            session.get(slow_server)
+
+    # no request is sent after the deadline
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceededError):
+            session.get(slow_server)
+
+    # nested deadlines cannot extend the outer deadline
+    with deadline(1):
+        with deadline(60):
+            assert get_remaining_time() <= 1
+    assert get_remaining_time() is None
+
+
+def test_retry_after_deadline(overloaded_server):
+    session = create_session(settings=HttpSettings(retries=3))
+
+    # the Retry-After of 5 seconds exceeds the deadline, the last response is returned instead of waiting
+    start = time.monotonic()
+    with deadline(1):
+        response = session.get(overloaded_server)
+    assert response.status_code == 503
+    assert time.monotonic() - start < 1
+
+
+def test_get_session():
+    assert get_session() is get_session()
+    assert get_session(auth=("user", "pass")) is not get_session()
+    assert get_session(auth=("user", "pass")).auth == ("user", "pass")
@@ -0,0 +1,151 @@
+import io
+import json
+import os
+import shutil
+
+import pytest
+
+from eopf_stac import io as io_module
+from eopf_stac.common import metadata as metadata_module
+from eopf_stac.common.constants import PRODUCT_METADATA_ASSET_KEY, PRODUCT_METADATA_PATH
+from eopf_stac.common.metadata import (
+    ZARR_JSON_KEY,
+    LazyMetadata,
+    RawMetadata,
+    is_attributes_key,
+    is_item_metadata_key,
+    load_consolidated_metadata,
+)
+from eopf_stac.io import create_item, get_product_type_from_href, read_metadata
+from tests.utils import create_local_product, create_local_product_v3
+
+DATA_FILES_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data-files")
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+
+
+@pytest.mark.parametrize("data_file", sorted(os.listdir(DATA_FILES_PATH)))
+def test_load_consolidated_metadata(data_file):
+    with open(os.path.join(DATA_FILES_PATH, data_file), "rb") as f:
+        expected = json.load(f)
+        f.seek(0)
+        zmetadata = load_consolidated_metadata(f)
+
+    # the documents written by zarr are indexed and decoded lazily
+    assert isinstance(zmetadata["metadata"], RawMetadata)
+    assert zmetadata["zarr_consolidated_format"] == expected["zarr_consolidated_format"]
+    assert dict(zmetadata["metadata"]) == {k: v for k, v in expected["metadata"].items() if is_item_metadata_key(k)}
+    assert zmetadata["metadata"][".zattrs"] is zmetadata["metadata"][".zattrs"]
+    assert any(key.endswith("/.zarray") for key in zmetadata["metadata"])
+    assert "measurements/.zgroup" not in zmetadata["metadata"]
+
+
+@pytest.mark.parametrize("data_file", sorted(os.listdir(DATA_FILES_PATH)))
+@pytest.mark.parametrize("chunk_size", [7, 4096, 64 * 1024])
+def test_load_consolidated_metadata_streaming(data_file, chunk_size, monkeypatch):
+    monkeypatch.setattr(metadata_module, "CHUNK_SIZE", chunk_size)
+    with open(os.path.join(DATA_FILES_PATH, data_file), "rb") as f:
+        expected = json.load(f)
+    zmetadata = load_consolidated_metadata(io.BytesIO(json.dumps(expected).encode("utf-8")))
+
+    assert not isinstance(zmetadata["metadata"], RawMetadata)
+    assert zmetadata["zarr_consolidated_format"] == expected["zarr_consolidated_format"]
+    assert zmetadata["metadata"] == {k: v for k, v in expected["metadata"].items() if is_item_metadata_key(k)}
+    assert ".zattrs" in zmetadata["metadata"]
+
+
+@pytest.mark.parametrize("indent", [None, 4])
+def test_load_consolidated_metadata_filter(indent):
+    document = {
+        "metadata": {
+            ".zattrs": {"stac_discovery": {}},
+            ".zgroup": {"zarr_format": 2},
+            "a/.zarray": {"shape": [10, 10], "fill_value": -1.5e-3},
+            "a/.zattrs": {"name": "ä \\" + '"'},
+            'b "c"/.zattrs': {},
+        },
+        "zarr_consolidated_format": 1,
+    }
+    data = json.dumps(document, ensure_ascii=False, indent=indent).encode("utf-8")
+
+    zmetadata = load_consolidated_metadata(io.BytesIO(data))
+    assert list(zmetadata["metadata"].keys()) == [".zattrs", "a/.zarray", "a/.zattrs", 'b "c"/.zattrs']
+    assert zmetadata["metadata"]["a/.zattrs"]["name"] == "ä \\" + '"'
+
+    zmetadata = load_consolidated_metadata(io.BytesIO(data), key_filter=is_attributes_key)
+    assert list(zmetadata["metadata"].keys()) == [".zattrs", "a/.zattrs", 'b "c"/.zattrs']
+
+
+def test_load_consolidated_metadata_max_size(monkeypatch):
+    monkeypatch.setattr(metadata_module, "CHUNK_SIZE", 16)
+    document = {"metadata": {f"{i}/.zattrs": {"value": "x" * 100} for i in range(10)}}
+    data = json.dumps(document).encode("utf-8")
+
+    assert len(load_consolidated_metadata(io.BytesIO(data), max_size=10000)["metadata"]) == 10
+    with pytest.raises(ValueError):
+        load_consolidated_metadata(io.BytesIO(data), max_size=500)
+    with pytest.raises(ValueError):
+        load_consolidated_metadata(io.BytesIO(data), max_size=50)
+    with pytest.raises(ValueError):
+        load_consolidated_metadata(io.BytesIO(data[:-10]))
+
+
+def test_read_metadata_lazy(tmp_path):
+    url = create_local_product(tmp_path, OLCI_EFR_FILE)
+    metadata = read_metadata(url)
+    assert isinstance(metadata, LazyMetadata)
+
+    # Sentinel-3 items only need the root attributes
+    item = create_item(metadata, eopf_href=url, source_uri=None)
+    assert item.id is not None
+    assert not metadata.loaded
+
+    assert "measurements/.zattrs" in metadata
+    assert metadata.loaded
+
+
+def test_get_product_type_from_href():
+    assert get_product_type_from_href("s3://bucket/S02MSIL2A_20250109T100401_0000_A122_TC06.zarr/") == "S02MSIL2A"
+    assert get_product_type_from_href("/data/S01SIWOCN_20250319T002519_0024_A019__205.zarr") == "S01SIWOCN"
+    assert get_product_type_from_href("/data/product.zarr") is None
+
+
+def test_read_metadata_by_product_name(tmp_path, monkeypatch):
+    opened = []
+    open_metadata_file = io_module.open_metadata_file
+    monkeypatch.setattr(
+        io_module, "open_metadata_file", lambda href, name, *args: opened.append(name) or open_metadata_file(href, name)
+    )
+
+    # the consolidated metadata is needed anyway for product types like Sentinel-2, no root attributes are read
+    url = str(tmp_path / "S02MSIL2A_20250109T100401_0000_A122_TC06.zarr")
+    shutil.copytree(create_local_product(tmp_path, OLCI_EFR_FILE), url)
+    metadata = read_metadata(url)
+    assert not isinstance(metadata, LazyMetadata)
+    assert opened == [".zmetadata"]
+
+
+def test_read_metadata_without_root_attributes(tmp_path):
+    url = create_local_product(tmp_path, OLCI_EFR_FILE, root_attributes=False)
+    metadata = read_metadata(url)
+    assert not isinstance(metadata, LazyMetadata)
+    assert "stac_discovery" in metadata[".zattrs"]
+
+
+@pytest.mark.filterwarnings("ignore:Consolidated metadata is currently not part")
+def test_read_metadata_zarr_v3(tmp_path):
+    url = create_local_product_v3(tmp_path, OLCI_EFR_FILE)
+    with open(os.path.join(DATA_FILES_PATH, OLCI_EFR_FILE), "rb") as f:
+        expected = json.load(f)["metadata"]
+
+    metadata = read_metadata(url)
+    assert metadata[".zattrs"] == expected[".zattrs"]
+    for key, value in expected.items():
+        if is_attributes_key(key) and len(value) > 0:
+            assert metadata[key] == value
+
+    v2_url = create_local_product(tmp_path / "v2", OLCI_EFR_FILE)
+    item = create_item(metadata, eopf_href=url, source_uri=None)
+    v2_item = create_item(read_metadata(v2_url), eopf_href=v2_url, source_uri=None)
+    assert item.id == v2_item.id
+    assert item.assets[PRODUCT_METADATA_ASSET_KEY].href == os.path.join(url, ZARR_JSON_KEY)
+    assert v2_item.assets[PRODUCT_METADATA_ASSET_KEY].href == os.path.join(v2_url, PRODUCT_METADATA_PATH)
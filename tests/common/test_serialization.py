@@ -0,0 +1,22 @@
+import json
+
+from eopf_stac.common import serialization
+from eopf_stac.common.serialization import dumps, json_body
+
+
+def test_dumps():
+    obj = {"id": "ä", "bbox": [1.5, -2.0e-5], "properties": {"datetime": None}}
+    assert json.loads(dumps(obj)) == obj
+    assert b" " not in dumps(obj)
+    assert dumps(obj, indent=True).startswith(b'{\n  "id"')
+    assert json_body(obj)["headers"]["Content-Type"] == "application/json"
+
+
+def test_dumps_fallback(monkeypatch):
+    # orjson only accepts string keys
+    assert json.loads(dumps({1: "a"})) == {"1": "a"}
+
+    monkeypatch.setattr(serialization, "orjson", None)
+    obj = {"id": "ä", "bbox": [1.5, -2.0e-5]}
+    assert json.loads(dumps(obj)) == obj
+    assert json.loads(dumps(obj, indent=True)) == obj
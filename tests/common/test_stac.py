@@ -1,9 +1,19 @@
+import copy
 import datetime
+import json
 
+import pystac
 import pytest
+import shapely
 from dateutil.tz import tzutc
 
+from eopf_stac.common.constants import CONTENT_HASH_PROPERTY
+from eopf_stac.common.footprint import FootprintSettings
 from eopf_stac.common.stac import (
+    _rework_geometry,
+    compute_content_hash,
+    fix_geometries,
+    get_cdse_stac_item_href,
     get_datetimes,
     get_identifier_from_href,
     rearrange_bbox,
@@ -72,3 +82,92 @@ class TestSTAC:
         expected_start = datetime.datetime(2025, 4, 16, 6, 37, 51, 892834, tzinfo=tzutc())
         expected_end = datetime.datetime(2025, 4, 16, 6, 40, 51, 892834, tzinfo=tzutc())
         assert (expected_start, expected_start, expected_end) == get_datetimes(properties)
+
+    def test_compute_content_hash(self):
+        item = {
+            "id": "a1",
+            "properties": {"datetime": "2025-01-01T00:00:00Z", "created": "2025-01-02T00:00:00Z"},
+            "links": [{"rel": "self", "href": "https://example.com/a1"}],
+        }
+        content_hash = compute_content_hash(item)
+
+        # timestamps of the run, the self link and the hash itself are ignored
+        rerun = {
+            "id": "a1",
+            "properties": {
+                "updated": "2025-02-01T00:00:00Z",
+                "created": "2025-02-01T00:00:00Z",
+                "datetime": "2025-01-01T00:00:00Z",
+                CONTENT_HASH_PROPERTY: content_hash,
+            },
+            "links": [],
+        }
+        assert compute_content_hash(rerun) == content_hash
+
+        item["properties"]["datetime"] = "2025-01-01T00:00:01Z"
+        assert compute_content_hash(item) != content_hash
+
+    def test_get_cdse_stac_item_href(self):
+        base = "https://stac.dataspace.copernicus.eu/v1/collections"
+        tests = [
+            (
+                "S01SIWGRD",
+                "S1A_IW_GRDH_1SDV_20250319T002519_20250319T002544_058371_073775_205A",
+                "sentinel-1-grd",
+            ),
+            ("S02MSIL2A", "S2B_MSIL2A_20240428T102559_N0510_R108_T32UPC_20240428T123125", "sentinel-2-l2a"),
+            (
+                "S03OLCEFR",
+                "S3B_OL_1_EFR____20250416T063752_20250416T064052_20250416T083131_0179_105_248_3240_ESA_O_NR_004",
+                "sentinel-3-olci-1-efr-nrt",
+            ),
+            (
+                "S03SLSLST",
+                "S3A_SL_2_LST____20250428T075538_20250428T075838_20250429T164402_0179_125_192_2160_PS1_O_NT_004",
+                "sentinel-3-sl-2-lst-ntc",
+            ),
+            (
+                "S03SYNSDR",
+                "S3A_SY_2_SYN____20250428T075538_20250428T075838_20250429T164402_0179_125_192_2160_PS1_O_ST_004",
+                "sentinel-3-syn-2-syn-stc",
+            ),
+        ]
+        for product_type, scene_id, collection in tests:
+            assert get_cdse_stac_item_href(product_type, scene_id) == f"{base}/{collection}/items/{scene_id}"
+
+        assert get_cdse_stac_item_href("S03OLCEFR", "S3B_OL_1_EFR____unknown") is None
+        assert get_cdse_stac_item_href("S99UNKNOWN", "scene") is None
+
+
+def create_geometry_item(coordinates: list, geometry_type: str = "Polygon") -> pystac.Item:
+    geometry = {"type": geometry_type, "coordinates": coordinates}
+    return pystac.Item("a", geometry=geometry, bbox=None, datetime=datetime.datetime(2025, 1, 1), properties={})
+
+
+@pytest.mark.parametrize(
+    "coordinates, geometry_type",
+    [
+        # closed and unclosed swaths
+        (
+            [[[24.1772, 20.9629], [24.6605, 20.8852], [25.1, 22.0], [0.12345678901234567, 21.0], [24.1772, 20.9629]]],
+            None,
+        ),
+        ([[[10, 10], [20, 10], [20, 20], [10, 20]]], None),
+        ([[[1.2345678901234567, 10], [20, 10], [20, 20], [10, 20]]], None),
+        # with a hole
+        ([[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]], [[2, 2], [4, 2], [4, 4], [2, 2]]], None),
+        # crossing the antimeridian
+        ([[[170, 10], [-170, 10], [-170, 20], [170, 20], [170, 10]]], None),
+        ([[[179.5, -5], [180, -5], [180, 5], [179.5, 5]]], None),
+        ([[[[170, 10], [175, 10], [175, 20], [170, 10]]]], "MultiPolygon"),
+    ],
+)
+def test_fix_geometries(coordinates, geometry_type):
+    geometry = {"type": geometry_type or "Polygon", "coordinates": copy.deepcopy(coordinates)}
+    expected = json.loads(shapely.to_geojson(_rework_geometry(geometry)))
+
+    item = create_geometry_item(copy.deepcopy(coordinates), geometry_type or "Polygon")
+    other = create_geometry_item(copy.deepcopy(coordinates), geometry_type or "Polygon")
+    fix_geometries([item, other], settings=FootprintSettings())
+    assert item.geometry == expected
+    assert other.geometry == expected
@@ -0,0 +1,147 @@
+import asyncio
+import os
+import shutil
+import threading
+
+from aiohttp import web
+
+from eopf_stac import aio
+from eopf_stac.aio import AsyncPipeline, run_async_batch, verify_links
+from eopf_stac.batch import STATUS_FAILED, STATUS_SUCCESS
+from eopf_stac.common.metadata import LazyMetadata
+from eopf_stac.journal import BatchJournal
+from tests.utils import create_local_product
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+SLSTR_LST_FILE = "S03SLSLST_20250428T075538_0180_B035_T196.json"
+OLCI_EFR_SOURCE = "S3B_OL_1_EFR____20250416T063752_20250416T064052_20250416T083131_0179_105_248_3240_ESA_O_NR_004"
+
+
+def test_run_async_batch(tmp_path):
+    products = [
+        (create_local_product(tmp_path, OLCI_EFR_FILE), None),
+        (str(tmp_path / "missing.zarr"), None),
+        (create_local_product(tmp_path, SLSTR_LST_FILE), None),
+    ]
+
+    results = run_async_batch(products=iter(products), concurrency=2)
+    assert len(results) == 3
+    assert len([r for r in results if r.status == STATUS_SUCCESS]) == 2
+    assert len([r for r in results if r.status == STATUS_FAILED]) == 1
+
+
+def test_run_async_batch_with_journal(tmp_path):
+    products = [(create_local_product(tmp_path, OLCI_EFR_FILE), None)]
+    journal = BatchJournal(str(tmp_path / "journal.db"))
+    assert len(run_async_batch(products=products, journal=journal)) == 1
+
+    # the metadata is unchanged
+    assert run_async_batch(products=products, journal=journal) == []
+    assert journal.skipped == 1
+    journal.close()
+
+
+def test_create_item_off_event_loop(tmp_path, monkeypatch):
+    threads = []
+    original_create_item = aio.create_item
+
+    def create_item(**kwargs):
+        threads.append(threading.current_thread())
+        return original_create_item(**kwargs)
+
+    monkeypatch.setattr(aio, "create_item", create_item)
+    results = run_async_batch(products=[(create_local_product(tmp_path, OLCI_EFR_FILE), None)])
+    assert results[0].status == STATUS_SUCCESS
+    assert threads != [threading.main_thread()]
+
+
+def test_read_metadata_by_product_name(tmp_path):
+    url = str(tmp_path / "S02MSIL2A_20250109T100401_0000_A122_TC06.zarr")
+    shutil.copytree(create_local_product(tmp_path, OLCI_EFR_FILE), url)
+    with open(os.path.join(url, ".zattrs"), "w") as f:
+        f.write("not read")
+
+    async def run():
+        async with AsyncPipeline() as pipeline:
+            return await pipeline.read_metadata(url)
+
+    # the consolidated metadata is read right away, without the root attributes
+    metadata = asyncio.run(run())
+    assert not isinstance(metadata, LazyMetadata)
+    assert "stac_discovery" in metadata[".zattrs"]
+
+
+def test_pipeline_with_catalog(tmp_path):
+    requests = []
+    cdse_href = "https://cdse.example/collections/sentinel-3-olci-1-efr-nrt/items/source"
+
+    async def search(request):
+        requests.append(("GET", request.path, request.query.get("ids")))
+        return web.json_response({"features": [{"links": [{"rel": "self", "href": cdse_href}]}]})
+
+    async def post_item(request):
+        item = await request.json()
+        requests.append(("POST", request.path, item["id"]))
+        # the item already exists
+        return web.json_response({}, status=409)
+
+    async def put_item(request):
+        item = await request.json()
+        requests.append(("PUT", request.path, item["id"]))
+        assert [link["href"] for link in item["links"] if link["rel"] == "alternate"] == [cdse_href]
+        return web.json_response(item)
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/cdse/search", search)
+        app.router.add_post("/stac/collections/{collection_id}/items", post_item)
+        app.router.add_put("/stac/collections/{collection_id}/items/{item_id}", put_item)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with AsyncPipeline(
+                stac_api_url=f"http://127.0.0.1:{port}/stac", cdse_stac_api_url=f"http://127.0.0.1:{port}/cdse"
+            ) as pipeline:
+                return await pipeline.run([(create_local_product(tmp_path, OLCI_EFR_FILE), OLCI_EFR_SOURCE)])
+        finally:
+            await runner.cleanup()
+
+    results = asyncio.run(run())
+    assert len(results) == 1
+    assert results[0].status == STATUS_SUCCESS
+
+    item_id = "S03OLCEFR_20250416T063751_0180_B248_T853"
+    items_path = "/stac/collections/sentinel-3-olci-l1-efr/items"
+    assert requests == [
+        ("GET", "/cdse/search", OLCI_EFR_SOURCE),
+        ("POST", items_path, item_id),
+        ("PUT", f"{items_path}/{item_id}", item_id),
+    ]
+
+
+def test_verify_links():
+    async def get_item(request):
+        if request.match_info["item_id"] == "missing":
+            return web.json_response({}, status=404)
+        return web.json_response({"id": request.match_info["item_id"]})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/collections/{collection_id}/items/{item_id}", get_item)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            base = f"http://127.0.0.1:{port}/collections/c/items"
+            return await verify_links([f"{base}/a", f"{base}/missing", f"{base}/b"])
+        finally:
+            await runner.cleanup()
+
+    broken = asyncio.run(run())
+    assert len(broken) == 1
+    assert broken[0].endswith("/missing")
@@ -0,0 +1,204 @@
+import json
+
+from eopf_stac import batch
+from eopf_stac.batch import (
+    STATUS_FAILED,
+    STATUS_SUCCESS,
+    process_product,
+    read_manifest,
+    resolve_source_scenes,
+    run_batch,
+)
+from eopf_stac.cdse_cache import CdseCache
+from eopf_stac.common.constants import CDSE_STAC_API_URL
+from eopf_stac.io import get_cdse_stac_item_urls
+from tests.utils import create_local_product
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+SLSTR_LST_FILE = "S03SLSLST_20250428T075538_0180_B035_T196.json"
+OLCI_EFR_SOURCE = "S3B_OL_1_EFR____20250416T063752_20250416T064052_20250416T083131_0179_105_248_3240_ESA_O_NR_004"
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "urls.txt"
+    manifest.write_text(
+        "# comment\n"
+        "s3://bucket/cpm_v264/product1.zarr\n"
+        "\n"
+        "s3://bucket/cpm_v264/product2.zarr  S2B_MSIL1C_20240428T102559_N0510_R108_T32UPC_20240428T123125.SAFE\n"
+    )
+
+    products = list(read_manifest(str(manifest)))
+    assert products == [
+        ("s3://bucket/cpm_v264/product1.zarr", None),
+        (
+            "s3://bucket/cpm_v264/product2.zarr",
+            "S2B_MSIL1C_20240428T102559_N0510_R108_T32UPC_20240428T123125.SAFE",
+        ),
+    ]
+
+
+def test_process_product(tmp_path):
+    url = create_local_product(tmp_path, OLCI_EFR_FILE)
+    result = process_product(url)
+    assert result.status == STATUS_SUCCESS
+    assert result.item_id == "S03OLCEFR_20250416T063751_0180_B248_T853"
+    assert result.collection_id == "sentinel-3-olci-l1-efr"
+
+    result = process_product(str(tmp_path / "missing.zarr"))
+    assert result.status == STATUS_FAILED
+    assert result.item_id is None
+    assert result.error is not None
+
+
+def test_process_product_cdse_offline(tmp_path):
+    url = create_local_product(tmp_path, OLCI_EFR_FILE)
+    source_uri = f"{OLCI_EFR_SOURCE}.SEN3"
+    result = process_product(url, source_uri=source_uri, cdse_offline=True)
+    assert result.status == STATUS_SUCCESS
+    assert result.cdse_href == f"{CDSE_STAC_API_URL}/collections/sentinel-3-olci-1-efr-nrt/items/{OLCI_EFR_SOURCE}"
+
+
+def test_run_batch(tmp_path):
+    products = [
+        (create_local_product(tmp_path, OLCI_EFR_FILE), None),
+        (str(tmp_path / "missing.zarr"), None),
+        (create_local_product(tmp_path, SLSTR_LST_FILE), None),
+    ]
+
+    for jobs in [1, 2]:
+        results = run_batch(products=iter(products), jobs=jobs)
+        assert len(results) == 3
+        assert sorted(r.url for r in results) == sorted(p[0] for p in products)
+        assert len([r for r in results if r.status == STATUS_SUCCESS]) == 2
+        assert len([r for r in results if r.status == STATUS_FAILED]) == 1
+
+
+class CountingWriter:
+    def __init__(self):
+        self.on_written = None
+        self.items = []
+        self.checks = 0
+
+    def add(self, item: dict) -> list[tuple[dict, str]]:
+        self.items.append(item)
+        return []
+
+    def flush_expired(self) -> list[tuple[dict, str]]:
+        self.checks += 1
+        return []
+
+    def flush(self, collection_id: str | None = None) -> list[tuple[dict, str]]:
+        return []
+
+    def close(self) -> list[tuple[dict, str]]:
+        return []
+
+
+def test_run_batch_checks_writer_flush_interval(tmp_path, monkeypatch):
+    # the writer is checked while waiting for the workers, not only when an item is added
+    monkeypatch.setattr(batch, "WRITER_CHECK_INTERVAL", 0.01)
+    products = [(create_local_product(tmp_path, OLCI_EFR_FILE), None)]
+    writer = CountingWriter()
+    results = run_batch(products=products, jobs=2, writer=writer)
+
+    assert [r.status for r in results] == [STATUS_SUCCESS]
+    assert len(writer.items) == 1
+    assert writer.checks > 0
+
+
+class FakeSearchResponse:
+    def __init__(self, body: dict):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeSearchSession:
+    def __init__(self, pages: list[dict]):
+        self.pages = pages
+        self.requests = []
+
+    def get(self, url: str):
+        self.requests.append(("GET", url, None))
+        return FakeSearchResponse(self.pages[len(self.requests) - 1])
+
+    def post(self, url: str, data: bytes, headers: dict):
+        assert headers["Content-Type"] == "application/json"
+        self.requests.append(("POST", url, json.loads(data)))
+        return FakeSearchResponse(self.pages[len(self.requests) - 1])
+
+
+def create_search_page(scene_ids: list[str], next_href: str | None = None) -> dict:
+    features = [
+        {"id": scene_id, "links": [{"rel": "self", "href": f"https://example.com/{scene_id}"}]}
+        for scene_id in scene_ids
+    ]
+    links = [{"rel": "next", "href": next_href}] if next_href is not None else []
+    return {"type": "FeatureCollection", "features": features, "links": links}
+
+
+def test_get_cdse_stac_item_urls():
+    session = FakeSearchSession(
+        [
+            create_search_page(["a"], next_href="https://example.com/search?token=next"),
+            create_search_page(["b"]),
+            create_search_page(["c"]),
+        ]
+    )
+    urls = get_cdse_stac_item_urls(["a", "b", "c", "d"], chunk_size=3, session=session)
+
+    assert urls == {"a": "https://example.com/a", "b": "https://example.com/b", "c": "https://example.com/c"}
+    assert session.requests == [
+        ("POST", f"{CDSE_STAC_API_URL}/search", {"ids": ["a", "b", "c"], "limit": 3}),
+        ("GET", "https://example.com/search?token=next", None),
+        ("POST", f"{CDSE_STAC_API_URL}/search", {"ids": ["d"], "limit": 1}),
+    ]
+
+
+def test_get_cdse_stac_item_urls_post_paging():
+    page = create_search_page(["a"])
+    page["links"] = [
+        {"rel": "next", "href": "https://example.com/search", "method": "POST", "body": {"token": "n"}, "merge": True}
+    ]
+    session = FakeSearchSession([page, create_search_page(["b"])])
+    urls = get_cdse_stac_item_urls(["a", "b"], chunk_size=2, session=session)
+
+    assert urls == {"a": "https://example.com/a", "b": "https://example.com/b"}
+    assert session.requests == [
+        ("POST", f"{CDSE_STAC_API_URL}/search", {"ids": ["a", "b"], "limit": 2}),
+        ("POST", "https://example.com/search", {"ids": ["a", "b"], "limit": 2, "token": "n"}),
+    ]
+
+
+def test_resolve_source_scenes(tmp_path, monkeypatch):
+    requests = []
+
+    def get_cdse_stac_item_urls(scene_ids: list[str], chunk_size: int) -> dict[str, str]:
+        requests.append(scene_ids)
+        return {scene_id: f"https://example.com/{scene_id}" for scene_id in scene_ids if scene_id != "missing"}
+
+    monkeypatch.setattr(batch, "get_cdse_stac_item_urls", get_cdse_stac_item_urls)
+    cache = CdseCache(str(tmp_path / "cdse.db"))
+    cache.put("cached", "https://example.com/cached")
+    products = [
+        ("p1", "a.SAFE"),
+        ("p2", None),
+        ("p3", "a.SAFE"),
+        ("p4", "cached.SAFE"),
+        ("p5", "missing.SAFE"),
+    ]
+
+    resolved = list(resolve_source_scenes(products, chunk_size=4, cdse_cache=cache))
+    assert requests == [["a"], ["missing"]]
+    assert [(url, source_uri) for url, source_uri, _ in resolved] == products
+    lookups = [lookup for _, _, lookup in resolved]
+    assert lookups[1] is None
+    assert lookups[0].href == "https://example.com/a" and lookups[0].cache_hit is False
+    assert lookups[3].href == "https://example.com/cached" and lookups[3].cache_hit is True
+    assert lookups[4].href is None
+    assert cache.get("missing") == (True, None)
@@ -0,0 +1,213 @@
+import json
+
+from eopf_stac.batch import STATUS_FAILED, STATUS_SUCCESS, run_batch
+from eopf_stac.catalog import BULK_METHOD_BULK_ITEMS, BULK_METHOD_ITEM_COLLECTION, BulkItemWriter
+from eopf_stac.common.constants import CONTENT_HASH_PROPERTY
+from eopf_stac.common.stac import compute_content_hash
+from eopf_stac.io import (
+    API_ACTION_INSERTED,
+    API_ACTION_UNCHANGED,
+    API_ACTION_UPDATED,
+    create_item,
+    read_metadata,
+    upsert_item,
+)
+from tests.utils import create_local_product
+
+STAC_API_URL = "https://stac.example"
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+SLSTR_LST_FILE = "S03SLSLST_20250428T075538_0180_B035_T196.json"
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, body: dict | None = None):
+        self.status_code = status_code
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    def __init__(self, status_codes: dict | None = None, bodies: dict | None = None):
+        self.requests = []
+        self.status_codes = status_codes or {}
+        self.bodies = bodies or {}
+
+    def request(self, method: str, url: str, data: bytes | None = None, headers: dict | None = None):
+        body = json.loads(data) if data is not None else None
+        self.requests.append((method, url, body))
+        return FakeResponse(self.status_codes.get((method, url), 200), self.bodies.get((method, url)))
+
+    def get(self, url: str):
+        return self.request("GET", url)
+
+    def post(self, url: str, data: bytes, headers: dict):
+        return self.request("POST", url, data, headers)
+
+    def put(self, url: str, data: bytes, headers: dict):
+        return self.request("PUT", url, data, headers)
+
+
+def create_item_dict(item_id: str, collection_id: str) -> dict:
+    return {
+        "id": item_id,
+        "collection": collection_id,
+        "properties": {},
+        "links": [{"rel": "self", "href": "https://example.com"}],
+    }
+
+
+class TestBulkItemWriter:
+    def test_bulk_items(self):
+        session = FakeSession()
+        writer = BulkItemWriter(STAC_API_URL, batch_size=2, flush_interval=3600, session=session)
+        written = []
+        writer.on_written = written.append
+
+        assert writer.add(create_item_dict("a1", "a")) == []
+        assert writer.add(create_item_dict("b1", "b")) == []
+        assert len(session.requests) == 0
+        assert writer.add(create_item_dict("a2", "a")) == []
+        assert len(session.requests) == 1
+        assert written == [[("a", "a1"), ("a", "a2")]]
+
+        method, url, body = session.requests[0]
+        assert method == "POST"
+        assert url == f"{STAC_API_URL}/collections/a/bulk_items"
+        assert body["method"] == "upsert"
+        assert list(body["items"].keys()) == ["a1", "a2"]
+        assert body["items"]["a1"]["links"] == []
+
+        assert writer.close() == []
+        assert len(session.requests) == 2
+        assert session.requests[1][1] == f"{STAC_API_URL}/collections/b/bulk_items"
+
+    def test_flush_interval(self):
+        session = FakeSession()
+        writer = BulkItemWriter(STAC_API_URL, batch_size=100, flush_interval=0, session=session)
+        writer.add(create_item_dict("a1", "a"))
+        assert len(session.requests) == 1
+
+    def test_item_collection(self):
+        items_url = f"{STAC_API_URL}/collections/a/items"
+        session = FakeSession({("POST", items_url): 409})
+        writer = BulkItemWriter(STAC_API_URL, batch_size=2, method=BULK_METHOD_ITEM_COLLECTION, session=session)
+        writer.add(create_item_dict("a1", "a"))
+        writer.add(create_item_dict("a2", "a"))
+
+        # ItemCollection is rejected because items exist -> items are updated one by one
+        assert [(r[0], r[1]) for r in session.requests] == [
+            ("POST", items_url),
+            ("POST", items_url),
+            ("PUT", f"{items_url}/a1"),
+            ("POST", items_url),
+            ("PUT", f"{items_url}/a2"),
+        ]
+        assert session.requests[0][2]["type"] == "FeatureCollection"
+        assert len(session.requests[0][2]["features"]) == 2
+
+    def test_failed(self):
+        session = FakeSession({("POST", f"{STAC_API_URL}/collections/a/bulk_items"): 500})
+        writer = BulkItemWriter(STAC_API_URL, batch_size=10, method=BULK_METHOD_BULK_ITEMS, session=session)
+        written = []
+        writer.on_written = written.append
+        writer.add(create_item_dict("a1", "a"))
+        failed = writer.close()
+        assert written == []
+        assert len(failed) == 1
+        assert failed[0][0]["id"] == "a1"
+
+    def test_skip_unchanged(self):
+        unchanged = create_item_dict("a1", "a")
+        unchanged_hash = compute_content_hash(unchanged)
+        search_url = f"{STAC_API_URL}/search"
+        search_response = {
+            "features": [
+                {"id": "a1", "properties": {CONTENT_HASH_PROPERTY: unchanged_hash}},
+                {"id": "a2", "properties": {CONTENT_HASH_PROPERTY: "outdated"}},
+            ]
+        }
+        session = FakeSession(bodies={("POST", search_url): search_response})
+        writer = BulkItemWriter(STAC_API_URL, batch_size=3, session=session, skip_unchanged=True)
+        writer.add(unchanged)
+        writer.add(create_item_dict("a2", "a"))
+        writer.add(create_item_dict("a3", "a"))
+
+        assert [(r[0], r[1]) for r in session.requests] == [
+            ("POST", search_url),
+            ("POST", f"{STAC_API_URL}/collections/a/bulk_items"),
+        ]
+        assert session.requests[0][2]["ids"] == ["a1", "a2", "a3"]
+        items = session.requests[1][2]["items"]
+        assert list(items.keys()) == ["a2", "a3"]
+        assert items["a2"]["properties"][CONTENT_HASH_PROPERTY] == compute_content_hash(items["a2"])
+
+    def test_skip_unchanged_paginated(self):
+        # the API returns at most one item per page, the second page is requested with a POST next link
+        items = [create_item_dict(item_id, "a") for item_id in ["a1", "a2"]]
+        search_url = f"{STAC_API_URL}/search"
+        next_url = f"{search_url}?page=2"
+        session = FakeSession(
+            bodies={
+                ("POST", search_url): {
+                    "features": [{"id": "a1", "properties": {CONTENT_HASH_PROPERTY: compute_content_hash(items[0])}}],
+                    "links": [
+                        {"rel": "next", "href": next_url, "method": "POST", "body": {"token": "2"}, "merge": True}
+                    ],
+                },
+                ("POST", next_url): {
+                    "features": [{"id": "a2", "properties": {CONTENT_HASH_PROPERTY: compute_content_hash(items[1])}}],
+                    "links": [],
+                },
+            }
+        )
+        writer = BulkItemWriter(STAC_API_URL, batch_size=2, session=session, skip_unchanged=True)
+        for item in items:
+            writer.add(item)
+
+        assert [(r[0], r[1]) for r in session.requests] == [("POST", search_url), ("POST", next_url)]
+        assert session.requests[1][2]["ids"] == ["a1", "a2"]
+        assert session.requests[1][2]["token"] == "2"
+
+
+def test_upsert_item_skip_unchanged(tmp_path):
+    url = create_local_product(tmp_path, OLCI_EFR_FILE)
+    item = create_item(read_metadata(url), eopf_href=url, source_uri=None)
+    item_url = f"{STAC_API_URL}/collections/{item.collection_id}/items/{item.id}"
+
+    # item does not exist yet
+    session = FakeSession({("GET", item_url): 404})
+    assert upsert_item(item, STAC_API_URL, session=session, skip_unchanged=True) == API_ACTION_INSERTED
+    stored = session.requests[-1][2]
+    assert stored["properties"][CONTENT_HASH_PROPERTY] == item.properties[CONTENT_HASH_PROPERTY]
+
+    # item is unchanged -> nothing is written
+    session = FakeSession(bodies={("GET", item_url): stored})
+    assert upsert_item(item, STAC_API_URL, session=session, skip_unchanged=True) == API_ACTION_UNCHANGED
+    assert [r[0] for r in session.requests] == ["GET"]
+
+    # item has changed -> updated directly with PUT
+    stored["properties"][CONTENT_HASH_PROPERTY] = "outdated"
+    session = FakeSession(bodies={("GET", item_url): stored})
+    assert upsert_item(item, STAC_API_URL, session=session, skip_unchanged=True) == API_ACTION_UPDATED
+    assert [r[0] for r in session.requests] == ["GET", "PUT"]
+
+
+def test_run_batch_with_writer(tmp_path):
+    products = [
+        (create_local_product(tmp_path, OLCI_EFR_FILE), None),
+        (create_local_product(tmp_path, SLSTR_LST_FILE), None),
+    ]
+    session = FakeSession({("POST", f"{STAC_API_URL}/collections/sentinel-3-slstr-l2-lst/bulk_items"): 500})
+    writer = BulkItemWriter(STAC_API_URL, batch_size=10, session=session)
+
+    results = run_batch(products=products, jobs=2, stac_api_url=STAC_API_URL, writer=writer)
+    assert len(session.requests) == 2
+    statuses = {r.collection_id: r.status for r in results}
+    assert statuses == {"sentinel-3-olci-l1-efr": STATUS_SUCCESS, "sentinel-3-slstr-l2-lst": STATUS_FAILED}
+    assert all(r.item is None for r in results)
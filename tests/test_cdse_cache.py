@@ -0,0 +1,72 @@
+import pickle
+
+from eopf_stac import io
+from eopf_stac.batch import STATUS_SUCCESS, run_batch
+from eopf_stac.cdse_cache import CdseCache, open_cdse_cache
+from eopf_stac.io import CdseItemNotFoundError, get_source_stac_item_url
+from tests.utils import create_local_product
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+SOURCE_URI = "S3B_OL_1_EFR____20250416T063751_20250416T064051_20250416T083407_0180_105_248_2340_ESA_O_NR_004.SEN3"
+SCENE_ID = SOURCE_URI.removesuffix(".SEN3")
+SCENE_URL = f"https://stac.dataspace.copernicus.eu/v1/collections/sentinel-3-olci-1-efr-nrt/items/{SCENE_ID}"
+
+
+class TestCdseCache:
+    def test_get_put(self, tmp_path):
+        cache = CdseCache(str(tmp_path / "cdse.db"))
+        assert cache.get("a") == (False, None)
+        cache.put("a", "https://example.com/a")
+        cache.put("b", None)
+        assert cache.get("a") == (True, "https://example.com/a")
+        assert cache.get("b") == (True, None)
+        assert cache.stats() == {"hits": 2, "misses": 1}
+
+        # cached entries are persistent
+        cache.close()
+        cache = CdseCache(str(tmp_path / "cdse.db"))
+        assert cache.get("a") == (True, "https://example.com/a")
+
+    def test_ttl(self, tmp_path):
+        cache = CdseCache(str(tmp_path / "cdse.db"), ttl=3600, negative_ttl=0)
+        cache.put("a", "https://example.com/a")
+        cache.put("b", None)
+        assert cache.get("a") == (True, "https://example.com/a")
+        assert cache.get("b") == (False, None)
+
+    def test_pickle(self, tmp_path):
+        cache = open_cdse_cache(str(tmp_path / "cdse.db"))
+        assert pickle.loads(pickle.dumps(cache)) is cache
+
+
+def test_get_source_stac_item_url(tmp_path, monkeypatch):
+    lookups = []
+
+    def get_cdse_stac_item_url(scene_id: str) -> str:
+        lookups.append(scene_id)
+        if scene_id == "missing":
+            raise CdseItemNotFoundError(f"Failed to find STAC item for scene id {scene_id} at CDSE")
+        if scene_id == "error":
+            raise Exception("HTTP 503")
+        return f"https://example.com/{scene_id}"
+
+    monkeypatch.setattr(io, "get_cdse_stac_item_url", get_cdse_stac_item_url)
+    cache = CdseCache(str(tmp_path / "cdse.db"))
+
+    for _ in range(2):
+        assert get_source_stac_item_url("a", cache=cache) == "https://example.com/a"
+        assert get_source_stac_item_url("missing", cache=cache) is None
+        assert get_source_stac_item_url("error", cache=cache) is None
+
+    # only errors are looked up again
+    assert lookups == ["a", "missing", "error", "error"]
+
+
+def test_run_batch_with_cache(tmp_path):
+    cache = open_cdse_cache(str(tmp_path / "cdse.db"))
+    cache.put(SCENE_ID, SCENE_URL)
+    products = [(create_local_product(tmp_path, OLCI_EFR_FILE), SOURCE_URI)]
+
+    results = run_batch(products=products, jobs=2, cdse_cache=cache)
+    assert results[0].status == STATUS_SUCCESS
+    assert results[0].cdse_cache_hit is True
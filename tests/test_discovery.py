@@ -0,0 +1,35 @@
+import os
+import types
+
+import pytest
+
+from eopf_stac.discovery import discover_products
+from tests.utils import create_local_product, create_local_product_v3
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+SLSTR_LST_FILE = "S03SLSLST_20250428T075538_0180_B035_T196.json"
+
+
+def test_discover_products(tmp_path):
+    product1 = create_local_product(tmp_path, OLCI_EFR_FILE, cpm_dir="cpm_v262")
+    product2 = create_local_product(tmp_path, SLSTR_LST_FILE, cpm_dir=os.path.join("cpm_v264", "2025", "04"))
+    # not a product: missing metadata
+    os.makedirs(tmp_path / "cpm_v264" / "incomplete.zarr")
+    # not a product: no zarr extension
+    os.makedirs(tmp_path / "cpm_v264" / "other")
+
+    discovered = discover_products(str(tmp_path), max_workers=4)
+    assert isinstance(discovered, types.GeneratorType)
+    assert sorted(discovered) == sorted([product1, product2])
+
+
+@pytest.mark.filterwarnings("ignore:Consolidated metadata is currently not part")
+def test_discover_products_zarr_v3(tmp_path):
+    product = create_local_product_v3(tmp_path, OLCI_EFR_FILE)
+    assert list(discover_products(str(tmp_path))) == [product]
+
+
+def test_discover_single_product(tmp_path):
+    product = create_local_product(tmp_path, OLCI_EFR_FILE)
+    assert list(discover_products(product)) == [product]
+    assert list(discover_products(str(tmp_path / "missing"))) == []
@@ -0,0 +1,272 @@
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+from eopf_stac import main
+from eopf_stac.batch import STATUS_SUCCESS, run_batch
+from eopf_stac.item_stream import (
+    COMPRESSION_GZIP,
+    COMPRESSION_ZSTD,
+    PGSTAC_METHOD_IGNORE,
+    PGSTAC_METHOD_UPSERT,
+    GeoParquetItemWriter,
+    NdjsonItemWriter,
+    PartitionedNdjsonItemWriter,
+    PgstacItemWriter,
+)
+from tests.utils import create_local_product
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+SLSTR_LST_FILE = "S03SLSLST_20250428T075538_0180_B035_T196.json"
+
+
+def create_item_dict(item_id: str) -> dict:
+    return {"id": item_id, "collection": "c", "properties": {}, "links": [{"rel": "self", "href": "x"}]}
+
+
+def test_rotation(tmp_path):
+    writer = NdjsonItemWriter(str(tmp_path / "out" / "items"), max_items=2)
+    written = []
+    writer.on_written = written.append
+    for i in range(5):
+        assert writer.add(create_item_dict(str(i))) == []
+    assert written == [[("c", "0"), ("c", "1")], [("c", "2"), ("c", "3")]]
+    writer.close()
+    assert written[-1] == [("c", "4")]
+
+    assert [p.rsplit("/", 1)[-1] for p in writer.paths] == [
+        "items-00000.ndjson",
+        "items-00001.ndjson",
+        "items-00002.ndjson",
+    ]
+    with open(writer.paths[0]) as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == ["0", "1"]
+    assert json.loads(lines[0])["links"] == []
+
+    line_size = len(open(writer.paths[0], "rb").readline())
+    writer = NdjsonItemWriter(str(tmp_path / "size"), max_size=2 * line_size + 1)
+    for i in range(5):
+        writer.add(create_item_dict(str(i)))
+    writer.close()
+    assert len(writer.paths) == 3
+
+
+def test_gzip(tmp_path):
+    writer = NdjsonItemWriter(str(tmp_path / "items"), compression=COMPRESSION_GZIP)
+    writer.add(create_item_dict("a"))
+    writer.close()
+    assert writer.paths[0].endswith(".ndjson.gz")
+    with gzip.open(writer.paths[0], "rt") as f:
+        assert json.loads(f.readline())["id"] == "a"
+
+
+def test_zstd_not_installed(tmp_path):
+    try:
+        import zstandard  # noqa: F401
+
+        pytest.skip("zstandard is installed")
+    except ImportError:
+        pass
+    with pytest.raises(ValueError):
+        NdjsonItemWriter(str(tmp_path / "items"), compression=COMPRESSION_ZSTD)
+
+
+def test_run_batch_with_ndjson_writer(tmp_path):
+    products = [(create_local_product(tmp_path, f), None) for f in [OLCI_EFR_FILE, SLSTR_LST_FILE]]
+    writer = NdjsonItemWriter(str(tmp_path / "items"))
+
+    results = run_batch(products=products, jobs=1, writer=writer)
+    assert all(r.status == STATUS_SUCCESS for r in results)
+    with open(writer.paths[0]) as f:
+        assert sorted(json.loads(line)["id"] for line in f) == sorted(r.item_id for r in results)
+
+
+def test_geoparquet_not_installed(tmp_path):
+    try:
+        import stac_geoparquet  # noqa: F401
+
+        pytest.skip("stac-geoparquet is installed")
+    except ImportError:
+        pass
+    with pytest.raises(ValueError):
+        GeoParquetItemWriter(str(tmp_path / "items"))
+
+
+def test_run_batch_with_geoparquet_writer(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    pytest.importorskip("stac_geoparquet")
+    products = [(create_local_product(tmp_path, f), None) for f in [OLCI_EFR_FILE, SLSTR_LST_FILE]]
+    writer = GeoParquetItemWriter(str(tmp_path / "items"), row_group_size=1)
+
+    results = run_batch(products=products, jobs=1, writer=writer)
+    assert all(r.status == STATUS_SUCCESS for r in results)
+    assert len(writer.paths) == 2
+    for result in results:
+        table = pq.read_table(str(tmp_path / "items" / f"{result.collection_id}.parquet"))
+        assert table.column("id").to_pylist() == [result.item_id]
+
+
+def test_partitioned_ndjson(tmp_path):
+    writer = PartitionedNdjsonItemWriter(str(tmp_path / "items"), max_items=2)
+    for i in range(3):
+        writer.add(create_item_dict(str(i)))
+    item = create_item_dict("x")
+    item["collection"] = "d"
+    writer.add(item)
+    writer.close()
+
+    assert [p.removeprefix(str(tmp_path / "items")) for p in writer.paths] == [
+        "/c/items-00000.ndjson",
+        "/c/items-00001.ndjson",
+        "/d/items-00000.ndjson",
+    ]
+
+
+class FakeCopy:
+    def __init__(self, connection: "FakeConnection") -> None:
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write_row(self, row: tuple) -> None:
+        if self.connection.fail:
+            raise RuntimeError("copy failed")
+        self.connection.rows.append(row)
+
+
+class FakeCursor:
+    def __init__(self, connection: "FakeConnection") -> None:
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def copy(self, statement: str) -> FakeCopy:
+        self.connection.statements.append(statement)
+        return FakeCopy(self.connection)
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.statements = []
+        self.rows = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.fail = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self) -> None:
+        self.commits += 1
+
+    def rollback(self) -> None:
+        self.rows.clear()
+        self.rollbacks += 1
+
+
+def test_pgstac_writer():
+    connection = FakeConnection()
+    writer = PgstacItemWriter(connection=connection, batch_size=2, method=PGSTAC_METHOD_IGNORE)
+    written = []
+    writer.on_written = written.append
+    for i in range(3):
+        assert writer.add(create_item_dict(str(i))) == []
+    assert connection.commits == 1
+    assert written == [[("c", "0"), ("c", "1")]]
+    assert writer.close() == []
+    assert written[-1] == [("c", "2")]
+
+    assert connection.statements == ["COPY pgstac.items_staging_ignore (content) FROM STDIN"] * 2
+    assert connection.commits == 2
+    assert [json.loads(row[0])["id"] for row in connection.rows] == ["0", "1", "2"]
+    assert json.loads(connection.rows[0][0])["links"] == []
+
+
+def test_pgstac_writer_error():
+    connection = FakeConnection()
+    connection.fail = True
+    writer = PgstacItemWriter(connection=connection)
+    writer.add(create_item_dict("a"))
+
+    failed = writer.close()
+    assert [(item["id"], error) for item, error in failed] == [("a", "copy failed")]
+    assert connection.rollbacks == 1
+    assert connection.commits == 0
+
+
+def test_pgstac_not_installed():
+    try:
+        import psycopg  # noqa: F401
+
+        pytest.skip("psycopg is installed")
+    except ImportError:
+        pass
+    with pytest.raises(ValueError):
+        PgstacItemWriter("postgresql://localhost/postgis")
+
+
+def test_pgstac_dry_run(tmp_path, monkeypatch):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(create_local_product(tmp_path, OLCI_EFR_FILE))
+    monkeypatch.delenv("PGSTAC_DSN", raising=False)
+    monkeypatch.setattr(sys, "argv", ["eopf-stac", "--manifest", str(manifest), "--dry-run", "--output-pgstac"])
+
+    # nothing is loaded, so no database is required
+    main.main()
+
+
+@pytest.mark.skipif(os.environ.get("PGSTAC_DSN") is None, reason="Environment variable PGSTAC_DSN is not set")
+def test_pgstac_writer_database():
+    psycopg = pytest.importorskip("psycopg")
+    collection_id = "eopf-stac-test"
+    collection = {
+        "type": "Collection",
+        "stac_version": "1.0.0",
+        "id": collection_id,
+        "description": "Test collection of eopf-stac",
+        "license": "proprietary",
+        "extent": {"spatial": {"bbox": [[-180, -90, 180, 90]]}, "temporal": {"interval": [[None, None]]}},
+        "links": [],
+    }
+
+    def create_database_item(item_id: str) -> dict:
+        return {
+            "type": "Feature",
+            "stac_version": "1.0.0",
+            "id": item_id,
+            "collection": collection_id,
+            "geometry": {"type": "Point", "coordinates": [10.0, 50.0]},
+            "bbox": [10.0, 50.0, 10.0, 50.0],
+            "properties": {"datetime": "2025-01-01T00:00:00Z"},
+            "links": [],
+            "assets": {},
+        }
+
+    with psycopg.connect(os.environ["PGSTAC_DSN"], autocommit=True) as connection:
+        connection.execute("SELECT pgstac.upsert_collection(%s::jsonb)", (json.dumps(collection),))
+        try:
+            # the second run upserts the existing items
+            for _ in range(2):
+                writer = PgstacItemWriter(dsn=os.environ["PGSTAC_DSN"], batch_size=2, method=PGSTAC_METHOD_UPSERT)
+                for i in range(3):
+                    assert writer.add(create_database_item(str(i))) == []
+                assert writer.close() == []
+
+            rows = connection.execute(
+                "SELECT id FROM pgstac.items WHERE collection = %s ORDER BY id", (collection_id,)
+            ).fetchall()
+            assert [row[0] for row in rows] == ["0", "1", "2"]
+        finally:
+            connection.execute("SELECT pgstac.delete_collection(%s)", (collection_id,))
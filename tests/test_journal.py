@@ -0,0 +1,151 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from eopf_stac.batch import STATUS_FAILED, STATUS_SUCCESS, run_batch
+from eopf_stac.item_stream import NdjsonItemWriter
+from eopf_stac.journal import BatchJournal
+from tests.utils import create_local_product
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+SLSTR_LST_FILE = "S03SLSLST_20250428T075538_0180_B035_T196.json"
+
+
+def test_journal(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = BatchJournal(path)
+    journal.record("a", STATUS_SUCCESS, metadata_hash="h", item_id="A", action="inserted")
+    journal.record("b", STATUS_FAILED, error="broken")
+    journal.record("d", STATUS_SUCCESS)
+    journal.close()
+
+    journal = BatchJournal(path)
+    assert journal.is_completed("a")
+    assert not journal.is_completed("b")
+    assert journal.get_metadata_hash("a") == "h"
+    # completed products with a hash are passed on to compare the hash with the one of the current metadata
+    products = [("a", None), ("b", None), ("c", None), ("d", None)]
+    assert list(journal.filter(products)) == [("a", None), ("b", None), ("c", None)]
+    assert journal.skipped == 1
+    assert journal.counts() == {STATUS_SUCCESS: 2, STATUS_FAILED: 1}
+
+    journal.record("a", STATUS_FAILED, error="broken")
+    assert not journal.is_completed("a")
+    journal.close()
+
+
+def test_run_batch_with_journal(tmp_path):
+    products = [
+        (create_local_product(tmp_path, OLCI_EFR_FILE), None),
+        (str(tmp_path / "missing.zarr"), None),
+    ]
+    path = str(tmp_path / "journal.db")
+
+    journal = BatchJournal(path)
+    results = run_batch(products=products, jobs=1, journal=journal)
+    assert len(results) == 2
+    journal.close()
+
+    # an interrupted run is continued with the products which have not been completed
+    products.append((create_local_product(tmp_path, SLSTR_LST_FILE), None))
+    journal = BatchJournal(path)
+    results = run_batch(products=products, jobs=2, journal=journal)
+    assert sorted(r.url for r in results) == sorted([products[1][0], products[2][0]])
+    assert journal.skipped == 1
+    journal.close()
+
+    connection = sqlite3.connect(path)
+    rows = connection.execute("SELECT url, status, item_id, metadata_hash FROM products ORDER BY url").fetchall()
+    connection.close()
+    assert len(rows) == 3
+    for url, status, item_id, metadata_hash in rows:
+        if url == products[1][0]:
+            assert (status, item_id, metadata_hash) == (STATUS_FAILED, None, None)
+        else:
+            assert status == STATUS_SUCCESS
+            assert item_id is not None
+            assert len(metadata_hash) == 64
+
+
+def test_run_batch_with_journal_and_writer(tmp_path):
+    products = [(create_local_product(tmp_path, OLCI_EFR_FILE), None)]
+    journal = BatchJournal(str(tmp_path / "journal.db"))
+    writer = NdjsonItemWriter(str(tmp_path / "items"))
+
+    results = run_batch(products=products, jobs=1, writer=writer, journal=journal)
+    assert results[0].status == STATUS_SUCCESS
+    assert journal.is_completed(products[0][0])
+    journal.close()
+
+
+def test_run_batch_with_journal_and_interrupted_writer(tmp_path, monkeypatch):
+    products = [
+        (create_local_product(tmp_path, OLCI_EFR_FILE), None),
+        (create_local_product(tmp_path, SLSTR_LST_FILE), None),
+    ]
+    journal = BatchJournal(str(tmp_path / "journal.db"))
+    writer = NdjsonItemWriter(str(tmp_path / "items"), max_items=1)
+
+    def close():
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(writer, "close", close)
+    with pytest.raises(RuntimeError):
+        run_batch(products=products, jobs=1, writer=writer, journal=journal)
+
+    # the item of the first file is recorded as soon as the file is complete, the pending one is not
+    assert journal.is_completed(products[0][0])
+    assert not journal.is_completed(products[1][0])
+    journal.close()
+
+
+def test_resume_with_ndjson_writer(tmp_path):
+    products = [
+        (create_local_product(tmp_path, OLCI_EFR_FILE), None),
+        (create_local_product(tmp_path, SLSTR_LST_FILE), None),
+    ]
+    path = str(tmp_path / "journal.db")
+    prefix = str(tmp_path / "out" / "items")
+
+    journal = BatchJournal(path)
+    run_batch(products=products, jobs=1, writer=NdjsonItemWriter(prefix), journal=journal)
+    journal.close()
+
+    # the second product is processed again, its item must not overwrite the file of the first run
+    connection = sqlite3.connect(path)
+    connection.execute("DELETE FROM products WHERE url = ?", (products[1][0],))
+    connection.commit()
+    connection.close()
+    journal = BatchJournal(path)
+    writer = NdjsonItemWriter(prefix)
+    run_batch(products=products, jobs=1, writer=writer, journal=journal)
+    assert journal.counts() == {STATUS_SUCCESS: 2}
+    journal.close()
+
+    assert [p.rsplit("/", 1)[-1] for p in writer.paths] == ["items-00001.ndjson"]
+    with open(f"{prefix}-00000.ndjson") as f:
+        assert len(f.read().splitlines()) == 2
+    with open(f"{prefix}-00001.ndjson") as f:
+        assert len(f.read().splitlines()) == 1
+
+
+def test_run_batch_with_journal_changed_metadata(tmp_path):
+    products = [(create_local_product(tmp_path, OLCI_EFR_FILE), None)]
+    journal = BatchJournal(str(tmp_path / "journal.db"))
+    run_batch(products=products, jobs=1, journal=journal)
+
+    # unchanged products are skipped, changed ones are processed again
+    assert run_batch(products=products, jobs=1, journal=journal) == []
+    assert journal.skipped == 1
+    zattrs_path = os.path.join(products[0][0], ".zattrs")
+    with open(zattrs_path) as f:
+        zattrs = json.load(f)
+    zattrs["other_metadata"]["history"] = "reprocessed"
+    with open(zattrs_path, "w") as f:
+        json.dump(zattrs, f)
+    results = run_batch(products=products, jobs=1, journal=journal)
+    assert [r.status for r in results] == [STATUS_SUCCESS]
+    assert journal.skipped == 1
+    journal.close()
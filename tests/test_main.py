@@ -0,0 +1,31 @@
+import json
+import sys
+
+import pytest
+
+from eopf_stac import main
+from tests.utils import create_local_product
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+
+
+def test_output_file(tmp_path, monkeypatch):
+    output_file = tmp_path / "item.json"
+    url = create_local_product(tmp_path, OLCI_EFR_FILE)
+    monkeypatch.setattr(sys, "argv", ["eopf-stac", url, "--output-file", str(output_file)])
+    main.main()
+
+    content = output_file.read_text()
+    assert content.startswith('{\n    "type": "Feature"')
+    assert json.loads(content)["id"] == "S03OLCEFR_20250416T063751_0180_B248_T853"
+
+
+@pytest.mark.parametrize(
+    "options",
+    [["s3://bucket/product.zarr"], ["--queue", "queue.db", "--daemon"], ["--queue", "queue.db", "--manifest", "a"]],
+)
+def test_cdse_verify_requires_batch_mode(options, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["eopf-stac", "--cdse-verify", "0.1", *options])
+    with pytest.raises(SystemExit) as e:
+        main.main()
+    assert e.value.code == 2
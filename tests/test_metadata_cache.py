@@ -0,0 +1,83 @@
+import os
+import pickle
+
+from eopf_stac.common.metadata import LazyMetadata
+from eopf_stac.io import read_metadata
+from eopf_stac.metadata_cache import MetadataCache, open_metadata_cache
+from tests.utils import create_local_product
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+
+
+class TestMetadataCache:
+    def test_open(self, tmp_path):
+        href = str(tmp_path / "a.json")
+        with open(href, "w") as f:
+            f.write("a")
+
+        cache = MetadataCache(str(tmp_path / "cache"))
+        for _ in range(2):
+            with cache.open(href) as f:
+                assert f.read() == b"a"
+        assert cache.stats() == {"hits": 1, "misses": 1}
+
+        # changed objects are downloaded again
+        with open(href, "w") as f:
+            f.write("bb")
+        with cache.open(href) as f:
+            assert f.read() == b"bb"
+        assert cache.stats() == {"hits": 1, "misses": 2}
+
+    def test_evict(self, tmp_path):
+        cache = MetadataCache(str(tmp_path / "cache"), max_size=10)
+        for name in ["a", "b", "c"]:
+            href = str(tmp_path / name)
+            with open(href, "w") as f:
+                f.write(name * 4)
+            cache.open(href).close()
+
+        # the least recently used document is evicted
+        files = [name for _, _, names in os.walk(cache.path) for name in names if len(name) == 64]
+        assert len(files) == 2
+        cache.open(str(tmp_path / "a")).close()
+        assert cache.stats() == {"hits": 0, "misses": 4}
+
+    def test_total_size(self, tmp_path, monkeypatch):
+        cache = MetadataCache(str(tmp_path / "cache"), max_size=10)
+        evictions = []
+        evict = cache._evict
+        monkeypatch.setattr(cache, "_evict", lambda: evictions.append(cache._size) or evict())
+
+        # documents are only scanned for eviction once the total size exceeds the limit
+        for name in ["a", "b", "c"]:
+            href = str(tmp_path / name)
+            with open(href, "w") as f:
+                f.write(name * 4)
+            cache.open(href).close()
+            cache.open(href).close()
+        assert evictions == [12]
+        assert cache._size == 8
+
+        # replaced documents no longer count
+        with open(str(tmp_path / "c"), "w") as f:
+            f.write("c")
+        cache.open(str(tmp_path / "c")).close()
+        assert cache._size == 5
+        cache.close()
+        assert MetadataCache(cache.path, max_size=10)._size == 5
+
+    def test_pickle(self, tmp_path):
+        cache = open_metadata_cache(str(tmp_path / "cache"))
+        assert pickle.loads(pickle.dumps(cache)) is cache
+
+
+def test_read_metadata_with_cache(tmp_path):
+    url = create_local_product(tmp_path, OLCI_EFR_FILE)
+    cache = MetadataCache(str(tmp_path / "cache"))
+
+    expected = dict(read_metadata(url))
+    for _ in range(2):
+        metadata = read_metadata(url, metadata_cache=cache)
+        assert isinstance(metadata, LazyMetadata)
+        assert dict(metadata) == expected
+    assert cache.stats() == {"hits": 2, "misses": 2}
@@ -0,0 +1,76 @@
+import sqlite3
+
+from eopf_stac.worker import (
+    STATUS_DONE,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+    WORKER_DIED_ERROR,
+    IngestionWorker,
+    WorkQueue,
+)
+from tests.utils import create_local_product
+
+OLCI_EFR_FILE = "S03OLCEFR_20250416T063751_0180_B248_T853.json"
+
+
+class TestWorkQueue:
+    def test_claim(self, tmp_path):
+        queue = WorkQueue(str(tmp_path / "queue.db"))
+        id1 = queue.enqueue("s3://bucket/product1.zarr", "S2B_MSIL1C_source")
+        id2 = queue.enqueue("s3://bucket/product2.zarr")
+
+        assert queue.claim() == (id1, "s3://bucket/product1.zarr", "S2B_MSIL1C_source")
+        assert queue.claim() == (id2, "s3://bucket/product2.zarr", None)
+        assert queue.claim() is None
+
+        queue.complete(id1, "product1")
+        queue.fail(id2, "error")
+        assert queue.counts() == {STATUS_DONE: 1, STATUS_QUEUED: 1}
+
+    def test_max_attempts(self, tmp_path):
+        queue = WorkQueue(str(tmp_path / "queue.db"), max_attempts=2)
+        entry_id = queue.enqueue("s3://bucket/product.zarr")
+        for _ in range(2):
+            assert queue.claim()[0] == entry_id
+            queue.fail(entry_id, "error")
+        assert queue.claim() is None
+        assert queue.counts() == {STATUS_FAILED: 1}
+
+    def test_visibility_timeout(self, tmp_path):
+        queue = WorkQueue(str(tmp_path / "queue.db"), visibility_timeout=0)
+        entry_id = queue.enqueue("s3://bucket/product.zarr")
+        assert queue.claim()[0] == entry_id
+        # entry was claimed but never finished
+        assert queue.claim()[0] == entry_id
+
+    def test_visibility_timeout_max_attempts(self, tmp_path):
+        path = str(tmp_path / "queue.db")
+        queue = WorkQueue(path, visibility_timeout=0, max_attempts=2)
+        entry_id = queue.enqueue("s3://bucket/product.zarr")
+        assert queue.claim()[0] == entry_id
+        assert queue.claim()[0] == entry_id
+        # the last attempt was claimed but never finished either
+        assert queue.claim() is None
+        assert queue.counts() == {STATUS_FAILED: 1}
+        queue.close()
+
+        connection = sqlite3.connect(path)
+        assert connection.execute("SELECT error FROM queue").fetchone() == (WORKER_DIED_ERROR,)
+        connection.close()
+
+    def test_durable(self, tmp_path):
+        path = str(tmp_path / "queue.db")
+        queue = WorkQueue(path)
+        queue.enqueue("s3://bucket/product.zarr")
+        queue.close()
+        assert WorkQueue(path).counts() == {STATUS_QUEUED: 1}
+
+
+def test_worker(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"), max_attempts=1)
+    queue.enqueue(create_local_product(tmp_path, OLCI_EFR_FILE))
+    queue.enqueue(str(tmp_path / "missing.zarr"))
+
+    worker = IngestionWorker(queue=queue, stac_api_url=None)
+    worker.run(exit_when_empty=True)
+    assert queue.counts() == {STATUS_DONE: 1, STATUS_FAILED: 1}
@@ -3,6 +3,7 @@ import os
 
 import fsspec
 import pystac
+import zarr
 from pystac.utils import datetime_to_str
 
 from eopf_stac.common.constants import (
@@ -174,3 +175,38 @@ def check_metadata_asset(item: pystac.Item, url: str):
 def check_zipped_product_asset(item: pystac.Item):
     zipped_product = item.assets[ZIPPED_PRODUCT_ASSET_KEY]
     assert zipped_product.href.endswith(".zip")
+
+
+def create_local_product(base_dir, data_file: str, cpm_dir: str = "cpm_v262", root_attributes: bool = True) -> str:
+    """Creates a minimal local EOPF product from a consolidated metadata file in tests/data-files"""
+    eopf_id = os.path.splitext(data_file)[0]
+    product_dir = os.path.join(base_dir, cpm_dir, f"{eopf_id}.zarr")
+    os.makedirs(product_dir, exist_ok=True)
+    data_file_path = os.path.join(os.path.dirname(__file__), "data-files", data_file)
+    with open(data_file_path, mode="rb") as src, open(os.path.join(product_dir, PRODUCT_METADATA_PATH), "wb") as dst:
+        data = src.read()
+        dst.write(data)
+    if root_attributes:
+        with open(os.path.join(product_dir, ".zattrs"), mode="w", encoding="utf-8") as dst:
+            json.dump(json.loads(data)["metadata"][".zattrs"], dst)
+    return product_dir
+
+
+def create_local_product_v3(base_dir, data_file: str, cpm_dir: str = "cpm_v262") -> str:
+    """Creates a local Zarr v3 EOPF product with consolidated metadata from a file in tests/data-files"""
+    eopf_id = os.path.splitext(data_file)[0]
+    product_dir = os.path.join(base_dir, cpm_dir, f"{eopf_id}.zarr")
+    with open(os.path.join(os.path.dirname(__file__), "data-files", data_file), mode="rb") as f:
+        metadata = json.load(f)["metadata"]
+
+    root = zarr.open_group(product_dir, mode="w", zarr_format=3, attributes=metadata[".zattrs"])
+    for key in sorted(metadata):
+        path, name = os.path.split(key)
+        attributes = metadata.get(f"{path}/.zattrs", {})
+        if name == ".zgroup" and path != "":
+            root.create_group(path, attributes=attributes)
+        elif name == ".zarray":
+            zarray = metadata[key]
+            root.create_array(path, shape=zarray["shape"], dtype="f4", attributes=attributes)
+    zarr.consolidate_metadata(product_dir)
+    return product_dir